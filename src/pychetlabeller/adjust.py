@@ -0,0 +1,80 @@
+"""
+Brightness and contrast adjustment of 8-bit image buffers.
+Both adjustments together are a single 256-entry mapping, so they are applied
+as a lookup table rather than with float arithmetic over the whole image.
+Large images are split into row bands mapped on a thread pool - np.take and the
+alpha copy release the GIL, so the bands run on separate cores.
+"""
+
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+PIXELS_PER_WORKER = 2 * 10 ** 6 # smaller images are not worth handing to the pool
+MAX_WORKERS = multiprocessing.cpu_count()
+
+_pool = None # ThreadPool of MAX_WORKERS threads, started on first use
+_pool_lock = threading.Lock()
+
+def brightness_contrast_lut(brightness=0, contrast=0):
+    '''uint8 table of clip(clip(v * (1 + contrast/100), 0, 255) + brightness, 0, 255) for v in 0..255
+    - the same formula (and truncation) as the original float implementation'''
+    values = np.clip(np.arange(256) * (1 + contrast / 100.), 0, 255)
+    return np.clip(values + brightness, 0, 255).astype(np.uint8)
+
+def pair_lut(lut):
+    '''65536-entry uint16 table mapping two packed bytes through lut at once'''
+    lut = np.asarray(lut, np.uint8)
+    return ((lut.astype(np.uint16)[:, None] << 8) | lut[None, :]).reshape(-1)
+
+def apply_lut(pixels, lut, out=None, pairs=None):
+    '''map the colour channels of (h, w, 4) uint8 pixels through lut, leaving alpha untouched
+    Writes into out (default: in place) and returns it. Rows must be contiguous.
+    pairs is pair_lut(lut), if already built.'''
+    out = pixels if out is None else out
+    alpha = None if out is pixels else pixels[..., 3]
+    if pixels.flags.c_contiguous and out.flags.c_contiguous and pixels.nbytes % 2 == 0:
+        if out is pixels:
+            alpha = pixels[..., 3].copy()
+        # Map two bytes per lookup through the 16-bit table, then put alpha back
+        np.take(pair_lut(lut) if pairs is None else pairs, pixels.reshape(-1).view(np.uint16),
+                out=out.reshape(-1).view(np.uint16), mode='clip')
+        out[..., 3] = alpha
+    else:
+        np.take(lut, pixels[..., :3], out=out[..., :3], mode='clip')
+        if alpha is not None:
+            out[..., 3] = alpha
+    return out
+
+def adjust_workers(pixels):
+    '''threads worth using for an image of this many pixels'''
+    return max(1, min(MAX_WORKERS, pixels // PIXELS_PER_WORKER))
+
+def thread_pool():
+    '''the shared pool, one thread per core - it is never closed, as several threads
+    (e.g. the adjustment pipeline and the tiles) may be mapping on it at once'''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(MAX_WORKERS)
+        return _pool
+
+def apply_lut_tiled(pixels, lut, out=None, workers=None):
+    '''apply_lut over row bands on a thread pool, writing into out (default: in place)
+    workers (the number of bands) defaults to adjust_workers of the image size; 1 maps the
+    image on this thread. At most MAX_WORKERS bands run at once.'''
+    out = pixels if out is None else out
+    if workers is None:
+        workers = adjust_workers(pixels.shape[0] * pixels.shape[1])
+    if workers <= 1 or len(pixels) < 2 * workers:
+        return apply_lut(pixels, lut, out=out)
+    pairs = pair_lut(lut)
+    bounds = np.linspace(0, len(pixels), workers + 1).astype(int)
+    in_place = out is pixels
+    def band(rows):
+        start, stop = rows
+        # a band of out is a new view, so say in place explicitly for apply_lut to keep alpha
+        apply_lut(pixels[start:stop], lut, out=None if in_place else out[start:stop], pairs=pairs)
+    thread_pool().map(band, zip(bounds[:-1], bounds[1:]), chunksize=1)
+    return out
@@ -0,0 +1,67 @@
+"""
+Item model of the annotations of the current image.
+The model reads straight from the LabelDataset: it only keeps the shape ids in
+row order, cells are formatted when a view asks for them, and adding or removing
+a shape inserts or removes a single row instead of rebuilding the list.
+"""
+
+import bisect
+from PyQt4 import QtCore
+
+class AnnotationModel(QtCore.QAbstractItemModel):
+    '''Flat table of the shapes of a LabelDataset, one row per shape in id order'''
+    headers = ('Item', 'Location', 'Size', 'Label ID', 'Label Name')
+    def __init__(self, parent=None):
+        QtCore.QAbstractItemModel.__init__(self, parent)
+        self.dataset = None
+        self.ids = [] # shape id of each row, ascending
+    def setDataset(self, dataset):
+        '''show the shapes of dataset'''
+        self.beginResetModel()
+        self.dataset = dataset
+        self.ids = sorted(dataset.ids()) if dataset is not None else []
+        self.endResetModel()
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self.ids) and 0 <= column < len(self.headers)):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+    def parent(self, index):
+        return QtCore.QModelIndex()
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.headers)
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return QtCore.QVariant()
+        return QtCore.QVariant(self.datum(index).column_text(index.column()))
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return QtCore.QVariant(self.headers[section])
+        return QtCore.QVariant()
+    def datum(self, index):
+        '''the LabelShape of a row, or None'''
+        if not index.isValid():
+            return None
+        return self.dataset.find(self.ids[index.row()])
+    def row(self, datum):
+        '''row of a LabelShape, or -1'''
+        row = bisect.bisect_left(self.ids, datum.id)
+        return row if row < len(self.ids) and self.ids[row] == datum.id else -1
+    def indexOf(self, datum):
+        '''model index of the first column of a LabelShape's row'''
+        return self.index(self.row(datum), 0)
+    def added(self, datum):
+        '''insert the row of a LabelShape just added to the dataset'''
+        row = bisect.bisect_left(self.ids, datum.id)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.ids.insert(row, datum.id)
+        self.endInsertRows()
+    def removed(self, datum):
+        '''remove the row of a LabelShape about to be removed from the dataset'''
+        row = self.row(datum)
+        if row < 0:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.ids[row]
+        self.endRemoveRows()
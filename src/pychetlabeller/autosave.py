@@ -0,0 +1,88 @@
+"""
+Background saving of annotations.
+Autosave on navigation hands a snapshot of the dataset to a worker thread, so the
+next image loads without waiting on the disk. Each file is written under a
+temporary name and renamed over the old one, repeated saves of the same image are
+merged into the newest (which then also runs the callbacks of the saves it replaced),
+and each write is reported back on the GUI thread as saved() or failed(). The
+callbacks of a save that failed, and of the saves it replaced, are not run.
+"""
+
+import threading
+from collections import OrderedDict
+from PyQt4 import QtCore
+
+from .profiling import profiler
+
+def chain(first, second):
+    '''call first() then second(), skipping either if None'''
+    def both():
+        first()
+        if second is not None:
+            second()
+    return both
+
+class AutosaveWriter(QtCore.QObject):
+    '''Writes dataset snapshots on a worker thread - the newest snapshot per label file wins'''
+    def __init__(self, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.pending = OrderedDict() # label basename -> (dataset snapshot, done), oldest first
+        self.writing = None # label basename being written by the worker
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self.work, name='AutosaveWriter')
+        self.worker.daemon = True
+        self.worker.start()
+    def submit(self, label_basename, snapshot, done=None):
+        '''queue snapshot.save(label_basename), replacing a queued save of the same file
+        done() is called on the worker thread once the files are written'''
+        with self.condition:
+            _, replaced = self.pending.pop(label_basename, (None, None))
+            if replaced is not None: # the newer snapshot holds everything the replaced one did
+                done = chain(replaced, done)
+            self.pending[label_basename] = (snapshot, done)
+            self.condition.notify_all()
+    def busy(self, label_basename=None):
+        '''True if label_basename (default: any file) is queued or being written (lock held)'''
+        if label_basename is None:
+            return bool(self.pending) or self.writing is not None
+        return label_basename in self.pending or self.writing == label_basename
+    def queued(self, label_basename):
+        '''True if a save of label_basename is queued or being written'''
+        with self.condition:
+            return self.busy(label_basename)
+    def flush(self, label_basename=None):
+        '''block until the queued saves of label_basename (default: all) are on disk'''
+        with self.condition:
+            while self.busy(label_basename):
+                self.condition.wait()
+    def discard(self, label_basename):
+        '''drop a queued save superseded by a synchronous one, waiting for one in flight'''
+        with self.condition:
+            self.pending.pop(label_basename, None)
+            while self.writing == label_basename:
+                self.condition.wait()
+    @profiler.timed('AutosaveWriter.write')
+    def write(self, label_basename, snapshot):
+        '''write the label files of a snapshot, each under a temporary name first'''
+        snapshot.saveSVG(label_basename + '.svg')
+        snapshot.saveCSV(label_basename + '.csv')
+    def work(self):
+        '''worker thread: write the oldest queued snapshot, then emit saved(PyQt_PyObject) with
+        (label basename, snapshot), or failed(PyQt_PyObject) with (label basename, error)'''
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                label_basename, (snapshot, done) = self.pending.popitem(last=False)
+                self.writing = label_basename
+            try:
+                self.write(label_basename, snapshot)
+                if done is not None:
+                    done()
+                self.emit(QtCore.SIGNAL('saved(PyQt_PyObject)'), (label_basename, snapshot))
+            except Exception as error:
+                self.emit(QtCore.SIGNAL('failed(PyQt_PyObject)'), (label_basename, error))
+            finally:
+                with self.condition:
+                    self.writing = None
+                    self.condition.notify_all()
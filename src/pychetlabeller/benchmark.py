@@ -0,0 +1,538 @@
+#! /usr/bin/python
+"""
+Benchmarks for the labeller hot paths.
+Run the suite with: python -m pychetlabeller.benchmark [--output results.json] [--compare baseline.json]
+It times LabelDataset load/save/saveSVG/data_at/find over synthetic label files of
+10 to 100k shapes, the QImage conversions and adjustPixmap over synthetic images of
+several sizes, and MainWindow.loadImage, populateTree and painting. Results are
+written as JSON, and --compare flags cases slower than a stored baseline. Removing
+10k shapes one by one also has a fixed time budget, failing the run when exceeded.
+Every run also imports the Qt-free modules in a fresh interpreter, timing the import
+and failing if it loaded Qt, NumPy, svgwrite, shapely or simplejson.
+Qt 5 builds run headless with QT_QPA_PLATFORM=offscreen (set by default); Qt 4 needs
+a display, so use xvfb-run on a headless machine (or --no-gui for the Qt-free cases).
+--comparisons runs the old-versus-new implementation comparisons instead.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import tempfile
+import timeit
+from collections import OrderedDict
+import numpy as np
+
+from .dataset import LabelDataset, LabelCircle, LabelRectangle
+from .adjust import brightness_contrast_lut, apply_lut, apply_lut_tiled, adjust_workers
+
+def random_circles(count, radius=20, area_per_shape=50 * 50, seed=0, size=None):
+    '''generate (x, y, r) rows for count circles at a constant density
+    - the image grows with the shape count so hits per query stay comparable
+    - unless an image size (width, height) is given'''
+    rng = np.random.RandomState(seed)
+    if size is None:
+        side = np.sqrt(count * area_per_shape)
+        size = (side, side)
+    xy = rng.uniform(0, 1, size=(count, 2)) * size
+    return [(x, y, radius) for x, y in xy], size
+
+def circle_dataset(count, seed=0, columnar=False):
+    '''return a LabelDataset populated with count random circles'''
+    rows, size = random_circles(count, seed=seed)
+    dataset = LabelDataset('benchmark', image_size=size, columnar=columnar)
+    for x, y, r in rows:
+        if columnar:
+            dataset.add_row('circle', (x, y, r), 1)
+        else:
+            dataset.add(LabelCircle(1, x, y, r))
+    return dataset
+
+def mixed_dataset(count, seed=0, columnar=False):
+    '''return a LabelDataset of count random circles and rectangles over several labels'''
+    rows, size = random_circles(count, seed=seed)
+    dataset = LabelDataset('benchmark', image_size=size, columnar=columnar)
+    for i, (x, y, r) in enumerate(rows):
+        label = i % 5
+        if i % 2:
+            dataset.add(LabelRectangle(label, x - r, y - r, 2 * r, r))
+        else:
+            dataset.add(LabelCircle(label, x, y, r))
+    return dataset
+
+def deep_sizeof(obj, seen=None):
+    '''approximate bytes held by obj and everything it references'''
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, dict):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+def bench_data_at(counts=(100, 1000, 5000, 10000, 50000), queries=1000, seed=0):
+    '''time LabelDataset.data_at point queries against the number of shapes'''
+    results = []
+    rng = np.random.RandomState(seed + 1)
+    for count in counts:
+        dataset = circle_dataset(count, seed=seed)
+        points = rng.uniform(0, dataset.image_size[0], size=(queries, 2))
+        def run():
+            for point in points:
+                dataset.data_at(point)
+        seconds = min(timeit.repeat(run, number=1, repeat=3)) / queries
+        results.append((count, seconds))
+        print('data_at: {:>6d} shapes {:>8.1f} us/query'.format(count, seconds * 1e6))
+    return results
+
+REMOVE_BUDGET = 1.0 # seconds to find and remove 10k shapes one by one - a linear find or remove takes far longer
+
+def remove_all(dataset):
+    '''find and remove every annotation one by one, newest first'''
+    for shape_id in reversed(dataset.ids()):
+        dataset.remove(dataset.find(shape_id))
+    assert not len(dataset)
+
+def bench_remove(count=10000, seed=0, budget=REMOVE_BUDGET):
+    '''time finding and removing every annotation one by one, failing if it takes longer than budget'''
+    for columnar in (False, True):
+        dataset = circle_dataset(count, seed=seed, columnar=columnar)
+        seconds = timeit.timeit(lambda: remove_all(dataset), number=1)
+        mode = 'columnar' if columnar else 'objects'
+        print('find+remove: {:>8s} {:>6d} shapes {:>8.1f} ms total'.format(mode, count, seconds * 1e3))
+        assert seconds <= budget * count / 10000., 'removing {} shapes took {:.2f} s'.format(count, seconds)
+    return seconds
+
+def bench_storage(count=20000, seed=0):
+    '''compare construction time and memory of object and columnar LabelDatasets'''
+    results = {}
+    for columnar in (True, False):
+        start = timeit.default_timer()
+        dataset = circle_dataset(count, seed=seed, columnar=columnar)
+        seconds = timeit.default_timer() - start
+        megabytes = deep_sizeof(dataset) / 1e6
+        mode = 'columnar' if columnar else 'objects'
+        results[mode] = (seconds, megabytes)
+        print('storage: {:>8s} {:>6d} shapes {:>8.1f} ms {:>8.1f} MB'.format(
+            mode, count, seconds * 1e3, megabytes))
+        del dataset
+    return results
+
+def save_svgwrite(dataset, output_filename):
+    '''the original svgwrite implementation of LabelDataset.saveSVG, for comparison'''
+    import svgwrite
+    dwg = svgwrite.Drawing(output_filename, profile='tiny', size=dataset.image_size)
+    for datum in dataset:
+        dwg.add(datum.svg_shape())
+    dwg.save()
+
+def bench_svg(counts=(1000, 20000), seed=0):
+    '''time svgwrite and streamed SVG saving, checking the files are identical'''
+    results = []
+    folder = tempfile.mkdtemp()
+    try:
+        for columnar in (False, True):
+            for count in counts:
+                dataset = mixed_dataset(count, seed=seed, columnar=columnar)
+                reference, streamed = os.path.join(folder, 'svgwrite.svg'), os.path.join(folder, 'stream.svg')
+                svgwrite_seconds = min(timeit.repeat(lambda: save_svgwrite(dataset, reference), number=1, repeat=3))
+                stream_seconds = min(timeit.repeat(lambda: dataset.saveSVG(streamed), number=1, repeat=3))
+                assert open(reference, 'rb').read() == open(streamed, 'rb').read()
+                mode = 'columnar' if columnar else 'objects'
+                results.append((mode, count, svgwrite_seconds, stream_seconds))
+                print('saveSVG: {:>8s} {:>6d} shapes svgwrite {:>8.1f} ms  stream {:>8.1f} ms'.format(
+                    mode, count, svgwrite_seconds * 1e3, stream_seconds * 1e3))
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+def load_csv_reader(dataset, label_path, tool='circle'):
+    '''the original row by row implementation of LabelDataset.load, for comparison'''
+    with open(label_path) as label_file:
+        for line in csv.reader(label_file):
+            try:
+                if tool == 'circle':
+                    dataset.add_row(tool, (float(line[1]), float(line[2]), float(line[3])), int(line[4]))
+                else:
+                    dataset.add_row(tool, (float(line[1]), float(line[2]), float(line[3]), float(line[4])), int(line[5]))
+            except (ValueError, KeyError):
+                pass
+
+def bench_load(counts=(1000, 20000), seed=0):
+    '''time loading a headerless circle file row by row and with the array parser'''
+    results = []
+    folder = tempfile.mkdtemp()
+    label_path = os.path.join(folder, 'labels.csv')
+    try:
+        for columnar in (False, True):
+            for count in counts:
+                rows, size = random_circles(count, seed=seed)
+                with open(label_path, 'w') as f:
+                    f.writelines('%d,%s,%s,%s,1\n' % ((i,) + row) for i, row in enumerate(rows))
+                def load(loader):
+                    dataset = LabelDataset('benchmark', image_size=size, columnar=columnar)
+                    loader(dataset, label_path)
+                    assert len(dataset) == count
+                csv_seconds = min(timeit.repeat(lambda: load(load_csv_reader), number=1, repeat=3))
+                array_seconds = min(timeit.repeat(lambda: load(LabelDataset.load), number=1, repeat=3))
+                mode = 'columnar' if columnar else 'objects'
+                results.append((mode, count, csv_seconds, array_seconds))
+                print('load: {:>8s} {:>6d} shapes csv {:>8.1f} ms  arrays {:>8.1f} ms'.format(
+                    mode, count, csv_seconds * 1e3, array_seconds * 1e3))
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+def random_pixels(width, height, seed=0):
+    '''(height, width, 4) uint8 BGRA buffer with opaque alpha'''
+    pixels = np.random.RandomState(seed).randint(0, 256, size=(height, width, 4)).astype(np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+def adjust_float(pixels, brightness=0, contrast=0):
+    '''the original float implementation of adjustPixmap, for comparison'''
+    adjusted = np.clip(pixels * (1 + contrast / 100.), 0, 255)
+    return np.clip(adjusted + brightness, 0, 255).astype('uint8')
+
+def bench_adjust(sizes=((640, 480), (1920, 1080), (4000, 3000), (6000, 4000)), brightness=-20, contrast=30):
+    '''time the float and lookup-table brightness/contrast paths across image sizes'''
+    results = []
+    for width, height in sizes:
+        pixels = random_pixels(width, height)
+        out = np.empty_like(pixels)
+        lut = brightness_contrast_lut(brightness, contrast)
+        float_seconds = min(timeit.repeat(lambda: adjust_float(pixels, brightness, contrast), number=1, repeat=3))
+        lut_seconds = min(timeit.repeat(lambda: apply_lut(pixels, lut, out=out), number=1, repeat=3))
+        assert (out[..., :3] == adjust_float(pixels, brightness, contrast)[..., :3]).all()
+        assert (out[..., 3] == pixels[..., 3]).all()
+        results.append(((width, height), float_seconds, lut_seconds))
+        print('adjust: {:>5d}x{:<5d} float {:>8.1f} ms  lut {:>8.1f} ms'.format(
+            width, height, float_seconds * 1e3, lut_seconds * 1e3))
+    return results
+
+def bench_frame(counts=(0, 1000, 5000, 20000), frames=100, size=(2000, 1500)):
+    '''time cursor-motion frames (tool move + repaint) against the number of annotations'''
+    from PyQt4 import QtGui, QtCore
+    from . import labeller
+    from .labelmap import parse_labelmap
+    app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv)
+    window = labeller.MainWindow()
+    window.labelmap = parse_labelmap()
+    window.ui.autoload_chk.setChecked(False)
+    window.show()
+    folder = tempfile.mkdtemp()
+    image_path = os.path.join(folder, 'frame.png')
+    image = QtGui.QImage(size[0], size[1], QtGui.QImage.Format_RGB32)
+    image.fill(0xff808080)
+    image.save(image_path)
+    results = []
+    try:
+        for count in counts:
+            window.loadImage(image_path)
+            rows, _ = random_circles(count, size=size)
+            for x, y, r in rows:
+                labeller.label_dataset.add(LabelCircle(1, x, y, r))
+            panel = window.imagePanel
+            panel.invalidate()
+            def frame(i):
+                panel.tool.mouse_move(panel, QtCore.QPointF(100 + i % 500, 100 + i % 500))
+                panel.refresh_tool()
+                app.processEvents()
+            frame(0) # fills the annotation cache
+            seconds = min(timeit.repeat(lambda: [frame(i) for i in range(frames)], number=1, repeat=3)) / frames
+            results.append((count, seconds))
+            print('frame: {:>6d} annotations {:>8.2f} ms/frame'.format(count, seconds * 1e3))
+    finally:
+        window.close()
+        shutil.rmtree(folder)
+    return results
+
+SHAPE_COUNTS = (10, 1000, 10000, 100000)
+IMAGE_SIZES = ((640, 480), (1920, 1080), (6000, 4000))
+LARGE_IMAGE_SIZES = ((6000, 4000), (8192, 6144)) # 24 and 50 MP
+WORKER_COUNTS = (1, 2, 4, 8)
+
+def qt_application():
+    '''the QApplication, created headless where the Qt platform plugins allow it'''
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen') # Qt 5 - Qt 4 needs xvfb-run
+    from PyQt4 import QtGui
+    return QtGui.QApplication.instance() or QtGui.QApplication(sys.argv)
+
+def synthetic_labels(label_basename, count, seed=0):
+    '''write label files of count mixed circles and rectangles, returning the image size they cover'''
+    dataset = mixed_dataset(count, seed=seed)
+    dataset.save(label_basename)
+    return dataset.image_size
+
+def synthetic_image(path, width, height, seed=0, block=16):
+    '''write an image of random blocks - compressible like a photo, unlike pixel noise'''
+    from .qtimage import convertMattoQImage
+    blocks = random_pixels(width // block + 1, height // block + 1, seed=seed)
+    pixels = np.ascontiguousarray(blocks.repeat(block, axis=0).repeat(block, axis=1)[:height, :width])
+    convertMattoQImage(pixels, copy=True).save(path)
+    return path
+
+# Modules that must import without the heavy dependencies, which load on first use
+LIGHT_MODULES = ('pychetlabeller.dataset', 'pychetlabeller.labelfile', 'pychetlabeller.journal')
+HEAVY_MODULES = ('PyQt4', 'numpy', 'svgwrite', 'shapely', 'simplejson')
+
+IMPORT_SCRIPT = '''
+import sys, json, timeit
+start = timeit.default_timer()
+import %s
+seconds = timeit.default_timer() - start
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in %r if name in sys.modules]}))
+'''
+
+def time_import(module, heavy=HEAVY_MODULES):
+    '''(seconds, heavy modules loaded) of importing module in a fresh interpreter'''
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT % (module, heavy)], env=env)
+    result = json.loads(output.splitlines()[-1])
+    return result['seconds'], result['loaded']
+
+class Suite(object):
+    '''Timed cases of the benchmark suite, named stage/variant/size'''
+    def __init__(self, repeat=3, pattern=None):
+        self.repeat = repeat
+        self.pattern = pattern # only run cases whose name contains this
+        self.results = OrderedDict() # name -> seconds per call
+        self.over_budget = [] # names of cases slower than their time budget
+    def wants(self, name):
+        return self.pattern is None or self.pattern in name
+    def time(self, name, run, number=1, setup=None, budget=None):
+        '''record the best of repeat timings of number calls of run (after setup, untimed)
+        A case whose best call takes longer than budget seconds fails the run.'''
+        if not self.wants(name):
+            return
+        best = None
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            start = timeit.default_timer()
+            for _ in range(number):
+                run()
+            seconds = (timeit.default_timer() - start) / number
+            best = seconds if best is None else min(best, seconds)
+        self.results[name] = best
+        over = budget is not None and best > budget
+        if over:
+            self.over_budget.append(name)
+        print('{:<48s} {:>12.3f} ms{}'.format(name, best * 1e3, '  OVER BUDGET' if over else ''))
+
+def suite_imports(suite, modules=LIGHT_MODULES):
+    '''import time of the Qt-free modules, returning {module: heavy modules it loaded}'''
+    violations = {}
+    for module in modules:
+        name = 'import/' + module
+        if not suite.wants(name):
+            continue
+        timings = [time_import(module) for _ in range(suite.repeat)]
+        suite.results[name] = min(seconds for seconds, _ in timings)
+        print('{:<48s} {:>12.3f} ms'.format(name, suite.results[name] * 1e3))
+        loaded = timings[-1][1]
+        if loaded:
+            violations[module] = loaded
+            print('{} imported {}'.format(module, ', '.join(loaded)))
+    return violations
+
+def suite_dataset(suite, folder, counts=SHAPE_COUNTS, queries=1000, seed=0):
+    '''LabelDataset load, save, saveSVG, data_at and find in both storage modes'''
+    rng = np.random.RandomState(seed + 1)
+    for count in counts:
+        label_basename = os.path.join(folder, 'labels_%d' % count)
+        size = synthetic_labels(label_basename, count, seed=seed)
+        points = rng.uniform(0, 1, size=(queries, 2)) * size
+        for columnar in (False, True):
+            mode = 'columnar' if columnar else 'objects'
+            def load():
+                dataset = LabelDataset('benchmark', image_size=size, columnar=columnar)
+                dataset.load(label_basename + '.csv')
+                return dataset
+            suite.time('LabelDataset.load/%s/%d' % (mode, count), load)
+            dataset = load()
+            output = os.path.join(folder, 'output')
+            suite.time('LabelDataset.save/%s/%d' % (mode, count), lambda: dataset.save(output))
+            suite.time('LabelDataset.saveSVG/%s/%d' % (mode, count), lambda: dataset.saveSVG(output + '.svg'))
+            suite.time('LabelDataset.data_at/%s/%d' % (mode, count),
+                       lambda: [dataset.data_at(point) for point in points], number=1)
+            ids = rng.choice(dataset.ids(), size=queries)
+            suite.time('LabelDataset.find/%s/%d' % (mode, count),
+                       lambda: [dataset.find(shape_id) for shape_id in ids], number=1)
+            if count == 10000:
+                suite.time('LabelDataset.remove/%s/%d' % (mode, count), lambda: remove_all(dataset),
+                           setup=lambda: dataset.load(label_basename + '.csv'), budget=REMOVE_BUDGET)
+
+def suite_adjust(suite, sizes=LARGE_IMAGE_SIZES, workers=WORKER_COUNTS, brightness=-20, contrast=30):
+    '''scaling of the banded brightness/contrast mapping with the number of bands (run on
+    up to one thread per core)'''
+    lut = brightness_contrast_lut(brightness, contrast)
+    for width, height in sizes:
+        pixels = random_pixels(width, height)
+        out = np.empty_like(pixels)
+        reference = apply_lut(pixels, lut, out=np.empty_like(pixels))
+        for count in workers:
+            name = 'apply_lut_tiled/%dx%d/%d' % (width, height, count)
+            if suite.wants(name):
+                out[...] = 0
+                suite.time(name, lambda: apply_lut_tiled(pixels, lut, out=out, workers=count))
+                assert (out == reference).all()
+        suite.time('apply_lut_tiled/%dx%d/auto' % (width, height), lambda: apply_lut_tiled(pixels, lut, out=out))
+
+def suite_image(suite, folder, sizes=IMAGE_SIZES):
+    '''QImage/NumPy conversions and adjustPixmap'''
+    from PyQt4 import QtGui
+    from .qtimage import convertQImageToMat, convertMattoQImage, adjustPixmap
+    from .imagecache import decodeImage
+    qt_application()
+    for width, height in sizes:
+        name = '%dx%d' % (width, height)
+        image = decodeImage(synthetic_image(os.path.join(folder, name + '.png'), width, height))
+        jpeg = synthetic_image(os.path.join(folder, name + '.jpg'), width, height)
+        suite.time('decodeImage/full/' + name, lambda: decodeImage(jpeg))
+        suite.time('decodeImage/fit1920x1080/' + name, lambda: decodeImage(jpeg, max_size=(1920, 1080)))
+        pixmap = QtGui.QPixmap.fromImage(image)
+        mat = convertQImageToMat(image, copy=True) # an array of our own, not a view of image
+        suite.time('adjustPixmap/' + name, lambda: adjustPixmap(pixmap, brightness=-20, contrast=30))
+        suite.time('convertQImageToMat/view/' + name, lambda: convertQImageToMat(image))
+        suite.time('convertQImageToMat/copy/' + name, lambda: convertQImageToMat(image, copy=True))
+        suite.time('convertMattoQImage/view/' + name, lambda: convertMattoQImage(mat))
+        suite.time('convertMattoQImage/copy/' + name, lambda: convertMattoQImage(mat, copy=True))
+
+def suite_window(suite, folder, sizes=IMAGE_SIZES, counts=SHAPE_COUNTS, view_size=(1920, 1080)):
+    '''MainWindow.loadImage, then populateTree and a full repaint of the scene per annotation count'''
+    from PyQt4 import QtGui, QtCore
+    from . import labeller
+    from .labelmap import parse_labelmap
+    qt_application()
+    window = labeller.MainWindow()
+    window.labelmap = parse_labelmap()
+    window.ui.autoload_chk.setChecked(False)
+    try:
+        for width, height in sizes:
+            name = '%dx%d' % (width, height)
+            path = os.path.join(folder, 'window_%s.png' % name)
+            synthetic_image(path, width, height)
+            suite.time('MainWindow.loadImage/' + name, lambda: window.loadImage(path), setup=window.image_cache.clear)
+        path = os.path.join(folder, 'window_%dx%d.png' % view_size)
+        if not os.path.exists(path):
+            synthetic_image(path, *view_size)
+        window.loadImage(path)
+        target = QtGui.QImage(view_size[0], view_size[1], QtGui.QImage.Format_RGB32)
+        def paint():
+            window.imagePanel.invalidate()
+            painter = QtGui.QPainter(target)
+            window.scene.render(painter, QtCore.QRectF(target.rect()), window.imagePanel.boundingRect())
+            painter.end()
+        for count in counts:
+            rows, _ = random_circles(count, size=view_size)
+            dataset = LabelDataset(path, image_size=view_size[::-1], labelmap=window.labelmap)
+            for i, (x, y, r) in enumerate(rows):
+                dataset.add(LabelCircle(i % 5, x, y, r))
+            labeller.label_dataset = dataset
+            suite.time('MainWindow.populateTree/%d' % count, window.populateTree)
+            suite.time('ObjectDrawPanel.paint/%d' % count, paint)
+    finally:
+        window.close()
+
+def environment():
+    '''where the results were measured'''
+    info = OrderedDict([('date', time.strftime('%Y-%m-%dT%H:%M:%S')), ('python', platform.python_version()),
+                        ('numpy', np.__version__), ('platform', platform.platform()),
+                        ('machine', platform.machine())])
+    try:
+        from PyQt4 import QtCore
+        info['qt'] = str(QtCore.QT_VERSION_STR)
+    except ImportError:
+        pass
+    return info
+
+def compare(results, baseline, threshold=0.25, noise=1e-4):
+    '''print the change of every case against a baseline, returning the names of the cases more
+    than threshold slower (and by more than noise seconds)'''
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        ratio = seconds / before if before else float('inf')
+        slower = ratio > 1 + threshold and seconds - before > noise
+        if slower:
+            regressions.append(name)
+        print('{:<48s} {:>10.3f} -> {:>10.3f} ms {:>6.2f}x{}'.format(
+            name, before * 1e3, seconds * 1e3, ratio, '  REGRESSION' if slower else ''))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite for the labeller hot paths')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help='Compare with the results in this JSON file, exiting with 1 on a regression')
+    parser.add_argument('--threshold', default=0.25, type=float,
+                        help='Slowdown (fraction) counted as a regression (default 0.25)')
+    parser.add_argument('--repeat', default=3, type=int, help='Timings per case, the best is kept')
+    parser.add_argument('--filter', default=None, help='Only run cases whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='Skip the 100k shape and 24 MP cases')
+    parser.add_argument('--no-gui', dest='gui', action='store_false', help='Only run the cases that need no Qt')
+    parser.add_argument('--comparisons', action='store_true',
+                        help='Run the old-versus-new implementation comparisons instead of the suite')
+    return parser.parse_args(argv)
+
+def comparisons():
+    bench_data_at()
+    bench_remove()
+    bench_storage()
+    bench_svg()
+    bench_load()
+    bench_adjust()
+    bench_frame()
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.comparisons:
+        comparisons()
+        return 0
+    counts = SHAPE_COUNTS[:-1] if args.quick else SHAPE_COUNTS
+    sizes = IMAGE_SIZES[:-1] if args.quick else IMAGE_SIZES
+    suite = Suite(repeat=args.repeat, pattern=args.filter)
+    violations = suite_imports(suite)
+    folder = tempfile.mkdtemp()
+    try:
+        suite_dataset(suite, folder, counts=counts)
+        suite_adjust(suite, sizes=LARGE_IMAGE_SIZES[:1] if args.quick else LARGE_IMAGE_SIZES)
+        if args.gui:
+            suite_image(suite, folder, sizes=sizes)
+            suite_window(suite, folder, sizes=sizes, counts=counts)
+    finally:
+        shutil.rmtree(folder)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(OrderedDict([('environment', environment()), ('results', suite.results)]), f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(suite.results, baseline, threshold=args.threshold)
+        if regressions:
+            print('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+            return 1
+    if suite.over_budget:
+        print('{} cases over budget: {}'.format(len(suite.over_budget), ', '.join(suite.over_budget)))
+        return 1
+    return 1 if violations else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
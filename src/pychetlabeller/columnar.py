@@ -0,0 +1,112 @@
+"""
+Columnar storage for label shapes.
+Shapes of one type live in a growable NumPy structured array; deleted rows are
+tombstoned and squeezed out once they make up half the array.
+"""
+
+import numpy as np
+
+CIRCLE_DTYPE = np.dtype([('id', np.int64), ('x', np.float64), ('y', np.float64),
+                         ('r', np.float64), ('label', np.int32)])
+RECTANGLE_DTYPE = np.dtype([('id', np.int64), ('x', np.float64), ('y', np.float64),
+                            ('dx', np.float64), ('dy', np.float64), ('label', np.int32)])
+
+class ShapeColumns(object):
+    '''Growable structured array of one shape type with tombstone deletion'''
+    def __init__(self, dtype, capacity=64):
+        self.dtype = np.dtype(dtype)
+        self.rows = np.zeros(capacity, self.dtype)
+        self.alive = np.zeros(capacity, bool)
+        self.size = 0 # rows in use, including tombstones
+        self.count = 0 # live rows
+        self.row_of = {} # id -> row
+    def __len__(self):
+        return self.count
+    def __contains__(self, shape_id):
+        return shape_id in self.row_of
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.rows))
+        rows = np.zeros(capacity, self.dtype)
+        rows[:self.size] = self.rows[:self.size]
+        alive = np.zeros(capacity, bool)
+        alive[:self.size] = self.alive[:self.size]
+        (self.rows, self.alive) = (rows, alive)
+    def append(self, row):
+        '''append one row given as a tuple in dtype field order'''
+        if self.size == len(self.rows):
+            self._grow(self.size + 1)
+        self.rows[self.size] = row
+        self.alive[self.size] = True
+        self.row_of[int(row[0])] = self.size
+        self.size += 1
+        self.count += 1
+    def extend(self, rows):
+        '''append a structured array (or sequence of tuples) of rows'''
+        rows = np.asarray(rows, self.dtype)
+        if self.size + len(rows) > len(self.rows):
+            self._grow(self.size + len(rows))
+        start, stop = self.size, self.size + len(rows)
+        self.rows[start:stop] = rows
+        self.alive[start:stop] = True
+        self.row_of.update(zip(rows['id'].tolist(), range(start, stop)))
+        self.size = stop
+        self.count += len(rows)
+    def delete(self, shape_id):
+        '''tombstone the row of shape_id'''
+        row = self.row_of.pop(shape_id)
+        self.alive[row] = False
+        self.count -= 1
+        if self.size > 64 and self.count < self.size // 2:
+            self.compact()
+    def compact(self):
+        '''drop tombstoned rows, preserving order'''
+        live = self.live()
+        self.rows[:len(live)] = live
+        self.alive[:] = False
+        self.alive[:len(live)] = True
+        self.size = len(live)
+        self.row_of = dict(zip(live['id'].tolist(), range(len(live))))
+    def copy(self):
+        '''independent copy of the live rows'''
+        columns = ShapeColumns(self.dtype, capacity=max(self.count, 1))
+        columns.extend(self.live())
+        return columns
+    def get(self, shape_id):
+        '''return the row of shape_id as a numpy record'''
+        return self.rows[self.row_of[shape_id]]
+    def live(self):
+        '''structured array (copy) of the live rows in insertion order'''
+        return self.rows[:self.size][self.alive[:self.size]]
+    def bounds(self, rows=None):
+        '''(n, 4) array of minx, miny, maxx, maxy for rows (default: live rows)'''
+        rows = self.live() if rows is None else rows
+        if 'r' in self.dtype.names:
+            return np.column_stack((rows['x'] - rows['r'], rows['y'] - rows['r'],
+                                    rows['x'] + rows['r'], rows['y'] + rows['r']))
+        return np.column_stack((rows['x'], rows['y'], rows['x'] + rows['dx'], rows['y'] + rows['dy']))
+    def ids_at(self, x, y):
+        '''ids of live shapes containing the point (x, y)'''
+        rows = self.live()
+        if 'r' in self.dtype.names:
+            inside = (rows['x'] - x) ** 2 + (rows['y'] - y) ** 2 <= rows['r'] ** 2
+        else:
+            inside = ((rows['x'] <= x) & (x <= rows['x'] + rows['dx'])
+                      & (rows['y'] <= y) & (y <= rows['y'] + rows['dy']))
+        return rows['id'][inside]
+    def ids_in(self, rect):
+        '''ids of live shapes intersecting the rectangle (minx, miny, maxx, maxy)'''
+        x1, y1, x2, y2 = rect
+        rows = self.live()
+        if 'r' in self.dtype.names:
+            # Distance from the centre to the nearest point of the rectangle
+            nx = np.clip(rows['x'], x1, x2) - rows['x']
+            ny = np.clip(rows['y'], y1, y2) - rows['y']
+            hit = nx ** 2 + ny ** 2 <= rows['r'] ** 2
+        else:
+            hit = ((rows['x'] <= x2) & (x1 <= rows['x'] + rows['dx'])
+                   & (rows['y'] <= y2) & (y1 <= rows['y'] + rows['dy']))
+        return rows['id'][hit]
+    def serialize(self):
+        '''(n, fields) float array of the live rows in CSV column order'''
+        live = self.live()
+        return np.column_stack([live[name] for name in self.dtype.names])
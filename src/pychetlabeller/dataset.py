@@ -0,0 +1,458 @@
+"""
+Annotation data model and label file I/O.
+LabelDataset holds the shapes of one image, as LabelShape objects or in NumPy
+columns, and reads and writes the label files. Nothing here needs Qt: NumPy, the
+columnar storage, svgwrite and shapely are only imported when first used, so
+scripts that just read or write label files start quickly.
+"""
+
+import math
+import weakref
+import zlib
+from collections import OrderedDict
+
+from .spatial import GridIndex
+from .labelmap import label_colour
+from .labelfile import HEADER, SECTION, atomic_write, parse_labels
+from .profiling import profiler
+
+# SVG markup as svgwrite 1.3.1 writes it (attributes sorted, numbers as str()), so saveSVG
+# can stream shapes straight to the file without building svgwrite elements
+SVG_HEADER = ('<?xml version="1.0" encoding="utf-8" ?>\n<svg baseProfile="tiny" height="%s" version="1.2" '
+              'width="%s" xmlns="http://www.w3.org/2000/svg" xmlns:ev="http://www.w3.org/2001/xml-events" '
+              'xmlns:xlink="http://www.w3.org/1999/xlink"><defs />')
+SVG_FOOTER = '</svg>'
+
+def svg_colour(label):
+    '''svgwrite.rgb(r, g, b, 'RGB') of a label's colour'''
+    r, g, b = label_colour(label)
+    return 'rgb(%d,%d,%d)' % (int(r) & 255, int(g) & 255, int(b) & 255)
+
+def svg_element(kind, row, colour):
+    '''SVG markup of a serialized shape row (id, geometry..., label)'''
+    if kind == 'circle':
+        _, x, y, r, _ = row
+        return '<circle cx="%s" cy="%s" fill="%s" r="%s" stroke="%s" />' % (x, y, colour, r, colour)
+    _, x, y, dx, dy, _ = row
+    return '<rect fill="%s" height="%s" stroke="%s" width="%s" x="%s" y="%s" />' % (colour, dy, colour, dx, x, y)
+
+def shape_digest(kind, fields):
+    '''stable hash of a shape's type and fields (without the id) as written to a label file'''
+    return zlib.crc32(kind + (',%.12g' * len(fields)) % tuple(fields)) & 0xffffffff
+
+class LabelDataset(object):
+    '''shape-label dataset class
+    By default shapes are held as LabelShape objects. With columnar=True they are held in
+    NumPy columns (see columnar.py) and LabelShape views are only built when asked for.
+    With typed=True label files are always written in the typed format (see labelfile.py).'''
+    def __init__(self, image_path, image_size, labelmap='', columnar=False, typed=False):
+        self.shapes = OrderedDict() # id -> LabelShape, in insertion order
+        self.image_size = image_size
+        self.image_path = image_path
+        self.label_path = None
+        self.labelmap = labelmap
+        self.typed = typed
+        self.index = GridIndex()
+        self.digest = 0 # sum of shape_digest over the shapes - see fingerprint()
+        self.columns = None
+        if columnar:
+            from .columnar import ShapeColumns, CIRCLE_DTYPE, RECTANGLE_DTYPE
+            self.columns = {'circle': ShapeColumns(CIRCLE_DTYPE),
+                            'rectangle': ShapeColumns(RECTANGLE_DTYPE)}
+            self.views = weakref.WeakValueDictionary() # id -> LabelShape view
+    def add(self, datum):
+        ''' add a LabelShape to the dataset'''
+        assert isinstance(datum, LabelShape)
+        self.digest = (self.digest + shape_digest(datum.kind, datum.serialize()[1:])) % 2 ** 64
+        if self.columns is not None:
+            self.columns[datum.kind].append(datum.serialize())
+            self.views[datum.id] = datum
+            return
+        self.shapes[datum.id] = datum
+        self.index.insert(datum, datum.bounds)
+    def add_row(self, kind, geometry, label, shape_id=None):
+        '''add a shape from its geometry tuple - in columnar mode no LabelShape is built'''
+        label_name = self.labelmap.name(label) if self.labelmap else ''
+        if self.columns is not None:
+            shape_id = LabelShape.new_id() if shape_id is None else shape_id
+            self.columns[kind].append((shape_id,) + tuple(geometry) + (label,))
+            self.digest = (self.digest + shape_digest(kind, tuple(geometry) + (label,))) % 2 ** 64
+            return
+        self.add(SHAPE_TYPES[kind](label, *geometry, label_name=label_name, shape_id=shape_id))
+    def remove(self, datum):
+        '''remove a LabelShape to the dataset'''
+        assert isinstance(datum, LabelShape)
+        self.digest = (self.digest - shape_digest(datum.kind, datum.serialize()[1:])) % 2 ** 64
+        if self.columns is not None:
+            self.columns[datum.kind].delete(datum.id)
+            self.views.pop(datum.id, None)
+            return
+        del self.shapes[datum.id]
+        self.index.delete(datum)
+    def add_rows(self, kind, rows, ids=None):
+        '''add shapes from an (n, columns) array of serialized rows, replacing their ids with ids
+        (default: newly allocated, in row order). Rows whose label is not in the labelmap are skipped.'''
+        import numpy as np
+        if ids is None:
+            ids = LabelShape.new_ids(len(rows))
+        labels = rows[:, -1]
+        keep = labels == np.round(labels)
+        if self.labelmap:
+            keep &= np.in1d(labels, list(self.labelmap.names))
+        if not keep.all():
+            print "WARNING: Skipped %d %s rows with unknown label ids" % (len(rows) - keep.sum(), kind)
+            rows, ids = rows[keep], ids[keep]
+        if self.columns is None:
+            for shape_id, row in zip(ids.tolist(), rows.tolist()):
+                self.add_row(kind, row[1:-1], int(row[-1]), shape_id=shape_id)
+            return
+        table = np.zeros(len(rows), self.columns[kind].dtype)
+        for name, column in zip(table.dtype.names, rows.T):
+            table[name] = column
+        table['id'] = ids
+        self.columns[kind].extend(table)
+        key = kind + ',%.12g' * (rows.shape[1] - 1) # as shape_digest, without a call per row
+        digests = sum(zlib.crc32(key % tuple(row)) & 0xffffffff for row in rows[:, 1:].tolist())
+        self.digest = (self.digest + digests) % 2 ** 64
+    def _view(self, kind, row):
+        '''return the (cached) LabelShape for a columnar row'''
+        shape_id = int(row['id'])
+        view = self.views.get(shape_id)
+        if view is None:
+            label = int(row['label'])
+            label_name = self.labelmap.name(label) if self.labelmap else ''
+            geometry = [float(row[name]) for name in row.dtype.names[1:-1]]
+            view = SHAPE_TYPES[kind](label, *geometry, label_name=label_name, shape_id=shape_id)
+            self.views[shape_id] = view
+        return view
+    def _views(self, kind_ids):
+        '''views for a list of (kind, id) pairs, ordered by id'''
+        return [self._view(kind, self.columns[kind].get(shape_id))
+                for kind, shape_id in sorted(kind_ids, key=lambda kind_id: kind_id[1])]
+    @property
+    def data(self):
+        '''list of the LabelShapes in the order they were added'''
+        return list(self)
+    def __iter__(self):
+        if self.columns is not None:
+            kind_ids = [(kind, shape_id) for kind, columns in self.columns.items()
+                        for shape_id in columns.live()['id'].tolist()]
+            return iter(self._views(kind_ids))
+        return iter(self.shapes.values())
+    def __len__(self):
+        if self.columns is not None:
+            return sum(len(columns) for columns in self.columns.values())
+        return len(self.shapes)
+    def last(self):
+        '''return the most recently added LabelShape, or None if empty'''
+        if self.columns is not None:
+            kind_ids = [(kind, int(columns.live()['id'].max()))
+                        for kind, columns in self.columns.items() if len(columns)]
+            return self._views(kind_ids)[-1] if kind_ids else None
+        if not self.shapes:
+            return None
+        return self.shapes[next(reversed(self.shapes))]
+    def ids(self):
+        '''list of the shape ids'''
+        if self.columns is not None:
+            return [shape_id for columns in self.columns.values() for shape_id in columns.live()['id'].tolist()]
+        return list(self.shapes)
+    def labels(self):
+        '''array of the label ids of all shapes'''
+        import numpy as np
+        if self.columns is not None:
+            return np.concatenate([columns.live()['label'] for columns in self.columns.values()])
+        return np.array([datum.label for datum in self.shapes.values()], int)
+    def fingerprint(self):
+        '''(shape count, digest) - equal for datasets holding the same shapes in any order,
+        maintained as shapes are added and removed'''
+        return (len(self), self.digest)
+    def serialize(self):
+        '''return {kind: (n, fields) array} of the serialized shapes (columnar mode only)'''
+        return dict((kind, columns.serialize()) for kind, columns in self.columns.items() if len(columns))
+    def snapshot(self):
+        '''copy of the dataset to save while editing carries on - shapes are shared, as they are
+        never modified once added, and the spatial index is not copied'''
+        copy = LabelDataset(self.image_path, self.image_size, labelmap=self.labelmap, typed=self.typed)
+        copy.label_path = self.label_path
+        copy.digest = self.digest
+        if self.columns is not None:
+            copy.columns = dict((kind, columns.copy()) for kind, columns in self.columns.items())
+            copy.views = weakref.WeakValueDictionary()
+        else:
+            copy.shapes = OrderedDict(self.shapes)
+        return copy
+    def rows(self):
+        '''(kind, serialized row) for every shape, in the order they were added'''
+        if self.columns is not None:
+            rows = [(kind, row) for kind, columns in self.columns.items() for row in columns.live().tolist()]
+            return sorted(rows, key=lambda kind_row: kind_row[1][0])
+        return [(datum.kind, datum.serialize()) for datum in self.shapes.values()]
+    @profiler.timed('LabelDataset.save')
+    def save(self, label_basename):
+        '''Save the dataset'''
+        self.saveSVG(label_basename + '.svg')
+        self.saveCSV(label_basename + '.csv')
+    def saveSVG(self, output_filename):
+        """Save the shapes in SVG format - streamed, byte for byte what svgwrite writes, to a
+        temporary file renamed over output_filename once it is complete"""
+        atomic_write(output_filename, self._writeSVG)
+    def _writeSVG(self, output_filename):
+        colours = {}
+        with open(output_filename, 'w') as f:
+            # the tiny profile of the drawing rounds float sizes to 4 places
+            width, height = [round(value, 4) if isinstance(value, float) else value for value in self.image_size]
+            f.write(SVG_HEADER % (height, width))
+            for kind, row in self.rows():
+                label = row[-1]
+                if label not in colours:
+                    colours[label] = svg_colour(label)
+                f.write(svg_element(kind, row, colours[label]))
+            f.write(SVG_FOOTER)
+    def saveCSV(self, output_filename, field_delimiter=',', line_delimiter='\n'):
+        """Save the shapes as CSV in the order they were added - headerless, unless the dataset is
+        typed or holds both shape types (see labelfile.py). The same bytes in either storage mode,
+        written to a temporary file renamed over output_filename once it is complete"""
+        atomic_write(output_filename, lambda path: self._writeCSV(path, field_delimiter, line_delimiter))
+    def _writeCSV(self, output_filename, field_delimiter, line_delimiter):
+        sections = OrderedDict() # shape type -> rows, in order of first appearance
+        for kind, row in self.rows():
+            sections.setdefault(kind, []).append(row)
+        typed = self.typed or len(sections) > 1
+        with open(output_filename, 'w') as f:
+            if typed:
+                f.write(HEADER + line_delimiter)
+            for kind, rows in sections.items():
+                if typed:
+                    f.write(SECTION % kind + line_delimiter)
+                fields = len(rows[0])
+                fmt = '%d' + (field_delimiter + '%.12g') * (fields - 2) + field_delimiter + '%d' + line_delimiter
+                f.write(''.join(fmt % tuple(row) for row in rows))
+    @profiler.timed('LabelDataset.load')
+    def load(self, label_path, tool='circle'):
+        '''try load the default path, or given label_path
+        tool is the shape type of files written without a header'''
+        self.label_path = label_path
+        try:
+            with open(self.label_path, 'r') as label_file:
+                text = label_file.read()
+        except IOError:
+            return False # Couldn't find file
+        sections = parse_labels(text, tool=tool)
+        if len(sections) < 2:
+            for kind, rows in sections:
+                self.add_rows(kind, rows)
+            return True
+        # Typed file - rows are grouped by type, so give out ids in the order of the id column
+        import numpy as np
+        order = np.argsort(np.concatenate([rows[:, 0] for _, rows in sections]), kind='mergesort')
+        ids = np.empty(len(order), np.int64)
+        ids[order] = LabelShape.new_ids(len(order))
+        start = 0
+        for kind, rows in sections:
+            self.add_rows(kind, rows, ids=ids[start:start + len(rows)])
+            start += len(rows)
+        if self.columns is None:
+            self.shapes = OrderedDict(sorted(self.shapes.items()))
+        return True
+    def find(self, labelshape_id):
+        '''find a LabelShape given by ID'''
+        if self.columns is not None:
+            for kind, columns in self.columns.items():
+                if labelshape_id in columns:
+                    return self._view(kind, columns.get(labelshape_id))
+            return None
+        return self.shapes.get(labelshape_id)
+    def data_at(self, position):
+        '''return all the data that lie at a point'''
+        if self.columns is not None:
+            return self._views([(kind, shape_id) for kind, columns in self.columns.items()
+                                for shape_id in columns.ids_at(*position[:2]).tolist()])
+        candidates = self.index.query_point(position[0], position[1])
+        results = [datum for datum in candidates if datum.contains(position[0], position[1])]
+        return sorted(results, key=lambda datum: datum.id)
+    def data_in(self, rect):
+        '''return all the data that intersect a rectangle (minx, miny, maxx, maxy)'''
+        if self.columns is not None:
+            return self._views([(kind, shape_id) for kind, columns in self.columns.items()
+                                for shape_id in columns.ids_in(rect).tolist()])
+        candidates = self.index.query_rect(rect)
+        results = [datum for datum in candidates if datum.intersects_rect(rect)]
+        return sorted(results, key=lambda datum: datum.id)
+
+class LabelShape(object):
+    '''base class of all data
+    Geometry is held analytically; the shapely geometry in shape is only built on first use'''
+    instances = 0
+    def __init__(self, label, label_name='', shape_id=None):
+        self.label = label
+        self.label_name = label_name
+        self._shape = None
+        self.id = LabelShape.new_id() if shape_id is None else shape_id
+    @staticmethod
+    def new_id():
+        '''allocate a new unique shape id'''
+        shape_id = LabelShape.instances
+        LabelShape.instances += 1
+        return shape_id
+    @staticmethod
+    def new_ids(count):
+        '''allocate count consecutive shape ids as an array'''
+        import numpy as np
+        first = LabelShape.instances
+        LabelShape.instances += count
+        return np.arange(first, first + count)
+    @property
+    def shape(self):
+        '''shapely geometry of this object - only needed for general polygon operations'''
+        if self._shape is None:
+            self._shape = self.build_shape()
+        return self._shape
+    def build_shape(self):
+        raise NotImplementedError("LabelShape::build_shape")
+    def contains(self, x, y):
+        '''True if the point (x, y) lies inside the shape'''
+        from shapely.geometry import Point
+        return Point(x, y).within(self.shape)
+    def intersects_rect(self, rect):
+        '''True if the shape intersects the rectangle (minx, miny, maxx, maxy)'''
+        from shapely.geometry import box
+        return box(*rect).intersects(self.shape)
+    def intersection_area(self, other):
+        '''area of overlap with another LabelShape'''
+        return self.shape.intersection(other.shape).area
+    def iou(self, other):
+        '''intersection over union with another LabelShape'''
+        intersection = self.intersection_area(other)
+        union = self.area + other.area - intersection
+        return intersection / union if union > 0 else 0.0
+    def populate_view(self, view, **kwargs):
+        '''draw the shape with a QPainter'''
+        pass
+    def column_text(self, column):
+        '''text of a column of the annotation list: item, location, size, label id, label name'''
+        if column == 0:
+            return str(self.id)
+        if column == 3:
+            return str(self.label)
+        if column == 4:
+            return str(self.label_name)
+        return ''
+    def __hash__(self):
+        return self.id
+    def __cmp__(self, other):
+        if self.id > other.id:
+            return 1
+        elif self.id < other.id:
+            return -1
+        return 0
+    def serialize(self):
+        raise Exception("serialize UNIMPLEMENTED for this type")
+
+class LabelRectangle(LabelShape):
+    enum = 1
+    kind = 'rectangle'
+    def __init__(self, label, x, y, dx, dy, label_name='', shape_id=None):
+        super(LabelRectangle, self).__init__(label, label_name=label_name, shape_id=shape_id)
+        (self.x, self.y, self.dx, self.dy) = (x, y, dx, dy)
+    def build_shape(self):
+        from shapely.geometry import box
+        return box(self.x, self.y, self.x + self.dx, self.y + self.dy)
+    @property
+    def bounds(self):
+        return (self.x, self.y, self.x + self.dx, self.y + self.dy)
+    @property
+    def area(self):
+        return float(self.dx) * self.dy
+    def contains(self, x, y):
+        return self.x <= x <= self.x + self.dx and self.y <= y <= self.y + self.dy
+    def intersects_rect(self, rect):
+        x1, y1, x2, y2 = rect
+        return self.x <= x2 and x1 <= self.x + self.dx and self.y <= y2 and y1 <= self.y + self.dy
+    def intersection_area(self, other):
+        if not isinstance(other, LabelRectangle):
+            return super(LabelRectangle, self).intersection_area(other)
+        (ax1, ay1, ax2, ay2), (bx1, by1, bx2, by2) = self.bounds, other.bounds
+        width = min(ax2, bx2) - max(ax1, bx1)
+        height = min(ay2, by2) - max(ay1, by1)
+        return float(width) * height if width > 0 and height > 0 else 0.0
+    def get_rect_data(self):
+        return self.x, self.y, self.dx, self.dy
+    def populate_view(self, view, **kwargs):
+        view.drawRect(*self.get_rect_data())
+    def column_text(self, column):
+        if column == 1:
+            return "(%d, %d)" % (self.x, self.y)
+        if column == 2:
+            return "(%d, %d)" % (self.dx, self.dy)
+        return LabelShape.column_text(self, column)
+    def serialize(self):
+        return (self.id,) + self.get_rect_data() + (self.label,)
+    def svg_shape(self):
+        '''return the SVG shape that this object represents'''
+        import svgwrite
+        r, g, b = label_colour(self.label)
+        x, y, dx, dy = self.get_rect_data()
+        return svgwrite.shapes.Rect(insert=(x, y)
+            , size=(dx,dy), stroke=svgwrite.rgb(r, g, b, 'RGB')
+            , fill=svgwrite.rgb(r, g, b, 'RGB'))
+
+
+class LabelCircle(LabelShape):
+    enum = 1
+    kind = 'circle'
+    def __init__(self, label, x, y, radius, label_name='', shape_id=None):
+        super(LabelCircle, self).__init__(label, label_name=label_name, shape_id=shape_id)
+        (self.x, self.y, self.radius) = (x, y, radius)
+    def build_shape(self):
+        from shapely.geometry import Point
+        return Point(self.x, self.y).buffer(self.radius)
+    @property
+    def bounds(self):
+        return (self.x - self.radius, self.y - self.radius, self.x + self.radius, self.y + self.radius)
+    @property
+    def area(self):
+        return math.pi * self.radius ** 2
+    def contains(self, x, y):
+        return (x - self.x) ** 2 + (y - self.y) ** 2 <= self.radius ** 2
+    def intersects_rect(self, rect):
+        x1, y1, x2, y2 = rect
+        # Distance from the centre to the nearest point of the rectangle
+        nx = min(max(self.x, x1), x2) - self.x
+        ny = min(max(self.y, y1), y2) - self.y
+        return nx ** 2 + ny ** 2 <= self.radius ** 2
+    def intersection_area(self, other):
+        if not isinstance(other, LabelCircle):
+            return super(LabelCircle, self).intersection_area(other)
+        r1, r2 = float(self.radius), float(other.radius)
+        d = math.hypot(self.x - other.x, self.y - other.y)
+        if d >= r1 + r2:
+            return 0.0
+        if d <= abs(r1 - r2):
+            return math.pi * min(r1, r2) ** 2
+        # Area of the lens formed by two overlapping circles
+        a1 = r1 ** 2 * math.acos((d ** 2 + r1 ** 2 - r2 ** 2) / (2 * d * r1))
+        a2 = r2 ** 2 * math.acos((d ** 2 + r2 ** 2 - r1 ** 2) / (2 * d * r2))
+        a3 = 0.5 * math.sqrt((-d + r1 + r2) * (d + r1 - r2) * (d - r1 + r2) * (d + r1 + r2))
+        return a1 + a2 - a3
+    def column_text(self, column):
+        if column == 1:
+            return "(%d, %d)" % (self.x, self.y)
+        if column == 2:
+            return str(self.radius)
+        return LabelShape.column_text(self, column)
+    def populate_view(self, view, **kwargs):
+        (x, y) = (self.x - self.radius, self.y - self.radius)
+        side_width = 2*self.radius
+        view.drawEllipse(x , y, side_width, side_width)
+    def serialize(self):
+        return (self.id, self.x, self.y, self.radius, self.label)
+    def svg_shape(self):
+        '''return the SVG shape that this object represents'''
+        import svgwrite
+        r, g, b = label_colour(self.label)
+        return svgwrite.shapes.Circle(center=(self.x, self.y)
+            , r=self.radius, stroke=svgwrite.rgb(r, g, b, 'RGB')
+            , fill=svgwrite.rgb(r, g, b, 'RGB'))
+
+SHAPE_TYPES = {'circle': LabelCircle, 'rectangle': LabelRectangle}
@@ -0,0 +1,138 @@
+"""
+Cache of decoded images for next/previous navigation.
+Images are decoded to 32-bit QImages (safe to build off the GUI thread), held in a
+least-recently-used cache bounded by a memory budget, and the images around the
+current one are decoded ahead of time by a background thread.
+Images can be decoded at reduced resolution to fit a maximum size. QImageReader
+then scales while decoding (JPEGs are downscaled in the DCT domain by libjpeg),
+so a large photo shown whole never costs a full resolution decode. The sharper
+decode wanted when the view zooms in is also made by the worker, ahead of any
+prefetching, and handed back with decoded(PyQt_PyObject).
+"""
+
+import os
+import math
+import threading
+from collections import OrderedDict, deque
+from PyQt4 import QtGui, QtCore
+
+def decodeImage(path, max_size=None):
+    '''Decode an image file into a 32-bit QImage ready for display and adjustment
+    max_size (width, height) decodes larger images at reduced resolution to fit it'''
+    reader = QtGui.QImageReader(path)
+    if max_size is not None:
+        size = reader.size()
+        if size.isValid() and (size.width() > max_size[0] or size.height() > max_size[1]):
+            reader.setScaledSize(size.scaled(QtCore.QSize(*max_size), QtCore.Qt.KeepAspectRatio))
+    return reader.read().convertToFormat(QtGui.QImage.Format_RGB32)
+
+def decodeSizeForZoom(size, lod, headroom=1.5):
+    '''(width, height) to decode an image of full resolution size at for display at lod
+    (device pixels per image pixel), with headroom for zooming in - None for full resolution'''
+    scale = lod * headroom
+    if scale >= 1:
+        return None
+    return (max(1, int(math.ceil(size.width() * scale))), max(1, int(math.ceil(size.height() * scale))))
+
+class ImageCache(QtCore.QObject):
+    '''Bounded LRU cache of decoded images, keyed by path, modification time and decode size'''
+    def __init__(self, budget_mb=512, prefetch_count=2, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.budget = budget_mb * 2 ** 20 # bytes
+        self.prefetch_count = prefetch_count # images to decode ahead in the direction of travel
+        self.max_pixels = 0 # larger images are not prefetched (they are tiled instead); 0 for no limit
+        self.max_size = None # (width, height) larger images are decoded to fit, or None for full resolution
+        self.images = OrderedDict() # (path, mtime, max_size) -> QImage, least recently used first
+        self.size = 0 # bytes held
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Condition()
+        self.queue = deque() # paths waiting to be prefetched
+        self.request = None # (path, max_size) of a decode to hand back, decoded before prefetching
+        self.decoding = set() # keys being decoded by the worker
+        self.worker = threading.Thread(target=self.work, name='ImageCache')
+        self.worker.daemon = True
+        self.worker.start()
+    def key(self, path):
+        try:
+            return (path, os.path.getmtime(path), self.max_size)
+        except OSError:
+            return (path, None, self.max_size)
+    def _insert(self, key, image):
+        '''add an image, evicting least recently used ones to stay within budget (lock held)'''
+        if key in self.images:
+            return
+        self.images[key] = image
+        self.size += image.byteCount()
+        while self.size > self.budget and len(self.images) > 1:
+            _, evicted = self.images.popitem(last=False)
+            self.size -= evicted.byteCount()
+    def too_large(self, path):
+        '''True if the image has more pixels than max_pixels (read from the header only)'''
+        size = QtGui.QImageReader(path).size()
+        return bool(self.max_pixels) and size.width() * size.height() > self.max_pixels
+    def get(self, path):
+        '''return the decoded image for path, decoding it now if it is not cached'''
+        key = self.key(path)
+        with self.lock:
+            while key in self.decoding: # the worker is already on it
+                self.lock.wait()
+            image = self.images.pop(key, None)
+            if image is not None:
+                self.images[key] = image # mark as most recently used
+                self.hits += 1
+                return image
+            self.misses += 1
+        image = decodeImage(path, key[2])
+        if not image.isNull():
+            with self.lock:
+                self._insert(key, image)
+        return image
+    def clear(self):
+        '''drop every cached image'''
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+    def prefetch(self, paths):
+        '''replace the prefetch queue with paths, nearest first'''
+        with self.lock:
+            self.queue.clear()
+            self.queue.extend(paths)
+            self.lock.notify_all()
+    def decode(self, path, max_size=None):
+        '''decode path to fit max_size on the worker, replacing a decode asked for earlier that has
+        not started - emits decoded(PyQt_PyObject) with (path, max_size, image). The image is not cached'''
+        with self.lock:
+            self.request = (path, max_size)
+            self.lock.notify_all()
+    def prefetch_around(self, images, index, direction=1, folder=''):
+        '''prefetch the next prefetch_count images in the direction of travel, and one behind'''
+        order = [index + direction * step for step in range(1, self.prefetch_count + 1)]
+        order.append(index - direction)
+        self.prefetch([os.path.join(folder, images[i]) for i in order if 0 <= i < len(images)])
+    def work(self):
+        '''worker thread: make the decode asked for with decode(), else decode queued paths that
+        are not already cached'''
+        while True:
+            with self.lock:
+                while not self.queue and self.request is None:
+                    self.lock.wait()
+                request, self.request = self.request, None
+                if request is None:
+                    path = self.queue.popleft()
+                    key = self.key(path)
+                    if key in self.images or key in self.decoding or self.too_large(path):
+                        continue
+                    self.decoding.add(key)
+            if request is not None:
+                path, max_size = request
+                self.emit(QtCore.SIGNAL('decoded(PyQt_PyObject)'), (path, max_size, decodeImage(path, max_size)))
+                continue
+            image = None
+            try:
+                image = decodeImage(path, key[2])
+            finally:
+                with self.lock:
+                    self.decoding.discard(key)
+                    if image is not None and not image.isNull():
+                        self._insert(key, image)
+                    self.lock.notify_all()
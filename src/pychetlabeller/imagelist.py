@@ -0,0 +1,133 @@
+"""
+Streaming list of the images in a folder.
+The folder is read on a background thread (with scandir where available, so no
+stat per file) and the names are handed to the model in batches. The combobox
+fetches them lazily, so the first image can be shown while a folder of hundreds of
+thousands of frames is still being read.
+The rows are kept sorted: each batch is merged into them as it is fetched, rather
+than the whole list being sorted once the scan is done, so Next/Previous follow the
+sorted order of the names found so far and nothing moves when the scan ends. The
+first image shown is the first of the first batch; an image found later that sorts
+before it is inserted above it, keeping it selected.
+"""
+
+import os
+import bisect
+import threading
+from fnmatch import fnmatch
+from PyQt4 import QtCore
+
+try:
+    from os import scandir # Python 3.5+
+except ImportError:
+    try:
+        from scandir import scandir # pip install scandir
+    except ImportError:
+        scandir = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+
+def list_directory(directory, recursive=False):
+    '''yield (name, is directory) for the entries of a directory as they are read'''
+    if scandir is not None:
+        for entry in scandir(directory):
+            yield entry.name, recursive and entry.is_dir()
+    else:
+        for name in os.listdir(directory):
+            yield name, recursive and os.path.isdir(os.path.join(directory, name))
+
+def iter_images(folder, recursive=False, pattern=None):
+    '''yield the paths (relative to folder) of the images in folder, unsorted
+    pattern is a glob matched against the relative path, e.g. 'cam1/*.png' '''
+    directories = ['']
+    while directories:
+        relative = directories.pop()
+        for name, is_directory in list_directory(os.path.join(folder, relative), recursive):
+            path = os.path.join(relative, name)
+            if is_directory:
+                directories.append(path)
+            elif os.path.splitext(name)[-1].lower() in IMAGE_EXTENSIONS \
+                    and (pattern is None or fnmatch(path, pattern)):
+                yield path
+
+class ImageListModel(QtCore.QAbstractListModel):
+    '''Image paths of a folder, filled by a background scan and fetched by views in batches'''
+    def __init__(self, folder, recursive=False, pattern=None, batch=1000, parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.folder = folder
+        self.batch = batch # names exposed per fetchMore
+        self.names = [] # rows of the model, sorted
+        self.pending = [] # scanned names not fetched yet
+        self.finished = False # True once the scan is complete and every name fetched
+        self.lock = threading.Lock()
+        self.connect(self, QtCore.SIGNAL('scanned(bool)'), self.scanned)
+        self.worker = threading.Thread(target=self.scan, args=(recursive, pattern), name='ImageListModel')
+        self.worker.daemon = True
+        self.worker.start()
+    def scan(self, recursive, pattern):
+        '''worker thread: read the folder, passing names on in batches with scanned(bool)'''
+        names = []
+        try:
+            for name in iter_images(self.folder, recursive, pattern):
+                names.append(name)
+                if len(names) == self.batch:
+                    with self.lock:
+                        self.pending.extend(names)
+                    names = []
+                    self.emit(QtCore.SIGNAL('scanned(bool)'), False)
+        finally:
+            with self.lock:
+                self.pending.extend(names)
+            self.emit(QtCore.SIGNAL('scanned(bool)'), True)
+    def scanned(self, done):
+        '''GUI thread: show the first batch straight away, and every name at the end'''
+        if not self.names:
+            self.fetchMore()
+        if done:
+            self.fetchAll()
+            self.finished = True
+        self.emit(QtCore.SIGNAL('progress()'))
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole) and index.isValid():
+            return QtCore.QVariant(self.names[index.row()])
+        return QtCore.QVariant()
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and bool(self.pending)
+    def fetchMore(self, parent=QtCore.QModelIndex(), count=None):
+        '''merge up to count (default: batch) scanned names into the sorted rows, keeping
+        persistent indexes (e.g. the combobox selection) on their image'''
+        with self.lock:
+            names, self.pending = self.pending[:count or self.batch], self.pending[count or self.batch:]
+        if not names:
+            return
+        names.sort()
+        if not self.names or names[0] > self.names[-1]: # all after the current rows
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.names), len(self.names) + len(names) - 1)
+            self.names.extend(names)
+            self.endInsertRows()
+            return
+        self.emit(QtCore.SIGNAL('layoutAboutToBeChanged()'))
+        persistent = self.persistentIndexList()
+        moved = [self.names[index.row()] for index in persistent]
+        self.names.extend(names)
+        self.names.sort() # two sorted runs - merged in linear time
+        self.changePersistentIndexList(persistent, [self.index(bisect.bisect_left(self.names, name))
+                                                    for name in moved])
+        self.emit(QtCore.SIGNAL('layoutChanged()'))
+    def fetchAll(self):
+        with self.lock:
+            count = len(self.pending)
+        self.fetchMore(count=count)
+    def sort(self, column=0, order=QtCore.Qt.AscendingOrder):
+        '''sort the names, keeping persistent indexes (e.g. the combobox selection) on their image'''
+        self.emit(QtCore.SIGNAL('layoutAboutToBeChanged()'))
+        old_names = list(self.names)
+        self.names.sort(reverse=order == QtCore.Qt.DescendingOrder)
+        persistent = self.persistentIndexList()
+        if persistent:
+            new_rows = dict((name, row) for row, name in enumerate(self.names))
+            self.changePersistentIndexList(persistent, [self.index(new_rows[old_names[index.row()]])
+                                                        for index in persistent])
+        self.emit(QtCore.SIGNAL('layoutChanged()'))
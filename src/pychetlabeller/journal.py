@@ -0,0 +1,125 @@
+"""
+Append-only journal of annotation edits.
+Every add or remove appends one short line to <label basename>.journal, so an edit
+costs the same however many shapes the image has and a crash loses nothing. The
+journal holds the edits made since the label files were last written: it is
+replayed on top of them when the image is loaded, and emptied once they are
+rewritten (compaction).
+Label files are rewritten in the background, so compaction first rotates the journal
+into a numbered segment (<label basename>.journal.1, .2, ...) and keeps appending to
+a fresh one. The segments are deleted once the files holding their edits are written,
+and replayed before the journal if a crash came first.
+
+Records are '+' or '-', the shape type and the shape fields without the id, e.g.
+    +,circle,120.5,88,14,1
+Ids are not stored as they are reassigned whenever a label file is loaded, so a
+removal matches the first shape with the same type and fields.
+"""
+
+import os
+import threading
+
+JOURNAL_SUFFIX = '.journal'
+
+segment_lock = threading.Lock() # segments are rotated on the GUI thread and removed by the autosave thread
+
+def shape_key(kind, fields):
+    '''(kind, formatted fields) - fields formatted as the label CSV stores them, so shapes
+    read back from a label file match their journal records'''
+    return (kind,) + tuple('%.12g' % value for value in fields)
+
+class Journal(object):
+    '''Edit journal for one image's label files'''
+    def __init__(self, label_basename, threshold=1000):
+        self.label_basename = label_basename
+        self.path = label_basename + JOURNAL_SUFFIX
+        self.threshold = threshold # records after which the journal should be compacted
+        self.records = 0 # records appended since the journal was last emptied
+        self.file = None # opened on the first append
+    def append(self, op, datum):
+        '''record the addition ('+') or removal ('-') of a LabelShape'''
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.file = open(self.path, 'a')
+        self.file.write(','.join((op,) + shape_key(datum.kind, datum.serialize()[1:])) + '\n')
+        self.file.flush()
+        self.records += 1
+    @property
+    def needs_compaction(self):
+        return self.records >= self.threshold
+    def segments(self):
+        '''paths of the rotated segments, oldest first - numbered from 1 without gaps'''
+        paths = []
+        while os.path.exists('%s.%d' % (self.path, len(paths) + 1)):
+            paths.append('%s.%d' % (self.path, len(paths) + 1))
+        return paths
+    def rotate(self):
+        '''move the edits so far into a new segment, returning the paths of every segment -
+        they can be deleted once the dataset holding their edits is written'''
+        self.close()
+        self.records = 0
+        with segment_lock:
+            segments = self.segments()
+            if os.path.exists(self.path):
+                segments.append('%s.%d' % (self.path, len(segments) + 1))
+                os.rename(self.path, segments[-1])
+        return segments
+    def replay(self, dataset):
+        '''apply the journalled edits (segments first) to dataset, returning the number applied'''
+        lines = []
+        for path in self.segments() + [self.path]:
+            try:
+                lines.extend(open(path).read().splitlines())
+            except IOError:
+                pass # no journal
+        if not lines:
+            return 0
+        removals = [line for line in lines if line.startswith('-')]
+        existing = {} # shape key -> LabelShapes in dataset, only needed for removals
+        if removals:
+            for datum in dataset:
+                existing.setdefault(shape_key(datum.kind, datum.serialize()[1:]), []).append(datum)
+        applied = 0
+        for line in lines:
+            fields = line.split(',')
+            if len(fields) < 3 or fields[0] not in '+-':
+                continue # torn final line
+            op, key = fields[0], tuple(fields[1:])
+            try:
+                if op == '+':
+                    kind, values = fields[1], [float(value) for value in fields[2:]]
+                    dataset.add_row(kind, values[:-1], int(values[-1]))
+                    if removals:
+                        existing.setdefault(key, []).append(dataset.last())
+                else:
+                    dataset.remove(existing[key].pop(0))
+            except (ValueError, KeyError, IndexError, TypeError):
+                print "WARNING: Skipped a journal record '%s'" % line
+                continue
+            applied += 1
+        self.records = len(lines)
+        return applied
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    def clear(self):
+        '''delete the edits made since the last rotation - they cancel out'''
+        self.close()
+        self.records = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    def remove(self):
+        '''delete the journal and its segments - their edits are in the label files (or discarded)'''
+        self.clear()
+        remove_segments(self.segments())
+
+def remove_segments(paths):
+    '''delete rotated segments once their edits are in the label files - newest first, so the
+    segments left by an interruption are still numbered from 1'''
+    with segment_lock:
+        for path in reversed(paths):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,84 @@
+"""
+Reading and writing label CSV files.
+Each row is id, geometry, label id - circles: id, x, y, r, label; rectangles: id, x, y, dx, dy, label.
+By default a file has no header and holds a single shape type, which the reader has to
+be told - the format every version of the labeller reads.
+The typed format (version 2) is written when asked for, or when a dataset holds both
+shape types. It starts with a header, and has one section per shape type:
+    #pychetlabeller labels 2
+    #shape circle
+    0,120.5,88,14,1
+    2,40,40,9,1
+    #shape rectangle
+    1,10,20,30,40,2
+The rows are grouped by type, so the loader restores the order the shapes were added in
+by sorting on the id column, once for the whole file. Readers from before version 2
+cannot read typed files: they fail on the header line.
+Files are parsed a section at a time into NumPy arrays rather than row by row
+(NumPy is imported on the first parse).
+"""
+
+import os
+import re
+import sys
+
+VERSION = 2
+HEADER = '#pychetlabeller labels %d' % VERSION
+SECTION = '#shape %s'
+FIELDS = {'circle': 5, 'rectangle': 6} # columns per row, including id and label
+
+_header = re.compile(r'^#pychetlabeller labels (\d+)')
+_section = re.compile(r'^#shape[ \t]+(\w+)[ \t]*\r?$', re.M)
+
+def atomic_write(path, write):
+    '''call write(temporary_path), then rename the finished file over path'''
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, '.{}.tmp'.format(name))
+    try:
+        write(temp_path)
+        if sys.platform == 'win32' and os.path.exists(path):
+            os.remove(path) # rename does not replace an existing file on Windows
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def parse_rows(lines, columns):
+    '''(n, columns) float array of comma separated rows, skipping rows that do not parse'''
+    import numpy as np
+    if all(line.count(',') == columns - 1 for line in lines):
+        values = np.fromstring(','.join(lines), sep=',')
+        if values.size == len(lines) * columns: # else a field did not parse
+            return values.reshape(len(lines), columns)
+    # Malformed rows somewhere - fall back to parsing row by row
+    rows = []
+    for line in lines:
+        try:
+            row = [float(value) for value in line.split(',')[:columns]]
+        except ValueError:
+            row = []
+        if len(row) < columns:
+            print "WARNING: Skipped a line (ValueError) '%s'" % line
+            continue
+        rows.append(row)
+    return np.array(rows, float).reshape(-1, columns)
+
+def parse_labels(text, tool='circle'):
+    '''parse the text of a label file into [(shape type, (n, columns) float array)] in file order
+    Rows before any #shape line (all rows in a headerless file) are of type tool.'''
+    version = _header.match(text)
+    if version and int(version.group(1)) > VERSION:
+        print "WARNING: Label file version %s is newer than %d" % (version.group(1), VERSION)
+    parts = _section.split(text) # [rows, type, rows, type, rows, ...]
+    sections = [(tool, parts[0])] + zip(parts[1::2], parts[2::2])
+    result = []
+    for kind, body in sections:
+        lines = [line for line in body.splitlines() if line.strip() and not line.startswith('#')]
+        if not lines:
+            continue
+        if kind not in FIELDS:
+            print "WARNING: Skipped %d rows of unknown shape type '%s'" % (len(lines), kind)
+            continue
+        result.append((kind, parse_rows(lines, FIELDS[kind])))
+    return result
@@ -6,99 +6,29 @@ Annotate using circular or rectangular shapes
 
 import sys
 import os
-import csv
 import argparse
 import numpy as np
-import svgwrite
 
 from PyQt4 import QtGui, QtCore
-from shapely.geometry import Point, box # Polygon
 from .labeller_ui import Ui_MainWindow
+from .dataset import LabelDataset, LabelShape, LabelCircle, LabelRectangle, SHAPE_TYPES # re-exported
+from .labelmap import my_colormap, parse_labelmap # my_colormap re-exported
+from .qtimage import convertQImageToMat, convertMattoQImage, adjustImage, adjustPixmap
+from .pipeline import AdjustmentPipeline
+from .imagecache import ImageCache, decodeSizeForZoom
+from .tiles import TiledImage
+from .autosave import AutosaveWriter
+from .journal import Journal, remove_segments
+from .manifest import Manifest
+from .imagelist import ImageListModel
+from .annotationmodel import AnnotationModel
+from .profiling import profiler, DEFAULT_REPORT
 
 __author__ = 'suchet'
 __date__ = '04/08/16' 
 
-my_colormap = [\
-[137, 0, 255], 
-[255, 0, 0], 
-[179, 179, 0], 
-[0, 255, 151], 
-[0, 193, 255], 
-[0, 27, 255], 
-[137, 0, 255], 
-[255, 165, 0], 
-[255, 0, 41], 
-[13, 255, 0], 
-[255, 0, 207]] * 20 # Dirty hack to cater for more than 10 objects - will have same colours
 label_dataset = None
 
-class LabelDataset(object):
-    '''shape-label dataset class'''
-    def __init__(self, image_path, image_size, labelmap=''):
-        self.data = []
-        self.image_size = image_size
-        self.image_path = image_path
-        self.label_path = None
-        self.labelmap = labelmap
-    def add(self, datum):
-        ''' add a LabelShape to the dataset'''
-        assert isinstance(datum, LabelShape)
-        self.data.append(datum)
-    def remove(self, datum):
-        '''remove a LabelShape to the dataset'''
-        assert isinstance(datum, LabelShape)
-        self.data.remove(datum)
-    def save(self, label_basename):
-        '''Save the dataset'''
-        self.saveSVG(label_basename + '.svg')
-        self.saveCSV(label_basename + '.csv')
-    def saveSVG(self, output_filename):
-        """Save the shapes in SVG format"""
-        dwg = svgwrite.Drawing(output_filename, profile='tiny', size=self.image_size)
-        for datum in self.data:
-            dwg.add(datum.svg_shape())
-        dwg.save()
-    def saveCSV(self, output_filename, field_delimiter=',', line_delimiter='\n'):
-        """Save the shapes as CSV"""
-        with open(output_filename, 'w') as f:
-            for datum in self.data:
-                serialized = [str(i) for i in datum.serialize()]
-                f.write(field_delimiter.join(serialized) + line_delimiter)
-    def load(self, label_path, tool='circle'):
-        '''try load the default path, or given label_path'''
-        self.label_path = label_path
-        try:
-            label_file = open(self.label_path, 'r')
-        except IOError:
-            return False # Couldn't find file
-        for line in csv.reader(label_file):
-            try:
-                #is_circle = True #TODO: complete stub
-                if tool == 'circle':
-                    label_id = int(line[4])
-                    label_name = self.labelmap[ [x['object_id'] for x in self.labelmap].index(label_id) ]['object_name']
-                    self.add(LabelCircle(int(line[4]), float(line[1]), float(line[2]), float(line[3]), label_name=label_name))
-                elif tool == 'rectangle':
-                    label_id = int(line[5])
-                    label_name = self.labelmap[ [x['object_id'] for x in self.labelmap].index(label_id) ]['object_name']
-                    self.add(LabelRectangle(int(line[5]), float(line[1]), float(line[2]), float(line[3]), float(line[4]), label_name=label_name))
-            except ValueError:
-                # Things that don't convert will be skipped
-                if line[0][0] != '#': # ignore comments
-                    print "WARNING: Skipped a line (ValueError) '%s'" % line
-        label_file.close()
-    def find(self, labelshape_id):
-        '''find a LabelShape given by ID'''
-        results = [datum for datum in self.data if datum.id == labelshape_id]
-        if len(results):
-            return results[0]
-        return None
-    def data_at(self, position):
-        '''return all the data that lie at a point'''
-        point = Point(position[0], position[1])
-        results = [datum for datum in self.data if point.within(datum.shape)]
-        return results
-
 # class Command(object):
 #     '''Superclass for editor commands'''
 #     def __init__(self, **kwargs):
@@ -116,6 +46,9 @@ class Tool(object):
         pass
     def paint(self, parent, QPainter, QStyleOptionGraphicsItem, QWidget):
         raise NotImplementedError("Tool::paint")
+    def outline(self):
+        '''rect (in image coordinates) covered by what paint draws'''
+        return QtCore.QRectF()
     def mouse_move(self, parent, pos):
         self.position = pos
     def key_down(self, parent, event):
@@ -145,35 +78,35 @@ class Tool_Circle(Tool):
                 parent.highlight(datum[0])
         elif modifiers == QtCore.Qt.NoModifier and button == QtCore.Qt.LeftButton:
             parent.add_datum(LabelCircle(self.label, point[0], point[1], self.radius,
-                label_name=self.labelmap[ [x['object_id'] for x in self.labelmap].index(self.label) ]['object_name']))
+                label_name=self.labelmap.name(self.label)))
     def wheel(self, parent, QWheelEvent):
         delta = QWheelEvent.delta()
         self.radius += np.sign(delta) * self.radius_scroll_delta
-        parent.update()
+        parent.refresh_tool()
         super(Tool_Circle, self).wheel(parent, QWheelEvent)
     def paint(self, parent, QPainter, QStyleOptionGraphicsItem, QWidget):
         QPainter.drawEllipse(
             self.position.x() - self.radius
             , self.position.y() - self.radius
             , 2 * self.radius, 2 * self.radius)
+    def outline(self):
+        return QtCore.QRectF(self.position.x() - self.radius, self.position.y() - self.radius,
+                             2 * self.radius, 2 * self.radius)
     def enable(self, parent):
         # parent.setCursor(QtGui.QCursor(QtCore.Qt.ArrowCursor))
         parent.setCursor(QtGui.QCursor(QtCore.Qt.CrossCursor))
     def key_down(self, parent, event):
         key = event.key()
-        if key == QtCore.Qt.Key_Backspace and len(label_dataset.data):
-            shape = label_dataset.data[-1]
-            parent.imagePanel.remove_datum(shape, from_tree=True)
+        if key == QtCore.Qt.Key_Backspace and len(label_dataset):
+            shape = label_dataset.last()
+            parent.imagePanel.remove_datum(shape)
             parent.update()
             parent.imagePanel.update()
-            parent.ui.treeWidget.update()
         else:
             keystr = str(QtCore.QString(QtCore.QChar(key))).lower()
-            shortcuts = [x['keyboard_shortcut'] for x in self.labelmap]
-            if keystr and keystr in shortcuts:
-                _label = shortcuts.index(keystr)
-                label = self.labelmap[_label]['object_id']
-                self.label = int(label)
+            label = self.labelmap.label_for_shortcut(keystr) if keystr else None
+            if label is not None:
+                self.label = label
                 parent.ui.item_label_txt.setText(keystr)
             # if keystr and any([keystr == chr(i) for i in xrange(ord('0'), 1 + ord('9'))]):
             #     self.label = int(keystr)
@@ -204,7 +137,7 @@ class Tool_Rectangle(Tool):
             if self.mode == Tool_Rectangle.MODE_CENTRE:
                 point = (self.position.x() - self.dx // 2, self.position.y() - self.dy // 2)
             parent.add_datum(LabelRectangle(self.label, point[0], point[1], self.dx, self.dy, 
-                label_name=self.labelmap[ [x['object_id'] for x in self.labelmap].index(self.label) ]['object_name']))
+                label_name=self.labelmap.name(self.label)))
     def wheel(self, parent, QWheelEvent):
         delta = QWheelEvent.delta()
         modifiers = QtGui.QApplication.keyboardModifiers()
@@ -218,37 +151,39 @@ class Tool_Rectangle(Tool):
                 self.dx = max(1, self.dx * (1 + np.sign(delta) * self.size_scroll_delta))
             if self.resize_dim & Tool_Rectangle.RESIZE_Y:
                 self.dy = max(1, self.dy * (1 + np.sign(delta) * self.size_scroll_delta))
-        parent.update()
+        parent.refresh_tool()
         super(Tool_Rectangle, self).wheel(parent, QWheelEvent)
     def paint(self, parent, QPainter, QStyleOptionGraphicsItem, QWidget):
         if self.mode == Tool_Rectangle.MODE_EDGE:
             QPainter.drawRect(self.position.x(), self.position.y(), self.dx, self.dy)
         elif self.mode == Tool_Rectangle.MODE_CENTRE:
             QPainter.drawRect(self.position.x() - self.dx // 2, self.position.y() - self.dy // 2, self.dx, self.dy)
+    def outline(self):
+        if self.mode == Tool_Rectangle.MODE_CENTRE:
+            return QtCore.QRectF(self.position.x() - self.dx // 2, self.position.y() - self.dy // 2, self.dx, self.dy)
+        return QtCore.QRectF(self.position.x(), self.position.y(), self.dx, self.dy)
     def enable(self, parent):
         # parent.setCursor(QtGui.QCursor(QtCore.Qt.ArrowCursor))
         parent.setCursor(QtGui.QCursor(QtCore.Qt.CrossCursor))
     def key_down(self, parent, event):
         key = event.key()
-        if key == QtCore.Qt.Key_Backspace and len(label_dataset.data):
-            shape = label_dataset.data[-1]
-            parent.imagePanel.remove_datum(shape, from_tree=True)
+        if key == QtCore.Qt.Key_Backspace and len(label_dataset):
+            shape = label_dataset.last()
+            parent.imagePanel.remove_datum(shape)
             parent.update()
             parent.imagePanel.update()
-            parent.ui.treeWidget.update()
         elif key == QtCore.Qt.Key_F2:
             self.mode = 1 - self.mode
+            parent.imagePanel.refresh_tool()
         elif key == QtCore.Qt.Key_Q:
             self.resize_dim = Tool_Rectangle.RESIZE_X
         elif key == QtCore.Qt.Key_A:
             self.resize_dim = Tool_Rectangle.RESIZE_Y
         else:
             keystr = str(QtCore.QString(QtCore.QChar(key))).lower()
-            shortcuts = [x['keyboard_shortcut'] for x in self.labelmap]
-            if keystr and keystr in shortcuts:
-                _label = shortcuts.index(keystr)
-                label = self.labelmap[_label]['object_id']
-                self.label = int(label)
+            label = self.labelmap.label_for_shortcut(keystr) if keystr else None
+            if label is not None:
+                self.label = label
                 parent.ui.item_label_txt.setText(keystr)
             # if keystr and any([keystr == chr(i) for i in xrange(ord('0'), 1 + ord('9'))]):
             #     self.label = int(keystr)
@@ -288,85 +223,6 @@ class Tool_Polygon(Tool):
     '''not yet implemented'''
     pass #
 
-class LabelShape(object):
-    '''base class of all data'''
-    instances = 0
-    def __init__(self, label, shape, label_name=''):
-        self.label = label
-        self.label_name = label_name
-        self.shape = shape
-        self.id = LabelShape.instances
-        LabelShape.instances += 1
-    def populate_view(self, view, **kwargs):
-        pass
-    def __hash__(self):
-        return self.id
-    def __cmp__(self, other):
-        if self.id > other.id:
-            return 1
-        elif self.id < other.id:
-            return -1
-        return 0
-    def serialize(self):
-        raise Exception("serialize UNIMPLEMENTED for this type")
-
-class LabelRectangle(LabelShape):
-    enum = 1
-    def __init__(self, label, x, y, dx, dy, label_name=''):
-        rectangle = box(x, y, x+dx, y+dy)
-        super(LabelRectangle, self).__init__(label, rectangle, label_name=label_name)
-    def get_rect_data(self):
-        x1, y1, x2, y2 = self.shape.bounds
-        x, y, dx, dy = x1, y1, x2-x1, y2-y1
-        return x,y,dx,dy
-    def populate_view(self, view, **kwargs):
-        x, y, dx, dy = self.get_rect_data()
-        if isinstance(view, QtGui.QTreeWidgetItem):
-            # NOTE: It is important not to change the first field as it is used for lookup
-            view.setText(0, str(self.id)) 
-            view.setText(1, "(%d, %d)" % (x, y))
-            view.setText(2, "(%d, %d)" % (dx, dy))
-            view.setText(3, str(self.label))
-            view.setText(4, str(self.label_name))
-        elif isinstance(view, QtGui.QPainter):
-            view.drawRect(x, y, dx, dy)
-    def serialize(self):
-        return (self.id,) + self.get_rect_data() + (self.label,)
-    def svg_shape(self):
-        '''return the SVG shape that this object represents'''
-        r, g, b = my_colormap[self.label]
-        x, y, dx, dy = self.get_rect_data()
-        return svgwrite.shapes.Rect(insert=(x, y)
-            , size=(dx,dy), stroke=svgwrite.rgb(r, g, b, 'RGB')
-            , fill=svgwrite.rgb(r, g, b, 'RGB'))
-
-
-class LabelCircle(LabelShape):
-    enum = 1
-    def __init__(self, label, x, y, radius, label_name=''):
-        circle = Point(x, y).buffer(radius)
-        (circle.x, circle.y, circle.radius) = (x, y, radius)
-        super(LabelCircle, self).__init__(label, circle, label_name=label_name)
-    def populate_view(self, view, **kwargs):
-        if isinstance(view, QtGui.QTreeWidgetItem):
-            # NOTE: It is important not to change the first field as it is used for lookup
-            view.setText(0, str(self.id)) 
-            view.setText(1, "(%d, %d)" % (self.shape.x, self.shape.y))
-            view.setText(2, str(self.shape.radius))
-            view.setText(3, str(self.label))
-            view.setText(4, str(self.label_name))
-        elif isinstance(view, QtGui.QPainter):
-            (x, y) = (self.shape.x - self.shape.radius, self.shape.y - self.shape.radius)
-            side_width = 2*self.shape.radius
-            view.drawEllipse(x , y, side_width, side_width)
-    def serialize(self):
-        return (self.id, self.shape.x, self.shape.y, self.shape.radius, self.label)
-    def svg_shape(self):
-        '''return the SVG shape that this object represents'''
-        r, g, b = my_colormap[self.label]
-        return svgwrite.shapes.Circle(center=(self.shape.x, self.shape.y)
-            , r=self.shape.radius, stroke=svgwrite.rgb(r, g, b, 'RGB')
-            , fill=svgwrite.rgb(r, g, b, 'RGB'))
 
 class SelectDropType(QtGui.QDialog):
     def __init__(self, parent=None):
@@ -378,6 +234,71 @@ class SelectDropType(QtGui.QDialog):
         msgBox.addButton(QtGui.QPushButton('Images'), QtGui.QMessageBox.YesRole)
         self.selection = msgBox.exec_()
 
+class AnnotationLayer(QtGui.QGraphicsItem):
+    """The committed annotations, drawn over the image panel. Qt caches the layer at device
+    resolution, so it is only repainted when invalidated or when the zoom changes"""
+    def __init__(self, panel):
+        super(AnnotationLayer, self).__init__(panel)
+        self.panel = panel
+        self.setCacheMode(QtGui.QGraphicsItem.DeviceCoordinateCache)
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.setAcceptedMouseButtons(QtCore.Qt.NoButton) # clicks go to the panel underneath
+    def boundingRect(self):
+        return self.panel.boundingRect()
+    @profiler.timed('AnnotationLayer.paint')
+    def paint(self, QPainter, QStyleOptionGraphicsItem, QWidget):
+        """Draw the annotations intersecting the exposed rect, one batch per label"""
+        panel = self.panel
+        QPainter.setPen(panel.pen)
+        exposed = QStyleOptionGraphicsItem.exposedRect.adjusted(-1, -1, 1, 1) # pen width
+        visible = label_dataset.data_in((exposed.left(), exposed.top(), exposed.right(), exposed.bottom()))
+        groups = {}
+        for datum in visible:
+            if datum is not panel.highlighted_datum:
+                groups.setdefault(datum.label, []).append(datum)
+        for label, data in groups.items():
+            QPainter.setBrush(panel.savebrushes[label])
+            self.draw_batch(QPainter, data)
+        highlighted = panel.highlighted_datum
+        if highlighted is not None and highlighted in visible:
+            QPainter.setBrush(panel.highlightbrushes[highlighted.label])
+            highlighted.populate_view(QPainter)
+    @staticmethod
+    def draw_batch(QPainter, data):
+        """Draw shapes sharing a brush with one call per shape type"""
+        rects = [QtCore.QRectF(*datum.get_rect_data()) for datum in data if datum.kind == 'rectangle']
+        if rects:
+            QPainter.drawRects(rects)
+        circles = [datum for datum in data if datum.kind == 'circle']
+        if circles:
+            path = QtGui.QPainterPath()
+            path.setFillRule(QtCore.Qt.WindingFill) # overlapping circles stay filled
+            for datum in circles:
+                path.addEllipse(QtCore.QPointF(datum.x, datum.y), datum.radius, datum.radius)
+            QPainter.drawPath(path)
+
+class ToolPreview(QtGui.QGraphicsItem):
+    """Outline of the active tool at the cursor. Moving it repaints only its old and new
+    rects, which the annotation layer fills from its cache"""
+    def __init__(self, panel):
+        super(ToolPreview, self).__init__(panel)
+        self.panel = panel
+        self.rect = QtCore.QRectF()
+        self.setAcceptedMouseButtons(QtCore.Qt.NoButton)
+    def boundingRect(self):
+        return self.rect
+    def refresh(self):
+        '''follow the tool's outline'''
+        pad = 2 # pen width and antialiasing
+        rect = self.panel.tool.outline().adjusted(-pad, -pad, pad, pad)
+        if rect != self.rect:
+            self.prepareGeometryChange() # schedules a repaint of the old rect
+            self.rect = rect
+        self.update()
+    def paint(self, QPainter, QStyleOptionGraphicsItem, QWidget):
+        QPainter.setPen(self.panel.pen)
+        self.panel.tool.paint(self.panel, QPainter, QStyleOptionGraphicsItem, QWidget)
+
 class ObjectDrawPanel(QtGui.QGraphicsPixmapItem):
     """Establish a pixmap item on which labelling (painting) will be performed"""
     def __init__(self, pixmap=None, parent=None, scene=None, tool='circle', labelmap=None):
@@ -387,12 +308,18 @@ class ObjectDrawPanel(QtGui.QGraphicsPixmapItem):
         self.parent = parent # Parent class - ui mainwindow
         self.current_scale = 1.0
         self.defaultColorPixmap = None
+        self.defaultColorImage = None # 32-bit copy of defaultColorPixmap for adjustment
+        self.adjustedImage = None # reused output buffer for brightness/contrast
+        self.previewPixmap = None # reduced resolution stand-in while an adjustment is computed
+        self.tiled = None # TiledImage when the image is too large to hold as one pixmap
+        self.full_size = None # full resolution QSize when the pixmap is a reduced resolution decode
+        self.upgrade_request = None # (zoom level, image path) a sharper decode has been asked for, until it is done
+        self.upgrade_size = None # (width, height) the sharper decode of upgrade_request is made at, once queued
+        self.attempted_lod = 0 # zoom level of the last sharper decode tried - not retried below it
         self.highlighted_datum = None
         # Annotation parameters
         self.opacity = 60 # Opacity of annotation
         self.highlight_opacity = 100
-        # Annotation drawing
-        self.changeMade = None
         # Use arg parse to select tool:
         self.tool_last = Tool_TransformView()
         if tool == 'circle':
@@ -402,16 +329,19 @@ class ObjectDrawPanel(QtGui.QGraphicsPixmapItem):
         else:
             raise ValueError('Input tool {} not valid'.format(tool))
         self.tool.labelmap = labelmap
-        
-        self.num_labels = len(labelmap)
+        self.labelmap = labelmap
         self.pen = None
         #TODO: Tidy brushes
-        self.highlightbrushes = []
-        self.savebrushes = []
+        self.highlightbrushes = {}
+        self.savebrushes = {}
         self.setBrushes()
         # Set up options
         self.setAcceptHoverEvents(True)
         self.setFlag(QtGui.QGraphicsItem.ItemIsMovable, False)
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption, True) # fills in exposedRect
+        # Annotations and the tool outline are child items so they repaint independently
+        self.annotations = AnnotationLayer(self)
+        self.toolPreview = ToolPreview(self)
         self.tool.enable(self)
         self.is_initialised = True
     def change_tool(self, tool=None):
@@ -423,6 +353,52 @@ class ObjectDrawPanel(QtGui.QGraphicsPixmapItem):
             (self.tool, self.tool_last) = (self.tool_last, self.tool)
         self.tool_last.disable(self)
         self.tool.enable(self)
+        self.refresh_tool()
+    def refresh_tool(self):
+        '''repaint the tool outline after the tool moved or changed size'''
+        self.toolPreview.refresh()
+    def invalidate(self):
+        '''repaint the annotation layer after the annotations or their brushes changed'''
+        self.annotations.update()
+    def setBasePixmap(self, pixmap, image=None):
+        """Set the unadjusted image that brightness and contrast are applied to
+        image is an already decoded 32-bit QImage of the pixmap, if one is at hand"""
+        self.defaultColorPixmap = pixmap
+        if image is None or image.size() != pixmap.size():
+            image = pixmap.toImage().convertToFormat(QtGui.QImage.Format_RGB32)
+        self.defaultColorImage = image
+        self.adjustedImage = None
+        self.previewPixmap = None
+    def setTiledImage(self, tiled):
+        """Paint from a tile pyramid (or None to paint the pixmap) - the pixmap becomes its overview,
+        painted under the tiles until they are decoded"""
+        self.prepareGeometryChange()
+        self.annotations.prepareGeometryChange()
+        if self.tiled is not None:
+            self.tiled.close()
+        self.tiled = tiled
+        if tiled is not None:
+            QtCore.QObject.connect(tiled, QtCore.SIGNAL('tileReady()'), self.update)
+    def setImageSize(self, size):
+        """Full resolution size of the image when the pixmap is decoded smaller (None when they match)
+        The item stays in full resolution coordinates - the pixmap is stretched over it - so
+        annotations are kept in original image pixels whatever resolution is on screen"""
+        self.prepareGeometryChange()
+        self.annotations.prepareGeometryChange()
+        self.full_size = size
+        self.upgrade_request = None
+        self.upgrade_size = None
+        self.attempted_lod = 0
+    def boundingRect(self):
+        if self.tiled is not None: # full resolution, whatever the size of the overview pixmap
+            return QtCore.QRectF(0, 0, self.tiled.size.width(), self.tiled.size.height())
+        if self.full_size is not None:
+            return QtCore.QRectF(0, 0, self.full_size.width(), self.full_size.height())
+        return QtGui.QGraphicsPixmapItem.boundingRect(self)
+    def shape(self):
+        path = QtGui.QPainterPath()
+        path.addRect(self.boundingRect())
+        return path
     def zoom(self, delta):
         """Zoom in to image by a fraction delta"""
         self.current_scale = max(self.current_scale + delta, 0.1)
@@ -432,35 +408,44 @@ class ObjectDrawPanel(QtGui.QGraphicsPixmapItem):
         self.pen = QtGui.QPen(QtCore.Qt.SolidLine)
         self.pen.setColor(QtCore.Qt.black)
         self.pen.setWidth(1)
-        self.savebrushes = [
-            QtGui.QBrush(QtGui.QColor(my_colormap[label_no][0],
-            my_colormap[label_no][1],
-            my_colormap[label_no][2],
-            self.opacity)) for label_no in range(self.num_labels)]
-        self.highlightbrushes = [
-            QtGui.QBrush(QtGui.QColor(my_colormap[label_no][0],
-           my_colormap[label_no][1],
-           my_colormap[label_no][2],
-           self.highlight_opacity)) for label_no in range(self.num_labels)]
+        colours = self.labelmap.colours
+        self.savebrushes = dict(
+            (label_no, QtGui.QBrush(QtGui.QColor(r, g, b, self.opacity)))
+            for label_no, (r, g, b) in colours.items())
+        self.highlightbrushes = dict(
+            (label_no, QtGui.QBrush(QtGui.QColor(r, g, b, self.highlight_opacity)))
+            for label_no, (r, g, b) in colours.items())
+    @profiler.timed('ObjectDrawPanel.paint')
     def paint(self, QPainter, QStyleOptionGraphicsItem, QWidget):
         """Painter to draw annotations"""
         if not self.is_initialised:
             return
         # Set image and pen
-        QPainter.drawPixmap(0, 0, self.pixmap())
-        QPainter.setPen(self.pen)
-        self.tool.paint(self, QPainter, QStyleOptionGraphicsItem, QWidget)
-        for datum in label_dataset.data:
-            if datum is self.highlighted_datum:
-                QPainter.setBrush(self.highlightbrushes[datum.label])
-            else:
-                QPainter.setBrush(self.savebrushes[datum.label])
-            datum.populate_view(QPainter)
+        if self.tiled is not None:
+            # Overview stretched under the tiles for the visible part of the image
+            QPainter.drawPixmap(self.boundingRect(), self.pixmap(), QtCore.QRectF(self.pixmap().rect()))
+            lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(QPainter.worldTransform())
+            self.tiled.paint(QPainter, QStyleOptionGraphicsItem.exposedRect, lod)
+        elif self.previewPixmap is not None or self.full_size is not None:
+            # Stretch the preview or reduced resolution image over the full size image
+            pixmap = self.previewPixmap or self.pixmap()
+            QPainter.drawPixmap(self.boundingRect(), pixmap, QtCore.QRectF(pixmap.rect()))
+            if self.full_size is not None:
+                self.checkResolution(QStyleOptionGraphicsItem.levelOfDetailFromTransform(QPainter.worldTransform()))
+        else:
+            QPainter.drawPixmap(0, 0, self.pixmap())
+    def checkResolution(self, lod):
+        """Ask for a sharper decode once the zoom magnifies the reduced resolution pixmap"""
+        if self.upgrade_request is not None or lod <= self.attempted_lod \
+                or lod * self.full_size.width() <= self.pixmap().width():
+            return
+        request = self.upgrade_request = (lod, label_dataset.image_path)
+        QtCore.QTimer.singleShot(0, lambda: self.parent.upgradeResolution(request)) # not while painting
     def hoverMoveEvent(self, event): #QGraphicsSceneHoverEvent
         '''While moving inside the picture, update x,y position for drawing annotation tool
         If instead in moving mode (grab and move image), do nothing.'''
         self.tool.mouse_move(self, event.pos())
-        self.update()
+        self.refresh_tool()
     def mousePressEvent(self, event): # QGraphicsSceneMouseEvent
         self.setFocus()
         self.tool.click(self, event.button())
@@ -472,24 +457,22 @@ class ObjectDrawPanel(QtGui.QGraphicsPixmapItem):
         QtGui.QGraphicsPixmapItem.mouseReleaseEvent(self, event)
     def add_datum(self, label_shape):
         label_dataset.add(label_shape)
-        item = QtGui.QTreeWidgetItem(self.parent.ui.treeWidget)
-        label_shape.populate_view(item)
-        self.changeMade = True
-    def remove_datum(self, label_shape, from_tree=False):
-        if from_tree:
-            tree = self.parent.ui.treeWidget
-            item = tree.findItems(str(label_shape.id), QtCore.Qt.MatchExactly, 0)[0]
-            tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
+        self.parent.annotation_model.added(label_shape)
+        self.parent.journalEdit('+', label_shape)
+        self.invalidate()
+    def remove_datum(self, label_shape):
+        self.parent.annotation_model.removed(label_shape)
         if self.highlighted_datum is label_shape:
             self.highlighted_datum = None
         label_dataset.remove(label_shape)
+        self.parent.journalEdit('-', label_shape)
+        self.invalidate()
     def highlight(self, datum):
         self.highlighted_datum = datum
         if datum:
-            item = self.parent.ui.treeWidget.findItems(str(datum.id), QtCore.Qt.MatchExactly, 0)[0]
-            self.parent.ui.treeWidget.setCurrentItem(item)
-        self.update()
-        self.parent.ui.treeWidget.setFocus()
+            self.parent.ui.treeView.setCurrentIndex(self.parent.annotation_model.indexOf(datum))
+        self.invalidate()
+        self.parent.ui.treeView.setFocus()
 
 class MainWindow(QtGui.QMainWindow):
     """The main window of the GUI - designed using Qt Designer"""
@@ -508,24 +491,61 @@ class MainWindow(QtGui.QMainWindow):
         self.scene = None
         self.imagePanel = None
         self.image_index = None
-        self.images = None
+        self.image_model = None # ImageListModel of the image folder, behind the combobox
+        self.current_image_path = None
+        self.recursive_scan = False # include images in subfolders
+        self.image_glob = None # only list images whose relative path matches this glob
         self.default_directory = os.path.expanduser("~")
         self.folder_image = None
         self.pixmap = None
         self.labelmap = None
         self.tool_str = 'circle'
+        self.columnar = False
+        self.typed_labels = False # write label files in the typed format even when they hold one shape type
+        self.image_cache = ImageCache(parent=self)
+        self.connect(self.image_cache, QtCore.SIGNAL('decoded(PyQt_PyObject)'), self.resolutionDecoded)
+        self.tile_threshold = 64 * 10 ** 6 # images with more pixels than this are tiled
+        self.tile_budget_mb = 256
+        self.image_cache.max_pixels = self.tile_threshold
+        self.reduced_decode = True # decode images to fit the screen, sharper as the view zooms in
+        self.nav_direction = 1 # +1 browsing forwards, -1 backwards - for prefetching
+        self.use_journal = False # keep a crash-safe journal of edits next to the label files
+        self.journal_threshold = 1000 # journal records after which the label files are rewritten
+        self.journal = None
+        self.saved_fingerprint = None # fingerprint of the labels on disk, None if there are none
+        self.queued_fingerprint = None # fingerprint of the newest autosave not yet written, None if none
+        self.writes_avoided = 0 # saves skipped because nothing changed
+        self.manifest = None # label statistics of the label folder
         # Define key and mouse function names
         self.key_alternate_tool = QtCore.Qt.Key_Control
         self.keyPressEvent = self.mainKeyPressEvent
         self.keyReleaseEvent = self.mainKeyReleaseEvent
-        self.ui.treeWidget.keyPressEvent = self.treeKeyPress
-        self.ui.treeWidget.mousePressEvent = self.treeMousePress
+        # Replace the annotation tree widget with a view onto the dataset
+        self.annotation_model = AnnotationModel(self)
+        self.ui.treeView = QtGui.QTreeView(self.ui.frame)
+        self.ui.treeView.setSizePolicy(self.ui.treeWidget.sizePolicy())
+        self.ui.treeView.setObjectName(QtCore.QString.fromUtf8("treeView"))
+        self.ui.treeView.setRootIsDecorated(False)
+        self.ui.treeView.setUniformRowHeights(True)
+        self.ui.treeView.setModel(self.annotation_model)
+        self.ui.verticalLayout_2.insertWidget(self.ui.verticalLayout_2.indexOf(self.ui.treeWidget), self.ui.treeView)
+        self.ui.verticalLayout_2.removeWidget(self.ui.treeWidget)
+        self.ui.treeWidget.deleteLater()
+        del self.ui.treeWidget
+        self.ui.treeView.keyPressEvent = self.treeKeyPress
+        self.ui.treeView.mousePressEvent = self.treeMousePress
         # Redefine graphics view with new class
         self.ui.graphicsView = FitImageGraphicsView(self.ui.centralwidget)
         self.ui.graphicsView.setObjectName(QtCore.QString.fromUtf8("graphicsView"))
         self.ui.gridLayout_3.addWidget(self.ui.graphicsView, 0, 0, 1, 3)
         # Initialise status
         self.ui.statusBar.showMessage('Welcome to the future of image annotation..!')
+        # Brightness/contrast slider events are adjusted off the GUI thread
+        self.adjustment = AdjustmentPipeline(self)
+        # Autosave on navigation writes in the background
+        self.autosave = AutosaveWriter(self)
+        self.connect(self.autosave, QtCore.SIGNAL('saved(PyQt_PyObject)'), self.autosaveWritten)
+        self.connect(self.autosave, QtCore.SIGNAL('failed(PyQt_PyObject)'), self.autosaveFailed)
         # Set graphics screen properties
         self.setscreenproperties()
         # self.ui.graphicsView.viewport().installEventFilter(self)
@@ -533,11 +553,16 @@ class MainWindow(QtGui.QMainWindow):
         # Reset column widths for the tree widget
         columnWidths = [50,80,80,50,80]
         for cidx, cw in enumerate(columnWidths):
-            self.ui.treeWidget.setColumnWidth(cidx, cw)
+            self.ui.treeView.setColumnWidth(cidx, cw)
 
     def connectSignals(self):
         """ Connect all the components on the GUI to respective functions """
         ui = self.ui
+        # Project progress actions (not in the designer file)
+        ui.actionNext_Unlabelled = QtGui.QAction('Next Unlabelled Image', self)
+        ui.actionProgress = QtGui.QAction('Progress', self)
+        ui.menuFIle.insertActions(ui.actionExit_3, [ui.actionNext_Unlabelled, ui.actionProgress])
+        ui.menuFIle.insertSeparator(ui.actionExit_3)
         # handlers: [UI Element, Signal, Handler]
         handlers = [ \
         # Folder/image navigation
@@ -553,6 +578,8 @@ class MainWindow(QtGui.QMainWindow):
          [ui.actionExit_3, QtCore.SIGNAL("triggered()"), self.close],
          [ui.actionAbout, QtCore.SIGNAL("triggered()"), self.aboutWindow],
          [ui.actionLoad_Label, QtCore.SIGNAL("triggered()"), self.loadFromFile],
+         [ui.actionNext_Unlabelled, QtCore.SIGNAL("triggered()"), self.nextUnlabelledImage],
+         [ui.actionProgress, QtCore.SIGNAL("triggered()"), self.showProgress],
          # Annotation tool
          [ui.opacity_slider, QtCore.SIGNAL('valueChanged(int)'), self.change_opacity],
          # Imaging properties
@@ -566,6 +593,8 @@ class MainWindow(QtGui.QMainWindow):
         ui.actionExit_3.setShortcut(QtCore.Qt.Key_Escape)
         ui.actionAbout.setShortcut(QtCore.Qt.Key_F1)
         ui.actionLoad_Label.setShortcut(QtGui.QKeySequence("Ctrl+l"))
+        ui.actionNext_Unlabelled.setShortcut(QtGui.QKeySequence("Ctrl+u"))
+        ui.actionProgress.setShortcut(QtGui.QKeySequence("Ctrl+p"))
         # Drag and drop data
         self.setAcceptDrops(True)
     def dragEnterEvent(self, QDragEnterEvent):
@@ -621,108 +650,238 @@ class MainWindow(QtGui.QMainWindow):
     def treeMousePress(self, event):
         """ Mouse events on the tree - select annotations """
         # Check if mouse selected gives a valid item
-        item = self.ui.treeWidget.indexAt(event.pos())
-        if item.isValid():
-            QtGui.QTreeWidget.mousePressEvent(self.ui.treeWidget, event)
-            selected_item = self.ui.treeWidget.currentItem()
-            datum = label_dataset.find(int(selected_item.text(0)))
-            self.imagePanel.highlight(datum)
+        index = self.ui.treeView.indexAt(event.pos())
+        if index.isValid():
+            QtGui.QTreeView.mousePressEvent(self.ui.treeView, event)
+            self.imagePanel.highlight(self.annotation_model.datum(self.ui.treeView.currentIndex()))
     def treeKeyPress(self, event):
         """ Keyboard events on the tree - move through annotations or delete them """
-        selected_item = self.ui.treeWidget.currentItem()
-        if selected_item is None:
+        view, model = self.ui.treeView, self.annotation_model
+        current = view.currentIndex()
+        if not current.isValid():
             return
         key = event.key()
-        datum = label_dataset.find(int(selected_item.text(0)))
+        datum = model.datum(current)
         do_update = True
         if key == QtCore.Qt.Key_Delete and datum is not None:
-            next_item = self.ui.treeWidget.itemAbove(selected_item)
+            row = current.row()
             self.imagePanel.remove_datum(datum)
-            if next_item:
-                self.ui.treeWidget.setCurrentItem(next_item)
-            self.ui.treeWidget.takeTopLevelItem(self.ui.treeWidget.indexOfTopLevelItem(selected_item))
+            if row > 0:
+                view.setCurrentIndex(model.index(row - 1, 0))
         elif key in [QtCore.Qt.Key_Down, QtCore.Qt.Key_Up]:
             # Navigate through items - highlighting the current selection on the image
-            if key == QtCore.Qt.Key_Up:
-                next_item = self.ui.treeWidget.itemAbove(selected_item)
-            else:
-                next_item = self.ui.treeWidget.itemBelow(selected_item)
-            if next_item:
-                self.ui.treeWidget.setCurrentItem(next_item)
+            row = current.row() + (-1 if key == QtCore.Qt.Key_Up else 1)
+            if 0 <= row < model.rowCount():
+                view.setCurrentIndex(model.index(row, 0))
         else:
             do_update = False
         if do_update:
             self.update()
             self.imagePanel.update()
-            self.ui.treeWidget.update()
+            view.update()
     def change_opacity(self, value):
         """ From the slider, change the opacity of the current annotations """
         self.ui.opacityBox.setTitle('Label Opacity: {}'.format(value))
         self.imagePanel.opacity = value
         self.imagePanel.setBrushes()
-        self.imagePanel.update()
+        self.imagePanel.invalidate()
+    @profiler.timed('change_brightness_contrast')
     def change_brightness_contrast(self):
-        """ Grab slider values and change brightness and contrast of the image """
+        """ Grab slider values and change brightness and contrast of the image (synchronously) """
+        self.adjustment.cancel()
         # Get current contrast and brightness
         b_value = self.ui.brightness_slider.value()
         c_value = self.ui.contrast_slider.value()
-        # Apply transformation
-        pixmap = adjustPixmap(self.imagePanel.defaultColorPixmap, brightness=b_value, contrast=c_value)
-        self.imagePanel.setPixmap(pixmap)
+        panel = self.imagePanel
+        if panel.tiled is not None:
+            panel.tiled.set_adjustment(b_value, c_value)
+            panel.update()
+        if b_value == 0 and c_value == 0:
+            panel.setPixmap(panel.defaultColorPixmap)
+            return
+        # Apply transformation into the panel's reusable output image
+        panel.adjustedImage = adjustImage(panel.defaultColorImage, brightness=b_value, contrast=c_value,
+                                          out=panel.adjustedImage)
+        panel.setPixmap(QtGui.QPixmap.fromImage(panel.adjustedImage))
     def change_brightness(self, value):
         """ From the slider, change the brightness of the current image """
         self.ui.brightness_box.setTitle('Brightness: {}'.format(value))
-        self.change_brightness_contrast()
+        self.request_brightness_contrast()
     def change_contrast(self, value):
         """ From the slider, change the contrast of the current image """
         self.ui.contrast_box.setTitle('Contrast: {}'.format(value))
-        self.change_brightness_contrast()
-    def initImage(self, pixmap):
+        self.request_brightness_contrast()
+    def request_brightness_contrast(self):
+        """ Adjust to the slider values in the background - tiled images only adjust the
+        visible tiles and their overview, so they are cheap enough to do directly """
+        if self.imagePanel is not None and self.imagePanel.tiled is not None:
+            self.change_brightness_contrast()
+        else:
+            self.adjustment.request(self.ui.brightness_slider.value(), self.ui.contrast_slider.value())
+    def initImage(self, pixmap, size=None):
         """ Load the first image onto graphics view - initialise graphics item """
         # Save original image size
-        self.original_size = pixmap.width(), pixmap.height()
+        size = size or pixmap.size()
+        self.original_size = size.width(), size.height()
         self.firstImage = False
         # Set scene and add to graphics view
         self.scene = QtGui.QGraphicsScene()
         self.imagePanel = ObjectDrawPanel(scene=self.scene, parent=self, tool=self.tool_str, labelmap=self.labelmap)
         self.imagePanel.setPixmap(self.pixmap)
-        self.imagePanel.defaultColorPixmap = self.pixmap
+        self.imagePanel.setBasePixmap(self.pixmap)
         self.change_brightness_contrast()
         self.scene.addItem(self.imagePanel)
         self.ui.graphicsView.setScene(self.scene)
         self.ui.graphicsView.setSceneRect(0, 0, \
             self.ui.graphicsView.size().width() - 10, \
             self.ui.graphicsView.size().height() - 10)
+    @profiler.timed('populateTree')
     def populateTree(self):
-        """ Update the tree when a new annotation is added """
-        self.ui.treeWidget.clear()
-        for datum in label_dataset.data:
-            datum.populate_view(QtGui.QTreeWidgetItem(self.ui.treeWidget))
+        """ Show the annotations of the current dataset in the tree """
+        self.annotation_model.setDataset(label_dataset)
+    @profiler.timed('loadImage')
     def loadImage(self, image_path):
         """ Given an image path, load image onto graphics item """
         global label_dataset
-        # Get current pixmap
-        self.pixmap = QtGui.QPixmap(image_path)
+        self.leaveJournal()
+        # Very large images are painted from a tile pyramid, with a small overview as the pixmap
+        size = QtGui.QImageReader(image_path).size()
+        tiled = None
+        if self.tile_threshold and size.width() * size.height() > self.tile_threshold:
+            tiled = TiledImage(image_path, budget_mb=self.tile_budget_mb)
+            image = tiled.overview()
+        else:
+            # Get current pixmap - decoded ahead of time by the image cache where possible,
+            # at no more than screen resolution
+            self.image_cache.max_size = self.screenSize() if self.reduced_decode else None
+            image = self.image_cache.get(image_path)
+            if not size.isValid(): # the format does not give its size without decoding
+                size = image.size()
+        self.pixmap = QtGui.QPixmap.fromImage(image)
         pixmap = self.pixmap
-        label_dataset = LabelDataset(image_path, image_size=(pixmap.height(), pixmap.width()), labelmap=self.labelmap)
+        label_dataset = LabelDataset(image_path, image_size=(size.height(), size.width()), labelmap=self.labelmap,
+                                     columnar=self.columnar, typed=self.typed_labels)
         if self.firstImage \
-            or pixmap.width() != self.original_size[0] \
-            or pixmap.height() != self.original_size[1]:
-            self.initImage(pixmap)
-        # Resize according to previous shape/size
-        if self.original_size is not None:
-            pixmap = pixmap.scaled(QtCore.QSize(self.original_size[0], self.original_size[1]), \
-                QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+            or size.width() != self.original_size[0] \
+            or size.height() != self.original_size[1]:
+            self.initImage(pixmap, size=size)
+        self.imagePanel.setTiledImage(tiled)
+        self.imagePanel.setImageSize(size if tiled is None and image.size() != size else None)
         self.imagePanel.setPixmap(pixmap)
-        self.imagePanel.defaultColorPixmap = pixmap
+        self.imagePanel.setBasePixmap(pixmap, image=image)
         self.change_brightness_contrast()
-        # Reset change status - To allow for auto saving of images without any fruits
-        self.imagePanel.changeMade = True
+        # No labels on disk yet - so an image without any fruits is still saved
+        self.saved_fingerprint = None
+        self.queued_fingerprint = None
         # Load annotation if on already exists (and if autoload is ticked)
         #@TODO: First image does not auto-load annotations because UI is not init'd yet @priority: low
         if self.ui.autoload_chk.isChecked():
             self.loadAnnotations()
+        self.openJournal()
         self.populateTree()
+        self.imagePanel.invalidate()
+    def screenSize(self):
+        """(width, height) of the screen the window is on - images are decoded to fit it"""
+        size = QtGui.QApplication.desktop().screenGeometry(self).size()
+        return size.width(), size.height()
+    def upgradeResolution(self, request):
+        """Have the image cache worker decode the current image again at the resolution the zoom
+        level of request (see ObjectDrawPanel.checkResolution) needs - full resolution once it
+        nears 1:1. The decode is swapped in by resolutionDecoded"""
+        panel = self.imagePanel
+        if request is not panel.upgrade_request: # superseded, e.g. by loading another image
+            return
+        lod, image_path = request
+        full_size = panel.full_size
+        if full_size is None or image_path != label_dataset.image_path:
+            panel.upgrade_request = None
+            return
+        panel.attempted_lod = lod # a failed or no sharper decode is not retried at this zoom
+        panel.upgrade_size = decodeSizeForZoom(full_size, lod)
+        self.image_cache.decode(image_path, panel.upgrade_size)
+    def resolutionDecoded(self, decoded):
+        """Show the sharper decode asked for by upgradeResolution - the request is cleared whichever
+        way this returns, so later zooms can ask again"""
+        image_path, max_size, image = decoded
+        panel = self.imagePanel
+        request = panel.upgrade_request
+        if request is None or (request[1], panel.upgrade_size) != (image_path, max_size): # superseded
+            return
+        try:
+            full_size = panel.full_size
+            if full_size is None or image_path != label_dataset.image_path:
+                return
+            if image.isNull() or image.width() <= panel.pixmap().width():
+                return
+            pixmap = QtGui.QPixmap.fromImage(image)
+            panel.setPixmap(pixmap)
+            panel.setBasePixmap(pixmap, image=image)
+            panel.setImageSize(full_size if image.size() != full_size else None)
+            self.change_brightness_contrast()
+            panel.update()
+        finally:
+            panel.upgrade_request = panel.upgrade_size = None
+    def labelsLoaded(self, label_basename):
+        """True if the dataset started from the label files of label_basename - they were loaded or
+        saved, or there are none - so writing it over them loses nothing"""
+        return self.saved_fingerprint is not None or self.queued_fingerprint is not None or not any(
+            os.path.exists(label_basename + extension) for extension in ('.csv', '.svg'))
+    def labelsSaved(self):
+        """True if the label files hold the current labels, or will once the queued autosave is written"""
+        if self.queued_fingerprint is not None: # it will overwrite what is on disk
+            return label_dataset.fingerprint() == self.queued_fingerprint
+        return label_dataset.fingerprint() == self.saved_fingerprint
+    def openJournal(self):
+        """Start the edit journal of the current image, replaying edits left by a crash on top of its
+        labels - the journal of labels that were not loaded is kept for when they are"""
+        if not self.use_journal:
+            return
+        label_basename = self.labelBasename()
+        self.autosave.flush(label_basename) # a queued save removes journal segments when written
+        if not self.labelsLoaded(label_basename):
+            self.ui.statusBar.showMessage('Edits are not journalled: the labels of {} were not loaded'.format(
+                os.path.basename(label_basename)))
+            return
+        self.journal = Journal(label_basename, threshold=self.journal_threshold)
+        recovered = self.journal.replay(label_dataset)
+        if recovered:
+            self.ui.statusBar.showMessage('Recovered {} unsaved edits from {}'.format(recovered, self.journal.path))
+    def journalEdit(self, op, datum):
+        """Record an edit in the journal, compacting it into the label files once it grows long"""
+        journal = self.journal
+        if journal is None:
+            return
+        journal.append(op, datum)
+        if journal.needs_compaction and self.labelsLoaded(journal.label_basename):
+            self.saveInBackground(journal.label_basename, journal)
+    def leaveJournal(self):
+        """Fold the journal into the label files on leaving its image (unless the autosave already
+        has) - it is kept for replay if the labels it applies to were not loaded"""
+        journal, self.journal = self.journal, None
+        if journal is None:
+            return
+        if self.labelsSaved():
+            self.dropJournal(journal) # its edits cancel out, or are in a queued save
+        elif self.labelsLoaded(journal.label_basename):
+            self.saveInBackground(journal.label_basename, journal)
+        journal.close()
+    def dropJournal(self, journal):
+        """Delete a journal whose edits cancel out - with its segments, unless a queued save holds them
+        (they are deleted once it is written, and kept for replay if it fails)"""
+        if self.autosave.queued(journal.label_basename):
+            journal.clear()
+        else:
+            journal.remove()
+    def saveInBackground(self, label_basename, journal=None):
+        """Hand a snapshot of the labels to the autosave thread - the journalled edits it holds are
+        rotated out of journal, and deleted once it is written (see autosaveWritten)"""
+        segments = journal.rotate() if journal is not None else []
+        snapshot = label_dataset.snapshot()
+        def done():
+            remove_segments(segments)
+            self.recordSave(label_basename, snapshot)
+        self.autosave.submit(label_basename, snapshot, done=done)
+        self.queued_fingerprint = snapshot.fingerprint()
     def previousImage(self):
         """ Navigate to previous image in the folder """
         self.nextImage(delta=-1)
@@ -730,32 +889,51 @@ class MainWindow(QtGui.QMainWindow):
         """ Navigate to next image in the folder """
         # Save annotations if needed
         self.imagePanel.current_scale = 1.0
-        if self.ui.autosave_chk.isChecked() and self.imagePanel.changeMade:
-            self.saveAnnotations()
+        self.nav_direction = 1 if delta > 0 else -1
+        if self.ui.autosave_chk.isChecked():
+            self.saveAnnotations(background=True)
         # Change entry in combobox
+        model = self.image_model
+        if model is not None:
+            model.fetchAll() # names found since the last fetch may sort between this image and the next
         index = self.ui.imageComboBox.currentIndex() + delta
         if index < 0:
             index = 0
         self.ui.imageComboBox.setCurrentIndex(index)
+    @property
+    def images(self):
+        """Image paths (relative to the image folder) listed so far"""
+        return self.image_model.names if self.image_model is not None else None
     def changeImage(self, text):
         """ Call load image and set new image as title, combo box entry and image # """
-        self.loadImage("%s/%s" % (self.folder_image, text))
+        image_path = "%s/%s" % (self.folder_image, text)
+        if image_path == self.current_image_path: # e.g. the list was re-sorted under it
+            return
+        self.current_image_path = image_path
+        self.loadImage(image_path)
         self.setWindowTitle("{} - Pychet Object Annotator [{}]".format(self.ui.imageComboBox.currentText(), self.tool_str))
-        self.image_index = self.ui.imageComboBox.currentIndex()
-        self.ui.image_index_label.setText('{:.0f}/{:.0f}'.format(self.image_index+1, self.ui.imageComboBox.count()))
+        self.updateImageIndex()
+        # Decode the neighbouring images in the background
+        self.image_cache.prefetch_around(self.images, self.image_index, self.nav_direction, self.folder_image)
     def openImageDirectory(self, folder_image=None):
         """ Open browser containing the set of images to be labelled """
         opendirectory = self.folder_image or self.default_directory
         self.folder_image = folder_image or \
             str(QtGui.QFileDialog.getExistingDirectory(self, "Open directory", opendirectory))
-        # Grab images and set up combobox
-        self.images = sorted([x for x in os.listdir(self.folder_image) \
-            if os.path.splitext(x)[-1].lower() \
-            in ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']])
-        self.ui.imageComboBox.clear()
-        self.ui.imageComboBox.addItems(self.images)
+        # Read the folder in the background - the combobox shows the first image as soon as it is found
+        self.image_model = ImageListModel(self.folder_image, recursive=self.recursive_scan, pattern=self.image_glob)
+        self.connect(self.image_model, QtCore.SIGNAL('progress()'), self.updateImageIndex)
+        self.current_image_path = None
+        self.openManifest()
+        self.ui.imageComboBox.setModel(self.image_model)
+        self.ui.imageComboBox.view().setUniformItemSizes(True)
         # Reset window title to current image
         self.setWindowTitle("%s - Pychet Annotator" % (self.ui.imageComboBox.currentText()))
+    def updateImageIndex(self):
+        """Show the current image number, and the number of images found so far"""
+        self.image_index = self.ui.imageComboBox.currentIndex()
+        self.ui.image_index_label.setText('{:.0f}/{:.0f}{}'.format(self.image_index+1, self.ui.imageComboBox.count(),
+            '' if self.image_model is None or self.image_model.finished else '+'))
     def setLabelDirectory(self, dir_path=None):
         """ Pick folder to save annotations into """
         if dir_path:
@@ -765,16 +943,73 @@ class MainWindow(QtGui.QMainWindow):
             labelfolderchoice = str(QtGui.QFileDialog.getExistingDirectory(self, "Open directory", opendirectory))
             if labelfolderchoice:
                 self.labelFolder = labelfolderchoice
-    def saveAnnotations(self):
-        """Save annotations"""
-        # Get the current image file name
+        self.openManifest()
+    def openManifest(self):
+        """Load the manifest of the label folder and bring it up to date in the background"""
+        if self.folder_image is None:
+            return
+        if self.labelFolder is None:
+            self.labelFolder = os.path.join(self.folder_image, '../labels/')
+        self.manifest = Manifest(os.path.normpath(self.labelFolder), tool=self.tool_str, recursive=self.recursive_scan)
+        self.manifest.refresh_async()
+    def recordSave(self, label_basename, dataset):
+        """Update the manifest once dataset has been written to label_basename"""
+        manifest = self.manifest
+        if manifest is None:
+            return
+        stem = os.path.relpath(label_basename, manifest.label_folder)
+        if not stem.startswith(os.pardir):
+            manifest.record(stem, dataset.labels())
+    def imageStems(self):
+        """Label file names (without extension) of the images in the folder"""
+        self.image_model.fetchAll()
+        return [os.path.normpath(os.path.splitext(image)[0]) for image in self.images]
+    def nextUnlabelledImage(self):
+        """Jump to the next image without a label file"""
+        if self.manifest is None or not self.images:
+            return
+        current = self.ui.imageComboBox.currentIndex()
+        index = self.manifest.next_unlabelled(self.imageStems(), current + 1)
+        if index is None:
+            self.ui.statusBar.showMessage('Every image has a label file')
+        else:
+            self.nextImage(delta=index - current)
+    def showProgress(self):
+        """Summarise the labelling progress of the folder"""
+        if self.manifest is None or not self.images:
+            return
+        stems = self.imageStems()
+        labelled, shapes, per_label = self.manifest.summary(stems)
+        lines = ['Labelled {} of {} images ({:.1f}%)'.format(labelled, len(stems), 100. * labelled / len(stems)),
+                 '{} objects'.format(shapes)]
+        for label, count in sorted(per_label.items()):
+            name = self.labelmap.names.get(label, label) if self.labelmap else label
+            lines.append('    {}: {}'.format(name, count))
+        if not self.manifest.refreshed or not self.image_model.finished:
+            lines.append('(still scanning the folders)')
+        QtGui.QMessageBox.information(self, 'Progress', '\n'.join(lines))
+    def labelBasename(self):
+        """Path of the current image's label files, without extension"""
         current_filename = os.path.splitext(str(self.ui.imageComboBox.currentText()))[0]
         if self.labelFolder is None:
             self.labelFolder = os.path.join(self.folder_image, '../labels/')
-        # Create label folder
-        if not os.path.exists(self.labelFolder):
+        return os.path.normpath(os.path.join(self.labelFolder, current_filename))
+    def saveAnnotations(self, background=False):
+        """Save annotations - with background=True a snapshot is written by the autosave thread"""
+        # Get the current image file name
+        current_filename = os.path.splitext(str(self.ui.imageComboBox.currentText()))[0]
+        label_basename = self.labelBasename()
+        if self.labelsSaved():
+            self.writes_avoided += 1
+            self.ui.statusBar.showMessage('No changes to save for {} ({} writes avoided)'.format(
+                current_filename, self.writes_avoided))
+            if self.journal is not None:
+                self.dropJournal(self.journal)
+            return 0
+        # Create label folder (and subfolder, for images in subfolders)
+        if not os.path.exists(os.path.dirname(label_basename)):
             self.ui.statusBar.showMessage('Created a Label Directory')
-            os.makedirs(self.labelFolder)
+            os.makedirs(os.path.dirname(label_basename))
         # Establish save file
         save_files = (os.path.join(self.labelFolder, current_filename + '.csv') \
             , os.path.join(self.labelFolder, current_filename + '.svg'))
@@ -786,9 +1021,53 @@ class MainWindow(QtGui.QMainWindow):
             if reply == QtGui.QMessageBox.Yes:
                 self.ui.statusBar.showMessage('Overwriting previous label')
             else:
+                if background and self.journal is not None: # leaving the image - its edits are not wanted
+                    self.journal.remove()
+                    self.journal = None
                 return 0
-        self.ui.statusBar.showMessage('Saved to {}'.format(current_filename))
-        label_dataset.save(os.path.join(self.labelFolder, current_filename))
+        if background:
+            self.ui.statusBar.showMessage('Autosaving {}'.format(current_filename))
+            self.saveInBackground(label_basename, self.journal)
+        else:
+            self.ui.statusBar.showMessage('Saved to {}'.format(current_filename))
+            self.autosave.discard(label_basename) # an older queued snapshot must not overwrite this
+            label_dataset.save(label_basename)
+            self.saved_fingerprint = label_dataset.fingerprint()
+            self.queued_fingerprint = None
+            self.recordSave(label_basename, label_dataset)
+            if self.journal is not None:
+                self.journal.remove() # the label files now hold every edit
+    def autosaveWritten(self, written):
+        """A background save is on disk - if it holds the current image's labels, they are saved"""
+        label_basename, snapshot = written
+        if label_basename != self.labelBasename():
+            return
+        self.saved_fingerprint = snapshot.fingerprint()
+        if not self.autosave.queued(label_basename): # else a newer snapshot is still to be written
+            self.queued_fingerprint = None
+    def autosaveFailed(self, failure):
+        """Report a background save that could not be written - the labels stay unsaved, and the
+        journal segments it would have deleted are kept for replay"""
+        label_basename, error = failure
+        if label_basename == self.labelBasename() and not self.autosave.queued(label_basename):
+            self.queued_fingerprint = None
+        self.ui.statusBar.showMessage('Autosave of {} failed: {}'.format(os.path.basename(label_basename), error))
+    def closeEvent(self, QCloseEvent):
+        """Finish writing queued autosaves before exiting"""
+        self.autosave.flush()
+        if self.journal is not None:
+            self.journal.close() # kept, and replayed when the image is next opened
+        if profiler.enabled:
+            print 'Wrote timings to {}'.format(profiler.dump())
+        QtGui.QMainWindow.closeEvent(self, QCloseEvent)
+    def showProfile(self):
+        """Show the rolling stage timings in the status bar, refreshed every second"""
+        self.profile_label = QtGui.QLabel(self)
+        self.ui.statusBar.addPermanentWidget(self.profile_label)
+        self.profile_timer = QtCore.QTimer(self)
+        self.connect(self.profile_timer, QtCore.SIGNAL('timeout()'),
+                     lambda: self.profile_label.setText(profiler.readout()))
+        self.profile_timer.start(1000)
 
     def loadFromFile(self, filename=None):
         """load image and associated label data"""
@@ -799,6 +1078,7 @@ class MainWindow(QtGui.QMainWindow):
         #TODO: SVG loading
         label_dataset.load(filename, tool=self.tool_str)
         self.populateTree()
+        self.imagePanel.invalidate()
     def aboutWindow(self):
         """ Display information about the software """
         message = """About the Object Annotator:
@@ -820,6 +1100,8 @@ Annotate: \t\tSpace or Left Click
 Select Annotation: \t Shift Click
 Previous/Next Image: \t</>
 Save Annotation: \tCtrl + s
+Next Unlabelled Image: \tCtrl + u
+Labelling Progress: \tCtrl + p
 Exit application: \tESC"""
         QtGui.QMessageBox.information(self, 'About Pychet Circle Annotator', message)
     def loadAnnotations(self):
@@ -830,6 +1112,10 @@ Exit application: \tESC"""
             self.labelFolder = os.path.join(self.folder_image, '../labels/')
         # Get load file name
         loadfile = os.path.join(self.labelFolder, filename+'.csv')
+        self.autosave.flush(self.labelBasename()) # returning to an image whose autosave is queued
+        if self.manifest is not None and self.manifest.labelled(os.path.normpath(filename)) is False:
+            self.ui.statusBar.showMessage('No label file exists')
+            return 0
         if os.path.exists(loadfile):
             self.ui.statusBar.showMessage('Loading previous label from {}.csv'.format(filename))
         else:
@@ -837,54 +1123,14 @@ Exit application: \tESC"""
             return 0
         # Load data
         self.loadFromFile(filename=loadfile)
-        # If labels are loaded then toggle changeMade to False
-        self.imagePanel.changeMade = False
+        # The labels on disk are what was loaded
+        self.saved_fingerprint = label_dataset.fingerprint()
 
 class FitImageGraphicsView(QtGui.QGraphicsView):
     """Resize function for window to properly fit an image."""
     def showEvent(self, QShowEvent):
         self.fitInView(self.sceneRect(), QtCore.Qt.KeepAspectRatio)
 
-def convertQImageToMat(incomingImage):
-    '''  Converts a QImage into an opencv MAT format  '''
-    incomingImage = incomingImage.convertToFormat(4)
-    width = incomingImage.width()
-    height = incomingImage.height()
-    ptr = incomingImage.bits()
-    ptr.setsize(incomingImage.byteCount())
-    arr = np.array(ptr).reshape(height, width, 4)  #  Copies the data
-    return arr
-
-def convertMattoQImage(im, copy=False):
-    if im is None:
-        return QtGui.QImage()
-    gray_color_table = [QtGui.qRgb(i, i, i) for i in range(256)]
-    if im.dtype == np.uint8:
-        if len(im.shape) == 2:
-            qim = QtGui.QImage(im.data, im.shape[1], im.shape[0], im.strides[0], QtGui.QImage.Format_Indexed8)
-            qim.setColorTable(gray_color_table)
-            return qim.copy() if copy else qim
-        elif len(im.shape) == 3:
-            if im.shape[2] == 3:
-                qim = QtGui.QImage(im.data, im.shape[1], im.shape[0], im.strides[0], QtGui.QImage.Format_RGB888)
-                return qim.copy() if copy else qim
-            elif im.shape[2] == 4:
-                qim = QtGui.QImage(im.data, im.shape[1], im.shape[0], im.strides[0], QtGui.QImage.Format_ARGB32)
-                return qim.copy() if copy else qim
-    raise NotImplementedError
-
-def adjustPixmap(pixmap, brightness=0, contrast=0):
-    """ Adjust the brightness and contrast of a QPixmap """
-    # Convert to QImage
-    im = pixmap.toImage()
-    # Convert to numpy array and adjust
-    imcv = np.clip(convertQImageToMat(im)*(1+contrast/100.), 0, 255)
-    imcv = np.clip(imcv + brightness, 0, 255)
-    # Convert back to pixmap
-    im = convertMattoQImage(imcv.astype('uint8'))
-    pixmap = QtGui.QPixmap.fromImage(im)
-    return pixmap
-
 def parse_args():
     parser = argparse.ArgumentParser(description='Object annotation toolbox')
     parser.add_argument('image_folder', metavar='IF', nargs='?', default=None, help='Image folder')
@@ -892,34 +1138,54 @@ def parse_args():
     parser.add_argument('--tool', dest='tool', default='circle', help='circle or rectangle', type=str)
     parser.add_argument('--labelmap', dest='labelmap', default=None, help='JSON file for annotation labels')
     parser.add_argument('--isbgr', dest='isbrg', )
+    parser.add_argument('--cache-mb', dest='cache_mb', default=512, type=int,
+                        help='Memory budget in MB for decoded images kept for navigation')
+    parser.add_argument('--prefetch', dest='prefetch', default=2, type=int,
+                        help='Number of images to decode ahead in the browsing direction')
+    parser.add_argument('--tile-mp', dest='tile_mp', default=64, type=float,
+                        help='Images above this many megapixels are decoded and drawn as tiles (0 disables)')
+    parser.add_argument('--columnar', dest='columnar', action='store_true',
+                        help='Store annotations in NumPy columns (for images with many thousands of shapes)')
+    parser.add_argument('--typed-labels', dest='typed_labels', action='store_true',
+                        help='Write label files with a header naming the shape type of each section')
+    parser.add_argument('--recursive', dest='recursive', action='store_true',
+                        help='Include images in subfolders of the image folder')
+    parser.add_argument('--glob', dest='glob', default=None,
+                        help='Only label images whose path (relative to the image folder) matches this pattern')
+    parser.add_argument('--journal', dest='journal', action='store_true',
+                        help='Journal every edit next to the label files for crash recovery')
+    parser.add_argument('--full-decode', dest='full_decode', action='store_true',
+                        help='Always decode images at full resolution, not just when zoomed in')
+    parser.add_argument('--profile', dest='profile', nargs='?', const=DEFAULT_REPORT, default=None, metavar='REPORT',
+                        help='Time the main stages, show them in the status bar and write a JSON (or .csv) report on exit')
+    parser.add_argument('--profile-stage', dest='profile_stage', default=None, metavar='STAGE',
+                        help='Also run this stage (e.g. loadImage) under cProfile, saving <REPORT>.prof')
     args = parser.parse_args()
     return args
 
-def parse_labelmap(labelmapfile=None):
-    if labelmapfile is not None and os.path.exists(labelmapfile):
-        import simplejson as json
-        with open(labelmapfile, 'rb') as f:
-            labelmap = json.load(f)
-    else:
-        labelmap = []
-        for i in range(9):
-            cl = dict()
-            cl['object_id'] = i
-            cl['keyboard_shortcut'] = str(i)
-            if i == 0:
-                cl['object_name'] = 'background'
-            else:
-                cl['object_name'] = 'object{}'.format(i)
-            labelmap.append(cl)
-    return labelmap
-
 def main(args=None): 
     if not args:
         args = parse_args()
     app = QtGui.QApplication(sys.argv)
     main_window = MainWindow()
     main_window.tool_str = args.tool
+    main_window.columnar = args.columnar
+    main_window.typed_labels = args.typed_labels
+    main_window.reduced_decode = not args.full_decode
+    main_window.use_journal = args.journal
+    main_window.recursive_scan = args.recursive
+    main_window.image_glob = args.glob
+    main_window.image_cache.budget = args.cache_mb * 2 ** 20
+    main_window.image_cache.prefetch_count = args.prefetch
+    main_window.tile_threshold = int(args.tile_mp * 10 ** 6)
+    main_window.image_cache.max_pixels = main_window.tile_threshold
     main_window.labelmap = parse_labelmap(labelmapfile=args.labelmap)
+    if getattr(args, 'profile', None):
+        profiler.enable(args.profile, args.profile_stage)
+    else:
+        profiler.enable_from_env()
+    if profiler.enabled:
+        main_window.showProfile()
     main_window.show()
     if args.annotation_folder is not None:
         main_window.setLabelDirectory(args.annotation_folder)
@@ -0,0 +1,77 @@
+"""
+Label map - the object classes available for annotation.
+Lookups by id and keyboard shortcut are indexed once when the map is built.
+"""
+
+import os
+
+my_colormap = [\
+[137, 0, 255],
+[255, 0, 0],
+[179, 179, 0],
+[0, 255, 151],
+[0, 193, 255],
+[0, 27, 255],
+[137, 0, 255],
+[255, 165, 0],
+[255, 0, 41],
+[13, 255, 0],
+[255, 0, 207]] * 20 # Dirty hack to cater for more than 10 objects - will have same colours
+
+def label_colour(object_id):
+    '''(r, g, b) colour of a label id - ids past the end of my_colormap wrap around'''
+    return tuple(my_colormap[object_id % len(my_colormap)])
+
+class LabelMap(object):
+    '''Ordered list of object classes with prebuilt id and shortcut indexes'''
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.names = {} # object_id -> object_name
+        self.colours = {} # object_id -> (r, g, b)
+        self.shortcuts = {} # keyboard_shortcut -> object_id
+        for entry in self.entries:
+            object_id = int(entry['object_id'])
+            if object_id in self.names:
+                raise ValueError('Duplicate object_id {} in labelmap'.format(object_id))
+            self.names[object_id] = entry['object_name']
+            self.colours[object_id] = label_colour(object_id)
+            shortcut = str(entry.get('keyboard_shortcut') or '').lower()
+            if not shortcut:
+                continue
+            if shortcut in self.shortcuts:
+                raise ValueError('Duplicate keyboard_shortcut "{}" in labelmap (object_id {} and {})'
+                                 .format(shortcut, self.shortcuts[shortcut], object_id))
+            self.shortcuts[shortcut] = object_id
+    def __iter__(self):
+        return iter(self.entries)
+    def __len__(self):
+        return len(self.entries)
+    def __getitem__(self, index):
+        return self.entries[index]
+    def name(self, object_id):
+        '''return the object name of a label id'''
+        return self.names[object_id]
+    def colour(self, object_id):
+        '''return the (r, g, b) colour of a label id'''
+        return self.colours[object_id]
+    def label_for_shortcut(self, keystr):
+        '''return the label id bound to a keyboard shortcut, or None'''
+        return self.shortcuts.get(keystr.lower())
+
+def parse_labelmap(labelmapfile=None):
+    if labelmapfile is not None and os.path.exists(labelmapfile):
+        import simplejson as json
+        with open(labelmapfile, 'rb') as f:
+            labelmap = json.load(f)
+    else:
+        labelmap = []
+        for i in range(9):
+            cl = dict()
+            cl['object_id'] = i
+            cl['keyboard_shortcut'] = str(i)
+            if i == 0:
+                cl['object_name'] = 'background'
+            else:
+                cl['object_name'] = 'object{}'.format(i)
+            labelmap.append(cl)
+    return LabelMap(labelmap)
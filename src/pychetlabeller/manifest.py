@@ -0,0 +1,187 @@
+"""
+Project manifest of a label folder.
+manifest.json in the label folder records, for each label file, its modification
+time and size, its number of shapes and the shapes per label id, so progress
+queries never have to open the label files. Entries are updated as labels are
+saved, and entries whose label file changed on disk are rebuilt in parallel.
+A save appends its entry as one JSON line to manifest.log rather than rewriting
+manifest.json, and the log is folded into manifest.json once it grows long (or
+after a refresh). Label files created by other tools since the last refresh are not
+in the manifest yet, so an image it has no entry for is checked on disk.
+"""
+
+import os
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from .labelfile import atomic_write, parse_labels
+
+MANIFEST_NAME = 'manifest.json'
+LOG_NAME = 'manifest.log'
+VERSION = 1
+
+def make_entry(stat, labels):
+    '''manifest entry of a label file from its os.stat and its array of label ids'''
+    ids, counts = np.unique(np.asarray(labels, int), return_counts=True)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'shapes': int(counts.sum()),
+            'labels': dict((str(label), count) for label, count in zip(ids.tolist(), counts.tolist()))}
+
+def stat_or_none(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def scan_label_file(path, tool='circle'):
+    '''manifest entry of a label file read from disk, or None if it cannot be read'''
+    try:
+        stat = os.stat(path)
+        with open(path) as label_file:
+            text = label_file.read()
+    except (IOError, OSError):
+        return None
+    labels = [rows[:, -1] for _, rows in parse_labels(text, tool=tool)]
+    return make_entry(stat, np.concatenate(labels) if labels else [])
+
+class Manifest(object):
+    '''Per-image label statistics of a label folder, keyed by label file name without extension'''
+    def __init__(self, label_folder, tool='circle', recursive=False, compact_every=1000):
+        self.label_folder = label_folder
+        self.recursive = recursive # include label files in subfolders (stems are relative paths)
+        self.path = os.path.join(label_folder, MANIFEST_NAME)
+        self.log_path = os.path.join(label_folder, LOG_NAME)
+        self.compact_every = compact_every # logged entries after which manifest.json is rewritten
+        self.logged = 0 # entries in the log
+        self.tool = tool # shape type of label files without a header
+        self.entries = {} # label file stem -> entry (see make_entry)
+        self.refreshed = False # True once the entries have been checked against the folder
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock() # saves come from the GUI and autosave threads
+        self.load()
+    def label_path(self, stem):
+        return os.path.join(self.label_folder, stem + '.csv')
+    def load(self):
+        '''read the manifest file, if there is a current one, and the entries logged since'''
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            data = {}
+        if data.get('version') == VERSION:
+            self.entries = data['images']
+        try:
+            lines = open(self.log_path).read().splitlines()
+        except IOError:
+            return
+        for line in lines:
+            try:
+                stem, entry = json.loads(line)
+            except ValueError:
+                continue # torn final line
+            self.entries[stem] = entry
+        self.logged = len(lines)
+    def save(self):
+        '''write the manifest file, folding in the log, if the label folder exists'''
+        if not os.path.isdir(self.label_folder):
+            return
+        with self.save_lock:
+            with self.lock:
+                data = {'version': VERSION, 'images': dict(self.entries)}
+            def write(path):
+                with open(path, 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+            atomic_write(self.path, write)
+            # Every logged entry is in the file now - replaying them again would be harmless
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self.logged = 0
+    def record(self, stem, labels):
+        '''update the entry of a label file that has just been written, given its label ids -
+        appended to the log, which is folded into the manifest file every compact_every entries'''
+        stat = stat_or_none(self.label_path(stem))
+        if stat is None:
+            return
+        entry = make_entry(stat, labels)
+        with self.lock:
+            self.entries[stem] = entry
+        with self.save_lock:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps([stem, entry], separators=(',', ':')) + '\n')
+            self.logged += 1
+            compact = self.logged >= self.compact_every
+        if compact:
+            self.save()
+    def stems(self):
+        '''names (without extension, relative to the label folder) of the label files on disk'''
+        if not self.recursive:
+            try:
+                return [name[:-4] for name in os.listdir(self.label_folder) if name.endswith('.csv')]
+            except OSError:
+                return []
+        return [os.path.normpath(os.path.join(os.path.relpath(root, self.label_folder), name[:-4]))
+                for root, _, names in os.walk(self.label_folder) for name in names if name.endswith('.csv')]
+    def refresh(self, workers=8):
+        '''rebuild the entries of label files added, changed or removed on disk, returning how many'''
+        stems = self.stems()
+        with self.lock:
+            known = dict(self.entries)
+        pool = ThreadPool(workers)
+        try:
+            stats = pool.map(stat_or_none, [self.label_path(stem) for stem in stems])
+            stale = [stem for stem, stat in zip(stems, stats) if stat is not None and (stem not in known
+                     or (known[stem]['mtime'], known[stem]['size']) != (stat.st_mtime, stat.st_size))]
+            scanned = pool.map(lambda stem: scan_label_file(self.label_path(stem), self.tool), stale)
+        finally:
+            pool.close()
+            pool.join()
+        removed = set(known) - set(stems)
+        with self.lock:
+            # Entries recorded by a save while scanning are newer - keep them
+            for stem in removed:
+                if self.entries.get(stem) is known[stem]:
+                    del self.entries[stem]
+            for stem, entry in zip(stale, scanned):
+                if entry is not None and self.entries.get(stem) is known.get(stem):
+                    self.entries[stem] = entry
+            self.refreshed = True
+        if stale or removed:
+            self.save()
+        return len(stale) + len(removed)
+    def refresh_async(self):
+        '''refresh on a background thread'''
+        thread = threading.Thread(target=self.refresh, name='Manifest')
+        thread.daemon = True
+        thread.start()
+        return thread
+    def labelled(self, stem):
+        '''True if stem has a label file, False if not, None if not yet known
+        Stems without an entry are checked on disk, for label files written by other tools.'''
+        with self.lock:
+            if stem in self.entries:
+                return True
+            if not self.refreshed:
+                return None
+        return os.path.exists(self.label_path(stem))
+    def next_unlabelled(self, stems, start=0):
+        '''index of the first stem from start on (wrapping around) without a label file, or None'''
+        for index in range(start, len(stems)) + range(0, start):
+            with self.lock:
+                known = stems[index] in self.entries
+            if not known and not os.path.exists(self.label_path(stems[index])):
+                return index
+        return None
+    def summary(self, stems):
+        '''(labelled images, shapes, {label id: shapes}) over the given stems'''
+        labelled, shapes, per_label = 0, 0, {}
+        with self.lock:
+            for stem in stems:
+                entry = self.entries.get(stem)
+                if entry is None:
+                    continue
+                labelled += 1
+                shapes += entry['shapes']
+                for label, count in entry['labels'].items():
+                    per_label[int(label)] = per_label.get(int(label), 0) + count
+        return labelled, shapes, per_label
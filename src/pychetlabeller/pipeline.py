@@ -0,0 +1,98 @@
+"""
+Non-blocking brightness/contrast adjustment.
+Slider events show a viewport-sized preview straight away. The full resolution
+image is computed on a worker thread once the slider settles, and a job is
+abandoned as soon as a newer value arrives.
+"""
+
+import threading
+from PyQt4 import QtGui, QtCore
+
+from .adjust import brightness_contrast_lut, apply_lut_tiled, adjust_workers
+from .qtimage import viewQImagePixels, adjustImage
+
+class AdjustmentPipeline(QtCore.QObject):
+    '''Coalesces brightness/contrast requests for the image panel of a MainWindow'''
+    def __init__(self, window, delay=40, band_rows=128):
+        QtCore.QObject.__init__(self, window)
+        self.window = window
+        self.band_rows = band_rows # rows adjusted per worker thread between cancellation checks
+        self.generation = 0 # bumped by every request; jobs from older generations are stale
+        self.preview_source = None # (base image cache key, viewport-sized copy of the base image)
+        self.pending = None # newest job waiting for the worker
+        self.condition = threading.Condition()
+        # Wait for the slider to settle before starting a full resolution job
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.connect(self.timer, QtCore.SIGNAL('timeout()'), self.submit)
+        self.connect(self, QtCore.SIGNAL('adjusted(PyQt_PyObject)'), self.finished)
+        self.worker = threading.Thread(target=self.work, name='AdjustmentPipeline')
+        self.worker.daemon = True
+        self.worker.start()
+    def current_values(self):
+        '''(brightness, contrast) as currently set on the sliders'''
+        ui = self.window.ui
+        return (ui.brightness_slider.value(), ui.contrast_slider.value())
+    def request(self, brightness, contrast):
+        '''show a preview for the given values now and schedule the full resolution job'''
+        self.generation += 1
+        if self.window.imagePanel is None:
+            return
+        self.render_preview(brightness, contrast)
+        self.timer.start()
+    def cancel(self):
+        '''abandon any preview or job in flight - e.g. when the image is adjusted synchronously'''
+        self.generation += 1
+        self.timer.stop()
+        with self.condition:
+            self.pending = None
+        panel = self.window.imagePanel
+        if panel is not None:
+            panel.previewPixmap = None
+    def render_preview(self, brightness, contrast):
+        '''adjust a viewport-sized copy of the base image and show it stretched over the panel'''
+        panel = self.window.imagePanel
+        base = panel.defaultColorImage
+        if self.preview_source is None or self.preview_source[0] != base.cacheKey():
+            size = base.size().boundedTo(self.window.ui.graphicsView.viewport().size())
+            source = base.scaled(size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.FastTransformation)
+            self.preview_source = (base.cacheKey(), source.convertToFormat(QtGui.QImage.Format_RGB32))
+        preview = adjustImage(self.preview_source[1], brightness=brightness, contrast=contrast)
+        panel.previewPixmap = QtGui.QPixmap.fromImage(preview)
+        panel.update()
+    def submit(self):
+        '''hand the latest request to the worker thread, replacing any job it has not started'''
+        job = (self.generation, self.current_values(), self.window.imagePanel.defaultColorImage)
+        with self.condition:
+            self.pending = job
+            self.condition.notify()
+    def work(self):
+        '''worker thread: adjust the newest pending job in row bands, checking for cancellation'''
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                (generation, values, image), self.pending = self.pending, None
+            lut = brightness_contrast_lut(*values)
+            out = QtGui.QImage(image.size(), image.format())
+            src, dst = viewQImagePixels(image, writable=False), viewQImagePixels(out)
+            # Each step adjusts a band per worker thread
+            workers = adjust_workers(image.width() * image.height())
+            step = self.band_rows * workers
+            for start in range(0, len(src), step):
+                if generation != self.generation:
+                    break # superseded
+                stop = start + step
+                apply_lut_tiled(src[start:stop], lut, out=dst[start:stop], workers=workers)
+            else:
+                self.emit(QtCore.SIGNAL('adjusted(PyQt_PyObject)'), (generation, values, out))
+    def finished(self, result):
+        '''GUI thread: swap in a finished image if it still matches the sliders'''
+        generation, values, image = result
+        if generation != self.generation or values != self.current_values():
+            return
+        panel = self.window.imagePanel
+        panel.adjustedImage = image
+        panel.previewPixmap = None
+        panel.setPixmap(QtGui.QPixmap.fromImage(image))
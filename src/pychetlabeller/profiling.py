@@ -0,0 +1,131 @@
+"""
+Opt-in timing of the labeller's hot paths.
+Stages are timed by wrapping them with @profiler.timed(name), which costs one
+attribute lookup while profiling is off. When it is on, the last `window` timings
+of each stage are kept for rolling percentiles (shown in the status bar) and every
+timing goes into totals for the report written on exit. Stages may run on any
+thread. One stage can also be run under cProfile, with its statistics saved next
+to the report.
+
+Enabled with --profile [REPORT] or the PYCHETLABELLER_PROFILE environment variable
+(set to the report path, or to 1 for the default path).
+"""
+
+import os
+import csv
+import json
+import time
+import functools
+import threading
+import cProfile
+from collections import deque, OrderedDict
+
+ENV_REPORT = 'PYCHETLABELLER_PROFILE'
+ENV_STAGE = 'PYCHETLABELLER_PROFILE_STAGE'
+DEFAULT_REPORT = 'pychetlabeller_profile.json'
+PERCENTILES = (50, 90, 99)
+
+class StageTimes(object):
+    '''Timings of one stage: a rolling window plus running totals'''
+    def __init__(self, window):
+        self.recent = deque(maxlen=window) # seconds
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+    def add(self, seconds):
+        self.recent.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+    def percentiles(self):
+        '''{percentile: milliseconds} over the rolling window'''
+        import numpy as np
+        values = np.percentile(np.fromiter(self.recent, float, len(self.recent)), PERCENTILES) * 1000
+        return OrderedDict(zip(PERCENTILES, values.tolist()))
+    def summary(self):
+        row = OrderedDict([('count', self.count), ('total_ms', self.total * 1000),
+                           ('mean_ms', self.total * 1000 / self.count), ('max_ms', self.worst * 1000)])
+        for percentile, value in self.percentiles().items():
+            row['p%d_ms' % percentile] = value
+        return row
+
+class Profiler(object):
+    '''Stage timer - does nothing until enable() is called'''
+    def __init__(self, window=200):
+        self.enabled = False
+        self.window = window # timings per stage kept for the percentiles
+        self.stages = OrderedDict() # stage name -> StageTimes
+        self.report_path = None
+        self.profile_stage = None # stage run under cProfile
+        self.profile = None
+        self.local = threading.local() # depth: nesting of the profiled stage on this thread
+        self.lock = threading.Lock() # stages are recorded from worker threads too
+    def enable(self, report_path=DEFAULT_REPORT, profile_stage=None):
+        self.enabled = True
+        self.report_path = report_path
+        self.profile_stage = profile_stage
+        self.profile = cProfile.Profile() if profile_stage else None
+    def enable_from_env(self):
+        '''enable if PYCHETLABELLER_PROFILE is set'''
+        report = os.environ.get(ENV_REPORT)
+        if report:
+            self.enable(DEFAULT_REPORT if report == '1' else report, os.environ.get(ENV_STAGE))
+    def record(self, name, seconds):
+        with self.lock:
+            times = self.stages.get(name)
+            if times is None:
+                times = self.stages[name] = StageTimes(self.window)
+            times.add(seconds)
+    def timed(self, name):
+        '''decorator timing every call of a function as stage name'''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                depth = getattr(self.local, 'depth', 0)
+                profiling = name == self.profile_stage and depth == 0
+                if profiling:
+                    self.profile.enable()
+                self.local.depth = depth + profiling
+                start = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.time() - start)
+                    self.local.depth = depth
+                    if profiling:
+                        self.profile.disable()
+            return wrapper
+        return decorator
+    def readout(self):
+        '''one line of the rolling percentiles of each stage, for the status bar'''
+        parts = []
+        with self.lock:
+            for name, times in self.stages.items():
+                p50, p90, p99 = times.percentiles().values()
+                parts.append('{} {:.1f}/{:.1f}/{:.1f}'.format(name, p50, p90, p99))
+        return 'ms p50/p90/p99: ' + '  '.join(parts) if parts else ''
+    def summary(self):
+        with self.lock:
+            return OrderedDict((name, times.summary()) for name, times in self.stages.items())
+    def dump(self, path=None):
+        '''write the report - CSV if the path ends in .csv, JSON otherwise - and the cProfile
+        statistics of the profiled stage to <report>.prof'''
+        path = path or self.report_path
+        summary = self.summary()
+        if path.lower().endswith('.csv'):
+            with open(path, 'wb') as f:
+                writer = csv.writer(f)
+                columns = summary.values()[0].keys() if summary else []
+                writer.writerow(['stage'] + list(columns))
+                for name, row in summary.items():
+                    writer.writerow([name] + [row[column] for column in columns])
+        else:
+            with open(path, 'w') as f:
+                json.dump({'window': self.window, 'stages': summary}, f, indent=2)
+        if self.profile is not None:
+            self.profile.dump_stats(os.path.splitext(path)[0] + '.prof')
+        return path
+
+profiler = Profiler()
@@ -0,0 +1,138 @@
+"""
+Conversion between QImages and NumPy arrays, and image adjustment on QImages.
+Conversions share memory rather than copy it: arrays are views onto the QImage's
+pixels and QImages are built on the array's buffer. Each side keeps the other
+alive - a QImageArray holds its QImage (as do its slices and views) and an
+ArrayQImage holds its array - so the memory cannot be freed under a view. Qt's
+own shallow copies of an ArrayQImage (e.g. a QImage stored by a C++ object) do
+not hold the array, so pass copy=True for images that outlive the wrapper.
+Images are only converted to another format when the bridge cannot view their own.
+"""
+
+import sip
+import numpy as np
+from PyQt4 import QtGui
+
+from .adjust import brightness_contrast_lut, apply_lut_tiled
+
+# Pixel layout of the formats viewed without conversion: format -> channels (1: 2D array)
+# 32-bit formats are B, G, R, A in memory on little-endian machines
+CHANNELS = {QtGui.QImage.Format_RGB32: 4, QtGui.QImage.Format_ARGB32: 4,
+            QtGui.QImage.Format_ARGB32_Premultiplied: 4, QtGui.QImage.Format_RGB888: 3,
+            QtGui.QImage.Format_Indexed8: 1}
+
+_gray_color_table = []
+
+def grayColorTable():
+    if not _gray_color_table:
+        _gray_color_table.extend(QtGui.qRgb(i, i, i) for i in range(256))
+    return _gray_color_table
+
+class QImageArray(np.ndarray):
+    '''ndarray viewing the pixels of a QImage, which it keeps alive as owner'''
+    def __array_finalize__(self, obj):
+        # slices and views share the pixels, so they hold the image too - new arrays do not
+        owner = getattr(obj, 'owner', None)
+        self.owner = owner if owner is not None and np.may_share_memory(self, obj) else None
+
+class ArrayQImage(QtGui.QImage):
+    '''QImage drawn straight from the buffer of an array, which it keeps alive'''
+    def __init__(self, array, fmt):
+        height, width = array.shape[:2]
+        address = array.__array_interface__['data'][0] # rows may be padded, so not array.data
+        QtGui.QImage.__init__(self, sip.voidptr(address), width, height, array.strides[0], fmt)
+        self.array = array
+
+def viewQImage(image, writable=True):
+    '''  (height, width[, channels]) uint8 view onto the pixels of a QImage - no copy
+    Rows keep their padding out of the view through the row stride. A writable view detaches
+    an image that shares its pixels with other QImages (Qt copies it then, as for any write)  '''
+    channels = CHANNELS.get(image.format())
+    if channels is None:
+        raise ValueError('Cannot view QImage format {} - convert it first'.format(image.format()))
+    ptr = image.bits() if writable else image.constBits()
+    ptr.setsize(image.byteCount())
+    shape, strides = (image.height(), image.width()), (image.bytesPerLine(), channels)
+    if channels > 1:
+        shape, strides = shape + (channels,), strides + (1,)
+    view = np.ndarray(shape, np.uint8, buffer=ptr, strides=strides).view(QImageArray)
+    view.owner = image
+    view.flags.writeable = writable
+    return view
+
+def viewQImagePixels(image, writable=True):
+    '''  (height, width, 4) uint8 view onto the pixels of a 32-bit QImage - no copy  '''
+    return viewQImage(image, writable=writable)
+
+def convertQImageToMat(incomingImage, copy=False, writable=True):
+    '''  Converts a QImage into a NumPy array, viewing its pixels unless copy=True
+    32-bit images give (height, width, 4) BGRA, RGB888 (height, width, 3) and Indexed8 the
+    (height, width) indexes; other formats are converted to 32-bit first  '''
+    if incomingImage.format() not in CHANNELS:
+        incomingImage = incomingImage.convertToFormat(QtGui.QImage.Format_RGB32)
+    arr = viewQImage(incomingImage, writable=writable and not copy)
+    return np.array(arr) if copy else arr
+
+def _format_of(im):
+    '''QImage format of an array's layout, or None'''
+    if im.dtype != np.uint8:
+        return None
+    if im.ndim == 2:
+        return QtGui.QImage.Format_Indexed8
+    if im.ndim == 3 and im.shape[2] == 3:
+        return QtGui.QImage.Format_RGB888
+    if im.ndim == 3 and im.shape[2] == 4:
+        return QtGui.QImage.Format_ARGB32
+    return None
+
+def _views_whole(im):
+    '''True if im is a view of every pixel of its owner QImage, in the owner's layout'''
+    owner = getattr(im, 'owner', None)
+    return owner is not None and CHANNELS.get(owner.format()) == (im.shape[2] if im.ndim == 3 else 1) \
+        and im.shape[:2] == (owner.height(), owner.width()) and im.strides[0] == owner.bytesPerLine() \
+        and im.__array_interface__['data'][0] == int(owner.constBits())
+
+def _rows_contiguous(im):
+    '''True if each row of im is one run of bytes, as a QImage needs (rows may be padded)'''
+    pixel = im.shape[2] if im.ndim == 3 else 1
+    inner = (pixel, 1) if im.ndim == 3 else (1,)
+    return im.strides[1:] == inner and im.strides[0] >= pixel * im.shape[1]
+
+def convertMattoQImage(im, copy=False):
+    '''  QImage of a uint8 array - (height, width) gray, (height, width, 3) RGB or (height, width, 4) BGRA
+    The image is drawn from the array's memory (kept alive by the returned ArrayQImage) unless
+    copy=True. Arrays whose rows are not contiguous are copied once; a whole QImageArray view
+    gives back the QImage it views  '''
+    if im is None:
+        return QtGui.QImage()
+    fmt = _format_of(im)
+    if fmt is None:
+        raise NotImplementedError
+    if not copy and _views_whole(im):
+        return im.owner
+    if not _rows_contiguous(im):
+        im = np.ascontiguousarray(im)
+    qim = ArrayQImage(im, fmt)
+    if fmt == QtGui.QImage.Format_Indexed8:
+        qim.setColorTable(grayColorTable())
+    return qim.copy() if copy else qim
+
+def adjustImage(image, brightness=0, contrast=0, out=None, workers=None):
+    """ Adjust the brightness and contrast of a 32-bit QImage through a lookup table
+    The result is written into out (a QImage of the same size and format, or image itself) if given.
+    Large images are adjusted in row bands on several threads (see adjust.apply_lut_tiled) """
+    lut = brightness_contrast_lut(brightness, contrast)
+    if out is image:
+        apply_lut_tiled(viewQImagePixels(image), lut, workers=workers)
+        return image
+    if out is None or out.size() != image.size() or out.format() != image.format():
+        out = QtGui.QImage(image.size(), image.format())
+    apply_lut_tiled(viewQImagePixels(image, writable=False), lut, out=viewQImagePixels(out), workers=workers)
+    return out
+
+def adjustPixmap(pixmap, brightness=0, contrast=0):
+    """ Adjust the brightness and contrast of a QPixmap """
+    # Convert to a 32-bit QImage of our own and map it in place
+    im = pixmap.toImage().convertToFormat(QtGui.QImage.Format_RGB32)
+    adjustImage(im, brightness=brightness, contrast=contrast, out=im)
+    return QtGui.QPixmap.fromImage(im)
@@ -0,0 +1,86 @@
+"""
+Spatial indexing for label shapes.
+A uniform grid bucketed on shape bounds - keeps hit-testing independent of the
+number of annotations on an image. Shapes whose bounds would cover more than
+max_cells cells are kept in a separate list that every query scans, so a few huge
+shapes cannot fill the grid.
+"""
+
+import math
+import itertools
+
+class GridIndex(object):
+    '''Uniform grid index mapping hashable items to the grid cells their bounds cover'''
+    def __init__(self, cell_size=64, max_cells=64):
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+        self.cells = {} # (i, j) -> set of items
+        self.items = {} # item -> (bounds, cell keys)
+        self.large = set() # items over max_cells cells, not in the grid
+    def __len__(self):
+        return len(self.items)
+    def __contains__(self, item):
+        return item in self.items
+    def _cell_range(self, bounds):
+        '''return the inclusive cell range (i1, j1, i2, j2) covering bounds'''
+        x1, y1, x2, y2 = bounds
+        size = self.cell_size
+        return (int(math.floor(x1 / size)), int(math.floor(y1 / size)),
+                int(math.floor(x2 / size)), int(math.floor(y2 / size)))
+    def insert(self, item, bounds):
+        '''add an item with bounds (minx, miny, maxx, maxy), replacing any previous entry'''
+        if item in self.items:
+            self.delete(item)
+        i1, j1, i2, j2 = self._cell_range(bounds)
+        if (i2 - i1 + 1) * (j2 - j1 + 1) > self.max_cells:
+            self.large.add(item)
+            self.items[item] = (tuple(bounds), ())
+            return
+        keys = [(i, j) for i in range(i1, i2 + 1) for j in range(j1, j2 + 1)]
+        for key in keys:
+            self.cells.setdefault(key, set()).add(item)
+        self.items[item] = (tuple(bounds), keys)
+    def delete(self, item):
+        '''remove an item from the index'''
+        _, keys = self.items.pop(item)
+        self.large.discard(item)
+        for key in keys:
+            cell = self.cells[key]
+            cell.discard(item)
+            if not cell:
+                del self.cells[key]
+    def clear(self):
+        self.cells.clear()
+        self.items.clear()
+        self.large.clear()
+    def query_point(self, x, y):
+        '''return the items whose bounds contain the point (x, y)'''
+        size = self.cell_size
+        cell = self.cells.get((int(math.floor(x / size)), int(math.floor(y / size))), ())
+        results = []
+        for item in itertools.chain(cell, self.large):
+            x1, y1, x2, y2 = self.items[item][0]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                results.append(item)
+        return results
+    def query_rect(self, bounds):
+        '''return the items whose bounds intersect the rectangle (minx, miny, maxx, maxy)'''
+        qx1, qy1, qx2, qy2 = bounds
+        i1, j1, i2, j2 = self._cell_range(bounds)
+        if (i2 - i1 + 1) * (j2 - j1 + 1) > len(self.cells):
+            # Query covers more cells than are populated - walk the populated ones instead
+            cells = [cell for (i, j), cell in self.cells.items() if i1 <= i <= i2 and j1 <= j <= j2]
+        else:
+            cells = [self.cells[key] for key in
+                     ((i, j) for i in range(i1, i2 + 1) for j in range(j1, j2 + 1))
+                     if key in self.cells]
+        cells.append(self.large)
+        results = set()
+        for cell in cells:
+            for item in cell:
+                if item in results:
+                    continue
+                x1, y1, x2, y2 = self.items[item][0]
+                if x1 <= qx2 and qx1 <= x2 and y1 <= qy2 and qy1 <= y2:
+                    results.add(item)
+        return list(results)
@@ -0,0 +1,185 @@
+"""
+Tiled multi-resolution rendering for very large images.
+Fixed-size tiles are decoded on demand at the pyramid level matching the current
+zoom, held in a least-recently-used cache under a memory cap, and only the tiles
+that intersect the exposed rect are painted. Painting is in full resolution image
+coordinates, so annotations are unaffected.
+Tiles are decoded by a background thread: painting draws the tiles already decoded
+over the overview and queues the missing ones, and tileReady() asks for a repaint as
+they arrive. Formats whose reader can clip (JPEG) decode just the tile (QImageReader
+clip + scaled size), so memory stays within the budget. Others (PNG, most TIFFs)
+would decode the whole file for every tile, so the worker decodes it once and crops
+the queued tiles from it; the full image counts against the budget, and once the
+queue is drained it is dropped if keeping it would go over.
+"""
+
+import math
+import threading
+from collections import OrderedDict, deque
+from PyQt4 import QtGui, QtCore
+
+from .qtimage import adjustImage
+
+class TiledImage(QtCore.QObject):
+    '''Lazily decoded tile pyramid of an image file'''
+    def __init__(self, path, tile_size=512, budget_mb=256, overview_size=2048, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.path = path
+        self.tile_size = tile_size
+        self.budget = budget_mb * 2 ** 20 # bytes
+        self.overview_size = overview_size
+        reader = QtGui.QImageReader(path)
+        self.size = reader.size()
+        self.clip = reader.supportsOption(QtGui.QImageIOHandler.ClipRect) # else tiles are cropped from source
+        self.source = None # the whole image at full resolution, when the reader cannot clip (worker thread)
+        # Level k is the image downscaled by 2**k; the last level fits in a single tile
+        longest = max(self.size.width(), self.size.height(), 1)
+        self.levels = 1 + max(0, int(math.ceil(math.log(float(longest) / tile_size, 2))))
+        self.tiles = OrderedDict() # (level, col, row) -> QImage, least recently used first
+        self.pixmaps = {} # (level, col, row) -> adjusted QPixmap for the current adjustment (GUI thread)
+        self.bytes = 0
+        self.adjustment = (0, 0) # (brightness, contrast)
+        self.lock = threading.Condition()
+        self.queue = deque() # tiles waiting to be decoded, most wanted first
+        self.decoding = None # tile being decoded by the worker
+        self.closed = False
+        self.worker = None # started by the first request
+    def decodeSource(self):
+        '''decode the whole image, for readers that cannot decode a clip of it (worker thread)'''
+        source = self.source
+        if source is None:
+            source = self.source = QtGui.QImageReader(self.path).read().convertToFormat(QtGui.QImage.Format_RGB32)
+        return source
+    def releaseSource(self):
+        '''drop the full image if it does not fit in the budget next to the tiles, or the image
+        is closed - called with the lock held once the queue is drained'''
+        if self.source is not None and (self.closed or 2 * self.bytes + self.source.byteCount() > self.budget):
+            self.source = None
+    def overview(self):
+        '''decode the whole image downscaled to fit overview_size - shown while tiles load'''
+        size = self.size.scaled(self.overview_size, self.overview_size, QtCore.Qt.KeepAspectRatio)
+        reader = QtGui.QImageReader(self.path)
+        reader.setScaledSize(size)
+        return reader.read().convertToFormat(QtGui.QImage.Format_RGB32)
+    def set_adjustment(self, brightness, contrast):
+        '''brightness/contrast to apply to tiles as they are painted'''
+        if (brightness, contrast) != self.adjustment:
+            self.adjustment = (brightness, contrast)
+            self.pixmaps.clear()
+    def level_for(self, lod):
+        '''coarsest level that still has at least one image pixel per device pixel'''
+        level = 0
+        while level + 1 < self.levels and 2 ** (level + 1) * lod <= 1:
+            level += 1
+        return level
+    def tile_rect(self, level, col, row):
+        '''full resolution rect covered by a tile'''
+        span = self.tile_size << level
+        rect = QtCore.QRect(col * span, row * span, span, span)
+        return rect.intersected(QtCore.QRect(QtCore.QPoint(0, 0), self.size))
+    def decode(self, level, col, row):
+        '''decode one tile at its level's resolution'''
+        source = self.tile_rect(level, col, row)
+        size = QtCore.QSize(max(1, source.width() >> level), max(1, source.height() >> level))
+        if not self.clip:
+            tile = self.decodeSource().copy(source)
+            if level:
+                tile = tile.scaled(size, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation)
+            return tile
+        reader = QtGui.QImageReader(self.path)
+        reader.setClipRect(source)
+        reader.setScaledSize(size)
+        return reader.read().convertToFormat(QtGui.QImage.Format_RGB32)
+    def tile(self, key):
+        '''adjusted pixmap of a decoded tile, or None if it has not been decoded yet (GUI thread)'''
+        with self.lock:
+            image = self.tiles.pop(key, None)
+            if image is None:
+                return None
+            self.tiles[key] = image # most recently used
+        pixmap = self.pixmaps.get(key)
+        if pixmap is None:
+            brightness, contrast = self.adjustment
+            if brightness or contrast:
+                image = adjustImage(image, brightness=brightness, contrast=contrast)
+            pixmap = self.pixmaps[key] = QtGui.QPixmap.fromImage(image)
+        return pixmap
+    def evict(self):
+        '''drop least recently used tiles over budget - on the GUI thread, as it owns the pixmaps'''
+        with self.lock:
+            while 2 * self.bytes > self.budget and len(self.tiles) > 1: # raw tile + adjusted pixmap
+                evicted, image = self.tiles.popitem(last=False)
+                self.pixmaps.pop(evicted, None)
+                self.bytes -= image.byteCount()
+    def request(self, keys):
+        '''replace the decode queue with keys, most wanted first'''
+        with self.lock:
+            if self.closed:
+                return
+            self.queue.clear()
+            self.queue.extend(keys)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.work, name='TiledImage')
+                self.worker.daemon = True
+                self.worker.start()
+            self.lock.notify_all()
+    def flush(self):
+        '''block until the queued tiles are decoded'''
+        with self.lock:
+            while self.queue or self.decoding is not None:
+                self.lock.wait()
+    def close(self):
+        '''stop decoding - the image is no longer shown'''
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+            self.source = None
+            self.lock.notify_all()
+    def work(self):
+        '''worker thread: decode queued tiles, emitting tileReady() after each'''
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.lock.wait()
+                if self.closed:
+                    return
+                key = self.queue.popleft()
+                if key in self.tiles:
+                    if not self.queue:
+                        self.releaseSource()
+                    continue
+                self.decoding = key
+            image = None
+            try:
+                image = self.decode(*key)
+            finally:
+                with self.lock:
+                    self.decoding = None
+                    if image is not None and not self.closed: # a null image is not retried
+                        self.tiles[key] = image
+                        self.bytes += image.byteCount()
+                    if not self.queue:
+                        self.releaseSource()
+                    self.lock.notify_all()
+            self.emit(QtCore.SIGNAL('tileReady()'))
+    def paint(self, painter, rect, lod):
+        '''paint the decoded tiles intersecting rect (image coordinates) at the level for lod,
+        queueing the missing ones'''
+        level = self.level_for(lod)
+        span = self.tile_size << level
+        cols = int(math.ceil(self.size.width() / float(span)))
+        rows = int(math.ceil(self.size.height() / float(span)))
+        col1, col2 = max(0, int(rect.left() // span)), min(cols - 1, int(rect.right() // span))
+        row1, row2 = max(0, int(rect.top() // span)), min(rows - 1, int(rect.bottom() // span))
+        missing = []
+        for row in range(row1, row2 + 1):
+            for col in range(col1, col2 + 1):
+                pixmap = self.tile((level, col, row))
+                if pixmap is None:
+                    missing.append((level, col, row))
+                    continue
+                painter.drawPixmap(QtCore.QRectF(self.tile_rect(level, col, row)), pixmap,
+                                   QtCore.QRectF(pixmap.rect()))
+        self.evict()
+        if missing:
+            self.request(missing)
@@ -0,0 +1,54 @@
+"""
+AutosaveWriter: saved() once the files are written, and on failure neither the
+callbacks of the failed save nor those of the saves it replaced are run.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from PyQt4 import QtCore
+except ImportError:
+    QtCore = None
+
+from pychetlabeller.dataset import LabelDataset, LabelCircle
+
+@unittest.skipIf(QtCore is None, 'PyQt4 is not installed')
+class AutosaveWriterTest(unittest.TestCase):
+    def setUp(self):
+        from pychetlabeller.autosave import AutosaveWriter
+        self.folder = tempfile.mkdtemp()
+        self.writer = AutosaveWriter()
+        self.signals = []
+        for name in ('saved', 'failed'):
+            self.writer.connect(self.writer, QtCore.SIGNAL(name + '(PyQt_PyObject)'),
+                                lambda value, name=name: self.signals.append((name, value[0])),
+                                QtCore.Qt.DirectConnection)
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    def dataset(self):
+        dataset = LabelDataset('image.png', (100, 100))
+        dataset.add(LabelCircle(1, 10, 10, 5))
+        return dataset
+    def test_saved_after_done(self):
+        basename = os.path.join(self.folder, 'image')
+        done = []
+        self.writer.submit(basename, self.dataset(), done=lambda: done.append(os.path.exists(basename + '.csv')))
+        self.writer.flush()
+        self.assertEqual(done, [True])
+        self.assertEqual(self.signals, [('saved', basename)])
+    def test_failure_runs_no_callbacks(self):
+        basename = os.path.join(self.folder, 'missing', 'image') # no such folder
+        done = []
+        with self.writer.condition: # hold the worker back so the second save replaces the first
+            self.writer.submit(basename, self.dataset(), done=lambda: done.append(1))
+            self.writer.submit(basename, self.dataset(), done=lambda: done.append(2))
+        self.writer.flush()
+        self.assertEqual(done, [])
+        self.assertEqual(self.signals, [('failed', basename)])
+        self.assertFalse(os.path.exists(basename + '.csv'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+LabelDataset without Qt: lookup and removal by id, and saving label files.
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+import unittest
+
+from pychetlabeller.benchmark import REMOVE_BUDGET, circle_dataset, mixed_dataset, remove_all
+from pychetlabeller.dataset import LabelDataset, LabelCircle, LabelRectangle, svg_colour
+from pychetlabeller.labelfile import HEADER, SECTION
+from pychetlabeller.labelmap import my_colormap
+
+class RemoveTest(unittest.TestCase):
+    count = 10000
+    def test_remove_within_budget(self):
+        for columnar in (False, True):
+            dataset = circle_dataset(self.count, columnar=columnar)
+            ids = dataset.ids()
+            seconds = timeit.timeit(lambda: remove_all(dataset), number=1)
+            self.assertLessEqual(seconds, REMOVE_BUDGET, 'columnar=%s' % columnar)
+            self.assertEqual((len(dataset), dataset.ids(), dataset.data), (0, [], []))
+            self.assertIsNone(dataset.find(ids[0]))
+            self.assertEqual(dataset.data_at((0, 0)), [])
+    def test_remove_keeps_the_others(self):
+        for columnar in (False, True):
+            dataset = circle_dataset(100, columnar=columnar)
+            ids = dataset.ids()
+            for shape_id in ids[::2]:
+                dataset.remove(dataset.find(shape_id))
+            self.assertEqual(sorted(dataset.ids()), ids[1::2])
+            self.assertEqual([datum.id for datum in dataset], ids[1::2])
+            self.assertEqual(dataset.find(ids[1]).id, ids[1])
+
+class FingerprintTest(unittest.TestCase):
+    def test_same_shapes_in_any_order(self):
+        shapes = [LabelCircle(1, 10.5, 20, 3), LabelRectangle(2, 1, 2, 3, 4), LabelCircle(1, 50, 50, 7)]
+        fingerprints = []
+        for columnar in (False, True):
+            for order in (shapes, shapes[::-1]):
+                dataset = LabelDataset('image.png', (100, 100), columnar=columnar)
+                for datum in order:
+                    dataset.add(datum)
+                fingerprints.append(dataset.fingerprint())
+        self.assertEqual(len(set(fingerprints)), 1)
+    def test_edits_that_cancel_out(self):
+        for columnar in (False, True):
+            dataset = mixed_dataset(50, columnar=columnar)
+            before = dataset.fingerprint()
+            datum = LabelCircle(1, 1, 2, 3)
+            dataset.add(datum)
+            self.assertNotEqual(dataset.fingerprint(), before)
+            dataset.remove(datum)
+            self.assertEqual(dataset.fingerprint(), before)
+            removed = dataset.data[10]
+            dataset.remove(removed)
+            self.assertNotEqual(dataset.fingerprint(), before)
+            dataset.add_row(removed.kind, removed.serialize()[1:-1], removed.label)
+            self.assertEqual(dataset.fingerprint(), before)
+
+class SaveTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.basename = os.path.join(self.folder, 'image')
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    def read(self, extension):
+        with open(self.basename + extension) as f:
+            return f.read()
+    def fields(self, dataset):
+        '''type and fields of each shape as written to a label file, without the id'''
+        return [datum.kind + (',%.12g' * (len(datum.serialize()) - 1)) % datum.serialize()[1:]
+                for datum in dataset]
+    def test_storage_modes_write_the_same_rows(self):
+        saved = []
+        for columnar in (False, True):
+            mixed_dataset(200, columnar=columnar).saveCSV(self.basename + '.csv')
+            saved.append([line.split(',')[1:] for line in self.read('.csv').splitlines()])
+        self.assertEqual(saved[0], saved[1])
+    def test_csv_round_trip(self):
+        for columnar in (False, True):
+            dataset = circle_dataset(200, columnar=columnar)
+            dataset.saveCSV(self.basename + '.csv')
+            for load_columnar in (False, True):
+                loaded = LabelDataset('image.png', dataset.image_size, columnar=load_columnar)
+                self.assertTrue(loaded.load(self.basename + '.csv'))
+                self.assertEqual(self.fields(loaded), self.fields(dataset))
+                self.assertEqual(loaded.fingerprint(), dataset.fingerprint())
+    def test_single_type_is_headerless(self):
+        dataset = circle_dataset(10)
+        dataset.saveCSV(self.basename + '.csv')
+        lines = self.read('.csv').splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertFalse(any(line.startswith('#') for line in lines))
+        dataset.typed = True
+        dataset.saveCSV(self.basename + '.csv')
+        self.assertEqual(self.read('.csv').splitlines()[:2], [HEADER, SECTION % 'circle'])
+    def test_mixed_file_keeps_order_in_one_section_per_type(self):
+        for columnar in (False, True):
+            dataset = mixed_dataset(200, columnar=columnar) # circles and rectangles alternate
+            dataset.saveCSV(self.basename + '.csv')
+            lines = self.read('.csv').splitlines()
+            self.assertEqual(lines[0], HEADER)
+            self.assertEqual([line for line in lines if line.startswith('#shape')],
+                             [SECTION % 'circle', SECTION % 'rectangle'])
+            self.assertEqual(len(lines), 203)
+            for load_columnar in (False, True):
+                loaded = LabelDataset('image.png', dataset.image_size, columnar=load_columnar)
+                self.assertTrue(loaded.load(self.basename + '.csv'))
+                self.assertEqual(self.fields(loaded), self.fields(dataset))
+                self.assertEqual([datum.kind for datum in loaded.data[:4]],
+                                 ['circle', 'rectangle', 'circle', 'rectangle'])
+                self.assertEqual(self.fields([loaded.last()]), self.fields([dataset.last()]))
+    def test_failed_save_keeps_the_old_files(self):
+        dataset = mixed_dataset(20)
+        dataset.save(self.basename)
+        saved = (self.read('.svg'), self.read('.csv'))
+        rows = dataset.rows()
+        def failing_rows():
+            yield rows[0]
+            raise IOError('disk full')
+        dataset.rows = failing_rows
+        self.assertRaises(IOError, dataset.saveSVG, self.basename + '.svg')
+        self.assertRaises(IOError, dataset.saveCSV, self.basename + '.csv')
+        self.assertEqual((self.read('.svg'), self.read('.csv')), saved)
+        self.assertEqual(sorted(os.listdir(self.folder)), ['image.csv', 'image.svg'])
+    def test_label_ids_past_the_colormap(self):
+        label = 300
+        self.assertGreaterEqual(label, len(my_colormap))
+        for columnar in (False, True):
+            dataset = LabelDataset('image.png', (100, 100), columnar=columnar)
+            dataset.add(LabelCircle(label, 10, 20, 5))
+            dataset.add(LabelRectangle(label, 1, 2, 3, 4))
+            dataset.save(self.basename)
+            colour = svg_colour(label % len(my_colormap))
+            with open(self.basename + '.svg') as f:
+                svg = f.read()
+            self.assertTrue(svg.endswith('</svg>'))
+            self.assertEqual(svg.count('fill="%s"' % colour), 2)
+            loaded = LabelDataset('image.png', (100, 100))
+            self.assertTrue(loaded.load(self.basename + '.csv'))
+            self.assertEqual([datum.label for datum in loaded], [label, label])
+
+if __name__ == '__main__':
+    unittest.main()
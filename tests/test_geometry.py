@@ -0,0 +1,68 @@
+"""
+Closed-form circle and rectangle geometry checked against the shapely geometry of
+the same shapes, which is only built when asked for.
+"""
+
+import unittest
+import numpy as np
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+from pychetlabeller.dataset import LabelShape, LabelCircle, LabelRectangle
+
+def random_shapes(rng, count):
+    shapes = []
+    for _ in range(count):
+        x, y = rng.uniform(0, 100, 2)
+        if rng.rand() < 0.5:
+            shapes.append(LabelCircle(1, x, y, rng.uniform(1, 30)))
+        else:
+            shapes.append(LabelRectangle(1, x, y, rng.uniform(1, 30), rng.uniform(1, 30)))
+    return shapes
+
+class LazyShapeTest(unittest.TestCase):
+    def test_geometry_without_shapely(self):
+        circle, rectangle = LabelCircle(1, 10, 10, 5), LabelRectangle(1, 0, 0, 10, 20)
+        self.assertTrue(circle.contains(13, 14))
+        self.assertFalse(circle.contains(14, 14))
+        self.assertTrue(rectangle.contains(10, 20))
+        self.assertTrue(circle.intersects_rect((13, 13, 20, 20)))
+        self.assertFalse(circle.intersects_rect((14, 14, 20, 20)))
+        self.assertEqual(rectangle.intersection_area(LabelRectangle(1, 5, 5, 10, 10)), 50)
+        self.assertEqual(circle.intersection_area(LabelCircle(1, 30, 10, 5)), 0)
+        self.assertIsNone(circle._shape)
+        self.assertIsNone(rectangle._shape)
+
+@unittest.skipIf(shapely is None, 'shapely is not installed')
+class ShapelyAgreementTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.shapes = random_shapes(self.rng, 200)
+    def test_contains(self):
+        from shapely.geometry import Point
+        for datum in self.shapes:
+            for x, y in self.rng.uniform(-10, 110, (20, 2)):
+                point = Point(x, y)
+                if point.distance(datum.shape.exterior) > 0.5: # shapely circles are polygons
+                    self.assertEqual(datum.contains(x, y), LabelShape.contains(datum, x, y))
+    def test_intersects_rect(self):
+        from shapely.geometry import box
+        for datum in self.shapes:
+            for x, y, w, h in self.rng.uniform(0, 40, (20, 4)) * (3, 3, 1, 1):
+                rect = (x, y, x + w, y + h)
+                if box(*rect).distance(datum.shape.exterior) > 0.5 or box(*rect).intersects(datum.shape.exterior):
+                    self.assertEqual(datum.intersects_rect(rect), LabelShape.intersects_rect(datum, rect))
+    def test_intersection_area_and_iou(self):
+        for a, b in zip(self.shapes[::2], self.shapes[1::2]):
+            expected = a.shape.intersection(b.shape).area
+            self.assertAlmostEqual(a.intersection_area(b), expected, delta=0.01 * max(a.area, b.area))
+            self.assertAlmostEqual(a.area, a.shape.area, delta=0.01 * a.area)
+            self.assertTrue(0 <= a.iou(b) <= 1)
+        a = LabelCircle(1, 0, 0, 10)
+        self.assertAlmostEqual(a.iou(LabelCircle(1, 0, 0, 10)), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
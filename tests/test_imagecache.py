@@ -0,0 +1,43 @@
+"""
+ImageCache.decode: the sharper decode wanted when zooming in is made on the worker,
+before any queued prefetch, and handed back with decoded(PyQt_PyObject).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from PyQt4 import QtGui, QtCore
+except ImportError:
+    QtGui = None
+
+@unittest.skipIf(QtGui is None, 'PyQt4 is not installed')
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'image.png')
+        image = QtGui.QImage(400, 200, QtGui.QImage.Format_RGB32)
+        image.fill(0xff336699)
+        image.save(self.path)
+    def test_decode_is_handed_back_uncached(self):
+        from pychetlabeller.imagecache import ImageCache
+        cache = ImageCache()
+        decoded = []
+        ready = threading.Event()
+        def receive(value):
+            decoded.append(value)
+            ready.set()
+        cache.connect(cache, QtCore.SIGNAL('decoded(PyQt_PyObject)'), receive, QtCore.Qt.DirectConnection)
+        cache.decode(self.path, (100, 100))
+        self.assertTrue(ready.wait(10))
+        path, max_size, image = decoded[0]
+        self.assertEqual((path, max_size), (self.path, (100, 100)))
+        self.assertEqual(image.size(), QtCore.QSize(100, 50))
+        self.assertEqual(len(cache.images), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+ImageListModel keeps its rows sorted as scanned batches are fetched, with the
+selection staying on its image.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from PyQt4 import QtCore
+except ImportError:
+    QtCore = None
+
+@unittest.skipIf(QtCore is None, 'PyQt4 is not installed')
+class ImageListModelTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+    def model(self, names, batch):
+        from pychetlabeller.imagelist import ImageListModel
+        model = ImageListModel(self.folder, batch=batch)
+        model.worker.join() # an empty folder - fill the pending list by hand instead
+        model.names, model.pending = [], list(names)
+        return model
+    def test_batches_are_merged_in_order(self):
+        names = ['%03d.png' % i for i in range(100)]
+        shuffled = names[::7] + [name for i, name in enumerate(names) if i % 7]
+        model = self.model(shuffled, batch=10)
+        model.fetchMore()
+        current = QtCore.QPersistentModelIndex(model.index(3))
+        selected = model.names[3]
+        while model.canFetchMore():
+            model.fetchMore()
+            self.assertEqual(model.names, sorted(model.names))
+            self.assertEqual(model.names[current.row()], selected)
+        self.assertEqual(model.names, names)
+    def test_scan_lists_the_folder_sorted(self):
+        from pychetlabeller.imagelist import ImageListModel
+        for name in ('b.png', 'a.jpg', 'c.txt', 'd.bmp'):
+            open(os.path.join(self.folder, name), 'w').close()
+        model = ImageListModel(self.folder, batch=1)
+        model.worker.join()
+        model.scanned(True) # delivered by the event loop in the labeller
+        self.assertTrue(model.finished)
+        self.assertEqual(model.names, ['a.jpg', 'b.png', 'd.bmp'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Journal replay: edits journalled after the label files were written are applied on
+top of them when the image is opened again, rotated segments first.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pychetlabeller.dataset import LabelDataset, LabelCircle, LabelRectangle
+from pychetlabeller.journal import Journal, remove_segments
+
+class JournalReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.basename = os.path.join(self.folder, 'image')
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    def fields(self, dataset):
+        return [(datum.kind,) + datum.serialize()[1:] for datum in dataset]
+    def reopen(self, columnar=False):
+        '''load the label files and replay the journal, as opening the image does'''
+        dataset = LabelDataset('image.png', (100, 100), columnar=columnar)
+        dataset.load(self.basename + '.csv')
+        journal = Journal(self.basename)
+        self.addCleanup(journal.close)
+        return dataset, journal.replay(dataset)
+    def edit(self, dataset, journal):
+        '''add three shapes and remove one loaded from the label files and one just added'''
+        added = [LabelCircle(1, 10.25, 20, 3), LabelRectangle(2, 1, 2, 3, 4), LabelCircle(1, 50, 50, 7)]
+        for datum in added:
+            dataset.add(datum)
+            journal.append('+', datum)
+        for datum in (dataset.data[0], added[1]):
+            dataset.remove(datum)
+            journal.append('-', datum)
+    def saved_dataset(self):
+        dataset = LabelDataset('image.png', (100, 100))
+        for i in range(5):
+            dataset.add(LabelCircle(i % 3, 10 * i + 0.1, 7, 2))
+        dataset.save(self.basename)
+        return dataset
+    def test_replay_after_add_and_remove(self):
+        dataset = self.saved_dataset()
+        journal = Journal(self.basename)
+        self.edit(dataset, journal)
+        journal.close() # a crash before the label files were written again
+        for columnar in (False, True):
+            reopened, applied = self.reopen(columnar)
+            self.assertEqual(applied, 5)
+            self.assertEqual(self.fields(reopened), self.fields(dataset))
+            self.assertEqual(reopened.fingerprint(), dataset.fingerprint())
+    def test_replay_segments_before_journal(self):
+        dataset = self.saved_dataset()
+        journal = Journal(self.basename, threshold=4)
+        self.edit(dataset, journal)
+        self.assertTrue(journal.needs_compaction)
+        segments = journal.rotate() # a background save that was never written
+        self.assertEqual(segments, [self.basename + '.journal.1'])
+        extra = LabelCircle(3, 1, 1, 1)
+        dataset.add(extra)
+        journal.append('+', extra)
+        dataset.remove(extra)
+        journal.append('-', extra)
+        journal.close()
+        reopened, applied = self.reopen()
+        self.assertEqual(applied, 7)
+        self.assertEqual(self.fields(reopened), self.fields(dataset))
+        dataset.save(self.basename) # the save is written - its segments go
+        remove_segments(segments)
+        Journal(self.basename).clear()
+        reopened, applied = self.reopen()
+        self.assertEqual(applied, 0)
+        self.assertEqual(self.fields(reopened), self.fields(dataset))
+    def test_torn_last_line_is_skipped(self):
+        dataset = self.saved_dataset()
+        journal = Journal(self.basename)
+        datum = LabelCircle(1, 5, 5, 5)
+        dataset.add(datum)
+        journal.append('+', datum)
+        journal.close()
+        with open(journal.path, 'a') as f:
+            f.write('+,circ')
+        reopened, applied = self.reopen()
+        self.assertEqual(applied, 1)
+        self.assertEqual(self.fields(reopened), self.fields(dataset))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+"""
+Names scripts imported from pychetlabeller.labeller before the data model moved to
+dataset.py and labelmap.py are still importable from it.
+"""
+
+import unittest
+
+try:
+    from PyQt4 import QtCore
+except ImportError:
+    QtCore = None
+
+@unittest.skipIf(QtCore is None, 'PyQt4 is not installed')
+class ReExportTest(unittest.TestCase):
+    def test_data_model_names(self):
+        from pychetlabeller import labeller, dataset, labelmap
+        for name in ('LabelDataset', 'LabelShape', 'LabelCircle', 'LabelRectangle'):
+            self.assertIs(getattr(labeller, name), getattr(dataset, name))
+        self.assertIs(labeller.my_colormap, labelmap.my_colormap)
+        for name in ('convertQImageToMat', 'convertMattoQImage', 'adjustPixmap', 'MainWindow', 'ObjectDrawPanel'):
+            self.assertTrue(hasattr(labeller, name), name)
+
+if __name__ == '__main__':
+    unittest.main()
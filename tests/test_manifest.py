@@ -0,0 +1,71 @@
+"""
+Manifest of a label folder: saves are appended to manifest.log, replayed when the
+manifest is reloaded and folded into manifest.json once the log grows long.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from pychetlabeller.dataset import LabelDataset, LabelCircle
+from pychetlabeller.manifest import Manifest, MANIFEST_NAME, LOG_NAME
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    def save_labels(self, manifest, stem, labels):
+        '''write a label file and record it, as saving an image does'''
+        dataset = LabelDataset(stem + '.png', (100, 100))
+        for i, label in enumerate(labels):
+            dataset.add(LabelCircle(label, i, i, 1))
+        dataset.save(os.path.join(self.folder, stem))
+        manifest.record(stem, dataset.labels())
+    def log_lines(self):
+        with open(os.path.join(self.folder, LOG_NAME)) as f:
+            return f.read().splitlines()
+    def test_saves_are_logged_and_reloaded(self):
+        manifest = Manifest(self.folder)
+        self.save_labels(manifest, 'a', [1, 1, 2])
+        self.save_labels(manifest, 'b', [3])
+        self.save_labels(manifest, 'a', [1, 2])
+        self.assertFalse(os.path.exists(os.path.join(self.folder, MANIFEST_NAME)))
+        self.assertEqual(len(self.log_lines()), 3)
+        reloaded = Manifest(self.folder)
+        self.assertEqual(reloaded.entries, manifest.entries)
+        self.assertEqual(reloaded.logged, 3)
+        self.assertEqual(reloaded.summary(['a', 'b', 'c']), (2, 3, {1: 1, 2: 1, 3: 1}))
+        self.assertTrue(reloaded.labelled('a'))
+        self.assertIsNone(reloaded.labelled('c')) # not refreshed yet
+    def test_log_is_compacted(self):
+        manifest = Manifest(self.folder, compact_every=3)
+        for stem in ('a', 'b', 'c', 'd'):
+            self.save_labels(manifest, stem, [1])
+        with open(os.path.join(self.folder, MANIFEST_NAME)) as f:
+            self.assertEqual(sorted(json.load(f)['images']), ['a', 'b', 'c'])
+        self.assertEqual(len(self.log_lines()), 1)
+        self.assertEqual(sorted(Manifest(self.folder).entries), ['a', 'b', 'c', 'd'])
+    def test_torn_log_line_is_skipped(self):
+        manifest = Manifest(self.folder)
+        self.save_labels(manifest, 'a', [1])
+        with open(os.path.join(self.folder, LOG_NAME), 'a') as f:
+            f.write('["b",{"mti')
+        self.assertEqual(sorted(Manifest(self.folder).entries), ['a'])
+    def test_refresh_finds_files_changed_on_disk(self):
+        manifest = Manifest(self.folder)
+        self.save_labels(manifest, 'a', [1])
+        with open(os.path.join(self.folder, 'b.csv'), 'w') as f: # written by another tool
+            f.write('0,1,2,3,4\n1,5,6,7,4\n')
+        os.remove(os.path.join(self.folder, 'a.csv'))
+        reloaded = Manifest(self.folder)
+        self.assertEqual(reloaded.refresh(workers=2), 2)
+        self.assertEqual(reloaded.summary(['a', 'b']), (1, 2, {4: 2}))
+        self.assertFalse(reloaded.labelled('a'))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, LOG_NAME)))
+        self.assertEqual(Manifest(self.folder).entries, reloaded.entries)
+
+if __name__ == '__main__':
+    unittest.main()
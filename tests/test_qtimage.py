@@ -0,0 +1,127 @@
+"""
+Zero-copy conversions between QImages and NumPy arrays: rows padded beyond their
+pixels, and views that must keep the memory they share alive.
+"""
+
+import gc
+import weakref
+import unittest
+import numpy as np
+
+try:
+    from PyQt4 import QtGui
+except ImportError:
+    QtGui = None
+
+def churn():
+    '''collect garbage and allocate over freed memory, so a dangling view would read garbage'''
+    gc.collect()
+    return [np.full(1 << 16, 0xab, np.uint8) for _ in range(32)]
+
+def bgra(x, y):
+    '''pixel of the test pattern at x, y'''
+    return (x * 20 % 256, y * 30 % 256, (x + y) % 256, 255)
+
+def pattern(height, width):
+    array = np.empty((height, width, 4), np.uint8)
+    for y in range(height):
+        for x in range(width):
+            array[y, x] = bgra(x, y)
+    return array
+
+@unittest.skipIf(QtGui is None, 'PyQt4 is not installed')
+class PaddedRowsTest(unittest.TestCase):
+    '''images whose bytesPerLine is more than width * bytes per pixel'''
+    def test_view_of_padded_rgb888(self):
+        from pychetlabeller.qtimage import convertQImageToMat
+        image = QtGui.QImage(5, 3, QtGui.QImage.Format_RGB888) # 15 bytes of pixels in 16 byte rows
+        for y in range(3):
+            for x in range(5):
+                image.setPixel(x, y, QtGui.qRgb(x * 40, y * 80, 7))
+        self.assertNotEqual(image.bytesPerLine(), image.width() * 3)
+        view = convertQImageToMat(image)
+        self.assertEqual(view.shape, (3, 5, 3))
+        self.assertEqual(view.strides[0], image.bytesPerLine())
+        for y in range(3):
+            for x in range(5):
+                self.assertEqual(tuple(view[y, x]), (x * 40, y * 80, 7))
+    def test_view_of_padded_indexed8(self):
+        from pychetlabeller.qtimage import convertQImageToMat, grayColorTable
+        image = QtGui.QImage(5, 3, QtGui.QImage.Format_Indexed8) # 5 bytes of pixels in 8 byte rows
+        image.setColorTable(grayColorTable())
+        for y in range(3):
+            for x in range(5):
+                image.setPixel(x, y, 10 * y + x)
+        view = convertQImageToMat(image)
+        self.assertEqual(view.shape, (3, 5))
+        self.assertEqual(view.strides[0], image.bytesPerLine())
+        self.assertEqual(view.tolist(), [[10 * y + x for x in range(5)] for y in range(3)])
+    def test_image_of_padded_array(self):
+        from pychetlabeller.qtimage import convertMattoQImage, convertQImageToMat
+        wide = pattern(3, 8)
+        array = wide[:, :5] # rows of 5 pixels, 8 pixels apart
+        image = convertMattoQImage(array)
+        self.assertEqual((image.width(), image.height()), (5, 3))
+        self.assertEqual(image.bytesPerLine(), 8 * 4) # drawn from the array, not copied
+        for y in range(3):
+            for x in range(5):
+                b, g, r, a = bgra(x, y)
+                self.assertEqual(image.pixel(x, y), QtGui.qRgba(r, g, b, a))
+        array[1, 2] = (1, 2, 3, 255)
+        self.assertEqual(image.pixel(2, 1), QtGui.qRgba(3, 2, 1, 255)) # memory is shared
+        self.assertTrue((convertQImageToMat(image) == array).all())
+    def test_copy_drops_padding_of_view(self):
+        from pychetlabeller.qtimage import convertQImageToMat
+        image = QtGui.QImage(5, 3, QtGui.QImage.Format_RGB888)
+        copied = convertQImageToMat(image, copy=True)
+        self.assertTrue(copied.flags.c_contiguous)
+        self.assertEqual(copied.strides[0], 5 * 3)
+
+@unittest.skipIf(QtGui is None, 'PyQt4 is not installed')
+class LifetimeTest(unittest.TestCase):
+    '''either side of a conversion stays valid after the other is dropped and collected'''
+    def test_view_outlives_image(self):
+        from pychetlabeller.qtimage import convertQImageToMat
+        image = QtGui.QImage(64, 48, QtGui.QImage.Format_RGB32)
+        image.fill(0xff102030)
+        image_ref = weakref.ref(image)
+        view = convertQImageToMat(image)
+        part = view[10:20, 5:9]
+        del image
+        churn()
+        self.assertIsNotNone(image_ref()) # held by the view
+        self.assertTrue((view[..., :3] == (0x30, 0x20, 0x10)).all())
+        del view
+        churn()
+        self.assertIsNotNone(image_ref()) # held by the slice
+        self.assertTrue((part[..., :3] == (0x30, 0x20, 0x10)).all())
+        del part
+        gc.collect()
+        self.assertIsNone(image_ref()) # and released with the last view
+    def test_image_outlives_array(self):
+        from pychetlabeller.qtimage import convertMattoQImage
+        array = pattern(48, 64)
+        array_ref = weakref.ref(array)
+        image = convertMattoQImage(array)
+        del array
+        churn()
+        self.assertIsNotNone(array_ref()) # held by the image
+        for x, y in [(0, 0), (63, 0), (17, 23), (63, 47)]:
+            b, g, r, a = bgra(x, y)
+            self.assertEqual(image.pixel(x, y), QtGui.qRgba(r, g, b, a))
+        del image
+        gc.collect()
+        self.assertIsNone(array_ref())
+    def test_copies_do_not_share(self):
+        from pychetlabeller.qtimage import convertMattoQImage, convertQImageToMat
+        array = pattern(4, 4)
+        image = convertMattoQImage(array, copy=True)
+        array[...] = 0
+        b, g, r, a = bgra(1, 1)
+        self.assertEqual(image.pixel(1, 1), QtGui.qRgba(r, g, b, a))
+        copied = convertQImageToMat(image, copy=True)
+        image.fill(0)
+        self.assertEqual(tuple(copied[1, 1]), bgra(1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Hit-testing through the grid index and the columnar store, checked against testing
+every shape - including shapes far larger than a grid cell.
+"""
+
+import unittest
+import numpy as np
+
+from pychetlabeller.spatial import GridIndex
+from pychetlabeller.dataset import LabelDataset, LabelCircle, LabelRectangle
+
+def random_shapes(count, seed=0, size=2000):
+    '''circles and rectangles, one in fifty of them covering most of the image'''
+    rng = np.random.RandomState(seed)
+    shapes = []
+    for i in range(count):
+        scale = size / 2.0 if i % 50 == 0 else 40
+        x, y = rng.uniform(-100, size, 2)
+        if rng.rand() < 0.5:
+            shapes.append(LabelCircle(1, x, y, rng.uniform(1, scale)))
+        else:
+            shapes.append(LabelRectangle(2, x, y, rng.uniform(1, scale), rng.uniform(1, scale)))
+    return shapes
+
+def datasets(shapes):
+    '''(object, columnar) datasets holding the same shapes with the same ids'''
+    result = []
+    for columnar in (False, True):
+        dataset = LabelDataset('image.png', (2000, 2000), columnar=columnar)
+        for datum in shapes:
+            dataset.add(type(datum)(datum.label, *datum.serialize()[1:-1], shape_id=datum.id))
+        result.append(dataset)
+    return result
+
+class GridIndexTest(unittest.TestCase):
+    def test_large_items_stay_out_of_the_grid(self):
+        index = GridIndex(cell_size=10, max_cells=4)
+        index.insert('small', (0, 0, 15, 15))
+        index.insert('large', (0, 0, 1e6, 1e6))
+        self.assertEqual(index.large, set(['large']))
+        self.assertEqual(len(index.cells), 4)
+        self.assertEqual(sorted(index.query_point(5, 5)), ['large', 'small'])
+        self.assertEqual(index.query_point(5e5, 5e5), ['large'])
+        self.assertEqual(sorted(index.query_rect((14, 14, 20, 20))), ['large', 'small'])
+        index.insert('large', (100, 100, 110, 110)) # moved into the grid
+        self.assertEqual(index.large, set())
+        self.assertEqual(index.query_point(5e5, 5e5), [])
+        index.delete('large')
+        index.delete('small')
+        self.assertEqual((len(index), index.cells), (0, {}))
+
+class HitTestTest(unittest.TestCase):
+    def setUp(self):
+        self.shapes = random_shapes(1000)
+        self.objects, self.columnar = datasets(self.shapes)
+        self.rng = np.random.RandomState(1)
+    def ids(self, data):
+        return [datum.id for datum in data]
+    def test_data_at(self):
+        for x, y in self.rng.uniform(-200, 2200, (300, 2)):
+            expected = [datum.id for datum in self.shapes if datum.contains(x, y)]
+            self.assertEqual(self.ids(self.objects.data_at((x, y))), expected)
+            self.assertEqual(self.ids(self.columnar.data_at((x, y))), expected)
+    def test_data_in(self):
+        for x, y, w, h in self.rng.uniform(0, 600, (300, 4)) * (4, 4, 1, 1) - (200, 200, 0, 0):
+            rect = (x, y, x + w, y + h)
+            expected = [datum.id for datum in self.shapes if datum.intersects_rect(rect)]
+            self.assertEqual(self.ids(self.objects.data_in(rect)), expected)
+            self.assertEqual(self.ids(self.columnar.data_in(rect)), expected)
+    def test_after_removal(self):
+        for datum in self.shapes[::3]:
+            self.objects.remove(self.objects.find(datum.id))
+            self.columnar.remove(self.columnar.find(datum.id))
+        kept = [datum for i, datum in enumerate(self.shapes) if i % 3]
+        for x, y in self.rng.uniform(0, 2000, (100, 2)):
+            expected = [datum.id for datum in kept if datum.contains(x, y)]
+            self.assertEqual(self.ids(self.objects.data_at((x, y))), expected)
+            self.assertEqual(self.ids(self.columnar.data_at((x, y))), expected)
+
+if __name__ == '__main__':
+    unittest.main()
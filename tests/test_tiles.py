@@ -0,0 +1,105 @@
+"""
+TiledImage with a format whose reader cannot decode a clip of the image (PNG):
+the file is decoded once and tiles are cropped from it on the worker thread, and
+the full image is dropped once the queued tiles are cut if it does not fit the budget.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    from PyQt4 import QtGui, QtCore
+except ImportError:
+    QtGui = None
+
+@unittest.skipIf(QtGui is None, 'PyQt4 is not installed')
+class TiledImageWithoutClipTest(unittest.TestCase):
+    width, height, tile_size = 1300, 700, 256
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QtGui.QApplication.instance() or QtGui.QApplication([])
+    def setUp(self):
+        from pychetlabeller.qtimage import convertMattoQImage, convertQImageToMat
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'image.png')
+        pixels = np.random.RandomState(0).randint(0, 256, size=(self.height, self.width, 4)).astype(np.uint8)
+        pixels[..., 3] = 255
+        convertMattoQImage(pixels, copy=True).save(self.path)
+        self.pixels = convertQImageToMat(QtGui.QImage(self.path).convertToFormat(QtGui.QImage.Format_RGB32),
+                                         copy=True)
+        # Count every full decode made through QImageReader
+        self.reads = []
+        reads = self.reads
+        self.reader = QtGui.QImageReader
+        class CountingReader(self.reader):
+            def read(self):
+                reads.append(self.clipRect())
+                return QtGui.QImageReader.read(self)
+        QtGui.QImageReader = CountingReader
+    def tearDown(self):
+        QtGui.QImageReader = self.reader
+        shutil.rmtree(self.folder)
+    def tiled(self, **kwargs):
+        from pychetlabeller.tiles import TiledImage
+        tiled = TiledImage(self.path, tile_size=self.tile_size, **kwargs)
+        tiled.clip = False # PNG readers cannot clip - whatever this Qt build reports, test the fallback
+        self.addCleanup(tiled.close)
+        return tiled
+    def test_tiles_are_cropped_from_one_decode(self):
+        from pychetlabeller.qtimage import convertQImageToMat
+        tiled = self.tiled()
+        keys = [(0, col, row) for row in range(3) for col in range(6)]
+        tiled.request(keys)
+        tiled.flush()
+        self.assertEqual(len(self.reads), 1)
+        self.assertIsNotNone(tiled.source) # fits in the budget
+        for key in keys:
+            rect = tiled.tile_rect(*key)
+            tile = convertQImageToMat(tiled.tiles[key])
+            expected = self.pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1]
+            self.assertTrue((tile[..., :3] == expected[..., :3]).all(), key)
+    def test_overview_does_not_keep_the_source(self):
+        tiled = self.tiled()
+        overview = tiled.overview()
+        self.assertEqual(overview.size(), QtCore.QSize(self.width, self.height).scaled(
+            2048, 2048, QtCore.Qt.KeepAspectRatio))
+        self.assertIsNone(tiled.source)
+    def test_source_over_budget_is_dropped(self):
+        tiled = self.tiled(budget_mb=1) # less than the 3.5 MB image
+        tiled.request([(0, 0, 0), (0, 1, 0)])
+        tiled.flush()
+        self.assertIsNone(tiled.source)
+        self.assertEqual(len(tiled.tiles), 2)
+        self.assertEqual(len(self.reads), 1)
+        tiled.request([(0, 2, 0)])
+        tiled.flush()
+        self.assertIsNone(tiled.source)
+        self.assertEqual(len(self.reads), 2)
+    def test_coarser_levels_are_scaled_down(self):
+        tiled = self.tiled()
+        tiled.request([(1, 0, 0), (1, 2, 0), (2, 0, 0)])
+        tiled.flush()
+        self.assertEqual(len(self.reads), 1)
+        self.assertEqual(tiled.tiles[(1, 0, 0)].size(), QtCore.QSize(256, 256))
+        self.assertEqual(tiled.tiles[(1, 2, 0)].size(), QtCore.QSize((self.width - 1024) // 2, 256))
+        self.assertEqual(tiled.tiles[(2, 0, 0)].size(), QtCore.QSize(256, self.height // 4))
+    def test_paint_queues_missing_tiles(self):
+        from pychetlabeller.qtimage import convertQImageToMat
+        tiled = self.tiled()
+        target = QtGui.QImage(self.width, self.height, QtGui.QImage.Format_RGB32)
+        def paint():
+            target.fill(0)
+            painter = QtGui.QPainter(target)
+            tiled.paint(painter, QtCore.QRectF(0, 0, self.width, self.height), 1.0)
+            painter.end()
+            return convertQImageToMat(target)
+        self.assertFalse(paint()[..., :3].any()) # nothing decoded yet - the overview shows
+        tiled.flush()
+        self.assertTrue((paint()[..., :3] == self.pixels[..., :3]).all())
+        self.assertEqual(len(self.reads), 1)
+
+if __name__ == '__main__':
+    unittest.main()